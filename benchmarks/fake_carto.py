@@ -0,0 +1,535 @@
+"""
+Local stand-in for the CARTO SQL, Batch SQL, Import and datasets APIs.
+
+It answers the requests carto_cli sends with generated data, so the real
+commands can be run against it with a fixed latency, row count and payload
+size. Point CARTO_API_URL to the URL it prints on start:
+
+    python benchmarks/fake_carto.py --rows 100000 --latency 0.05
+
+GET /__stats returns the number of requests and bytes sent by endpoint and
+POST /__reset sets them back to zero.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USER = 'bench'
+
+# Hex EWKB of POINT(1 2) in EPSG:4326
+POINT = '0101000020E6100000000000000000F03F0000000000000040'
+
+FIELDS = {
+    'cartodb_id': {'type': 'number', 'pgtype': 'int4'},
+    'the_geom': {'type': 'geometry', 'pgtype': 'geometry'},
+    'name': {'type': 'string', 'pgtype': 'text'},
+    'value': {'type': 'number', 'pgtype': 'float8'},
+    'updated_at': {'type': 'date', 'pgtype': 'timestamptz'},
+}
+
+COLUMN_TYPES = {
+    'cartodb_id': 'integer',
+    'the_geom': 'geometry(Geometry,4326)',
+    'name': 'text',
+    'value': 'double precision',
+    'updated_at': 'timestamp with time zone',
+}
+
+CHUNK_FILTER = re.compile(r'(\w+) >= (-?\d+) and\s+\1 < (-?\d+)')
+DELTA_FILTER = re.compile(r'cartodb_id (>|<=) (\d+)|cartodb_id in \(([\d,]+)\)')
+
+
+class FakeCARTO(object):
+    '''
+    Generated account: `tables` tables named bench, bench_1... with `rows`
+    rows each and ids separated by `id_gap`
+    '''
+
+    def __init__(self, rows=10000, latency=0.0, row_bytes=64, tables=5,
+                 id_gap=1, job_reads=2, import_reads=2):
+        self.rows = rows
+        self.latency = latency
+        self.row_bytes = row_bytes
+        self.tables = ['bench'] + ['bench_{}'.format(i) for i in range(1, tables)]
+        self.id_gap = id_gap
+        self.job_reads = job_reads
+        self.import_reads = import_reads
+        self.jobs = {}
+        self.imports = {}
+        self.copied = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes': 0, 'endpoints': {}}
+
+    def count(self, endpoint, size):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+            counts = self.stats['endpoints'].setdefault(
+                endpoint, {'requests': 0, 'bytes': 0})
+            counts['requests'] += 1
+            counts['bytes'] += size
+
+    @property
+    def max_id(self):
+        return 1 + (self.rows - 1) * self.id_gap
+
+    def ids(self, start=None, end=None):
+        first = 1
+        if start is not None and start > 1:
+            first = 1 + ((start - 1 + self.id_gap - 1) // self.id_gap) * self.id_gap
+        last = self.max_id if end is None else min(self.max_id, end - 1)
+        return range(first, last + 1, self.id_gap)
+
+    def delta_ids(self, query, ids):
+        '''
+        Applies the cartodb_id filters of an incremental download
+        '''
+        for operator, value, values in DELTA_FILTER.findall(query):
+            if values:
+                wanted = set(int(value) for value in values.split(','))
+                ids = [id for id in ids if id in wanted]
+            elif operator == '>':
+                ids = [id for id in ids if id > int(value)]
+            else:
+                ids = [id for id in ids if id <= int(value)]
+        return ids
+
+    def row(self, cartodb_id):
+        name = 'row {} '.format(cartodb_id)
+        return {
+            'cartodb_id': cartodb_id,
+            'the_geom': POINT,
+            'name': (name * (self.row_bytes // len(name) + 1))[:self.row_bytes],
+            'value': cartodb_id / 3.0,
+            'updated_at': '2018-01-01T00:00:00Z',
+        }
+
+    def sql(self, query, format):
+        '''
+        Returns the body and content type of a SQL API response
+        '''
+        lower = ' '.join(query.lower().split())
+        chunk = CHUNK_FILTER.search(query)
+
+        if lower.startswith('explain'):
+            rows = [{'QUERY PLAN': [self.plan(query)]}]
+        elif 'as table_name' in lower:
+            names = re.findall(r"'([^']*)'", re.search(r'in \((.*?)\)', query).group(1))
+            rows = [{'table_name': name, 'attribute': column, 'type': pgtype}
+                    for name in names if name in self.tables
+                    for column, pgtype in COLUMN_TYPES.items()]
+        elif 'n_dead_tup' in lower:
+            rows = [self.health(index, name) for index, name in enumerate(self.tables)]
+        elif 'pg_stat_user_tables' in lower:
+            # The last pattern is the one of the table names
+            patterns = re.findall(r"like '([^']*)'", query)
+            pattern = patterns[-1].replace('%', '.*') if patterns else '.*'
+            rows = [{'name': name, 'relid': index, 'stats_seq_scan': 3,
+                     'stats_live_tup': self.rows, 'stats_dead_tup': 0,
+                     'stats_last_analyze': None, 'stats_last_vacuum': None,
+                     'total_size': self.rows * self.row_bytes}
+                    for index, name in enumerate(self.tables)
+                    if re.fullmatch(pattern, name)]
+        elif 'pg_index ' in lower or 'pg_index,' in lower:
+            rows = [{'index_name': 'bench_pkey', 'column_name': 'cartodb_id',
+                     'index_type': 'btree'}]
+        elif 'pg_trigger' in lower:
+            rows = [{'tgname': 'track_updates'}]
+        elif 'pg_attribute' in lower:
+            rows = [{'attribute': column, 'type': pgtype}
+                    for column, pgtype in COLUMN_TYPES.items()]
+        elif 'as cancelled' in lower:
+            pids = [int(pid) for pid in re.findall(r"\((\d+), '[^']*'::timestamptz\)", query)]
+            rows = [{'pid': pid, 'cancelled': True} for pid in pids]
+        elif 'pg_cancel_backend' in lower:
+            rows = [{'pg_cancel_backend': True}]
+        elif 'pg_stat_activity' in lower:
+            rows = self.activity()
+        elif 'to_regclass' in lower:
+            name = re.search(r"to_regclass\('([^']*)'\)", query).group(1)
+            rows = [{'exists': name in self.tables or name in self.copied}]
+        elif 'pg_indexes' in lower:
+            name = re.search(r"tablename = '([^']*)'", query).group(1)
+            rows = [{'index_name': '{}_pkey'.format(name),
+                     'definition': 'CREATE UNIQUE INDEX {0}_pkey ON public.{0} '
+                                   'USING btree (cartodb_id)'.format(name)},
+                    {'index_name': '{}_name_idx'.format(name),
+                     'definition': 'CREATE INDEX {0}_name_idx ON public.{0} '
+                                   'USING btree (name)'.format(name)}]
+        elif lower.startswith(('create table', 'drop table')):
+            name = re.search(r'table "?(\w+)"?', lower).group(1)
+            with self.lock:
+                if lower.startswith('create'):
+                    self.copied[name] = 0
+                else:
+                    self.copied.pop(name, None)
+            rows = []
+        elif 'count(*)' in lower and re.search(r'from "?(\w+)"?$', lower) and \
+                re.search(r'from "?(\w+)"?$', lower).group(1) in self.copied:
+            rows = [{'count': self.copied[re.search(r'from "?(\w+)"?$', lower).group(1)]}]
+        elif lower.startswith(('vacuum', 'create', 'drop', 'insert', 'update',
+                               'delete', 'alter', 'select cdb_')):
+            rows = []
+        elif 'percentile_disc' in lower:
+            fractions = [float(value) for value in
+                         re.search(r'array\[(.*?)\]', query).group(1).split(',')]
+            ids = self.ids()
+            rows = [{'bounds': [ids[int(fraction * (len(ids) - 1))]
+                                for fraction in fractions]}]
+        elif 'as watermark' in lower:
+            rows = [{'watermark': self.max_id}]
+        elif 'as checksum' in lower:
+            ids = ','.join(str(id) for id in self.ids())
+            rows = [{'count': self.rows,
+                     'checksum': hashlib.md5(ids.encode('utf-8')).hexdigest()}]
+        elif 'min_id' in lower:
+            ids = self.delta_ids(query, self.ids())
+            rows = [{'count': len(ids), 'min_id': min(ids) if ids else None,
+                     'max_id': max(ids) if ids else None}]
+        elif 'count(*)' in lower:
+            rows = [{'count': self.rows}]
+        elif 'limit 0' in lower:
+            return self.json_body({'rows': [], 'time': 0.001,
+                                   'fields': FIELDS, 'total_rows': 0})
+        else:
+            ids = self.ids(int(chunk.group(2)), int(chunk.group(3))) \
+                if chunk else self.ids()
+            return self.table(self.delta_ids(query, ids), format)
+
+        fields = {key: {'type': 'number' if isinstance(value, (int, float))
+                        else 'string'}
+                  for key, value in (rows[0].items() if rows else [])}
+        return self.json_body({'rows': rows, 'time': 0.001, 'fields': fields,
+                               'total_rows': len(rows)})
+
+    def activity(self):
+        '''
+        A few sessions running queries that only differ in their literals
+        '''
+        now = time.time()
+        rows = []
+        for pid in range(100, 106):
+            started = now - random.random() * 60
+            rows.append({
+                'pid': pid,
+                'state': 'active' if pid % 3 else 'idle',
+                'wait_event_type': 'Lock' if pid == 104 else None,
+                'wait_event': 'relation' if pid == 104 else None,
+                'application_name': 'bench',
+                'query_start': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+                'duration': now - started,
+                'query': "select * from bench where cartodb_id = {}".format(pid)
+                         if pid % 2 else "update bench set name = 'x{}'".format(pid),
+            })
+        for pid, job in enumerate(self.jobs.values(), 200):
+            if job['status'] == 'running':
+                rows.append({
+                    'pid': pid, 'state': 'active', 'wait_event_type': None,
+                    'wait_event': None, 'application_name': 'cartodb_batch',
+                    'query_start': job['created_at'], 'duration': 1,
+                    'query': '/* {} */ {}'.format(job['job_id'], job['query']),
+                })
+        return rows
+
+    def health(self, index, name):
+        '''
+        Every other table is bloated and lacks a spatial index
+        '''
+        return {
+            'name': name, 'seq_scan': 100, 'idx_scan': 10 * index,
+            'live_tup': self.rows, 'dead_tup': self.rows // 2 if index % 2 == 0 else 0,
+            'mod_since_analyze': 0, 'last_analyze': '2018-01-01T00:00:00Z',
+            'last_vacuum': None, 'table_size': self.rows * self.row_bytes,
+            'indexes_size': self.rows * 16, 'toast_size': 0,
+            'unused_indexes': [{'name': '{}_name_idx'.format(name), 'size': self.rows * 8}]
+                              if index else [],
+            'missing_spatial_indexes': ['the_geom'] if index % 2 == 0 else [],
+        }
+
+    def plan(self, query):
+        '''
+        Plan of a sequential scan of bench, or an index scan when the query
+        filters by cartodb_id, with some noise in the times
+        '''
+        jitter = 1 + random.random() * 0.2
+        if 'cartodb_id' in query.lower():
+            scan = {'Node Type': 'Index Scan', 'Relation Name': 'bench',
+                    'Index Name': 'bench_pkey', 'Plan Rows': 1, 'Actual Rows': 1}
+        else:
+            scan = {'Node Type': 'Seq Scan', 'Relation Name': 'bench',
+                    'Plan Rows': self.rows // 200, 'Actual Rows': self.rows}
+        scan.update({'Actual Loops': 1, 'Actual Total Time': self.rows * 0.0002 * jitter,
+                     'Shared Hit Blocks': self.rows // 100, 'Shared Read Blocks': 3})
+        root = {'Node Type': 'Aggregate', 'Plan Rows': 1, 'Actual Rows': 1,
+                'Actual Loops': 1, 'Actual Total Time': scan['Actual Total Time'] + 0.5,
+                'Shared Hit Blocks': scan['Shared Hit Blocks'],
+                'Shared Read Blocks': 3, 'Plans': [scan]}
+        return {'Plan': root, 'Planning Time': 0.1 * jitter,
+                'Execution Time': root['Actual Total Time'] + 0.1}
+
+    def json_body(self, value):
+        return json.dumps(value).encode('utf-8'), 'application/json'
+
+    def table(self, ids, format):
+        if format == 'csv':
+            lines = ['cartodb_id,the_geom,name,value,updated_at\n']
+            for cartodb_id in ids:
+                row = self.row(cartodb_id)
+                lines.append('{cartodb_id},{the_geom},{name},{value},{updated_at}\n'.format(**row))
+            return ''.join(lines).encode('utf-8'), 'text/csv'
+
+        if format == 'geojson':
+            features = []
+            for cartodb_id in ids:
+                properties = self.row(cartodb_id)
+                del properties['the_geom']
+                features.append({'type': 'Feature',
+                                 'geometry': {'type': 'Point', 'coordinates': [1, 2]},
+                                 'properties': properties})
+            return self.json_body({'type': 'FeatureCollection',
+                                   'features': features})
+
+        rows = [self.row(cartodb_id) for cartodb_id in ids]
+        return self.json_body({'rows': rows, 'time': 0.001, 'fields': FIELDS,
+                               'total_rows': len(rows)})
+
+    def copy_to(self, query):
+        '''
+        CSV without header of the rows of a COPY TO of a chunk
+        '''
+        chunk = CHUNK_FILTER.search(query)
+        ids = self.ids(int(chunk.group(2)), int(chunk.group(3))) if chunk else self.ids()
+        return self.table(ids, 'csv')[0].split(b'\n', 1)[1]
+
+    def copy_from(self, query, body):
+        name = re.search(r'copy "?(\w+)"?', query.lower()).group(1)
+        rows = body.count(b'\n')
+        with self.lock:
+            self.copied[name] = self.copied.get(name, 0) + rows
+        return {'time': 0.001, 'total_rows': rows}
+
+    def batch(self, method, job_id, params):
+        with self.lock:
+            if method == 'POST':
+                job_id = '00000000-0000-0000-0000-{:012d}'.format(len(self.jobs))
+                self.jobs[job_id] = {
+                    'job_id': job_id, 'user': USER, 'query': params.get('query'),
+                    'status': 'pending', 'reads': 0,
+                    'created_at': '2018-01-01T00:00:00.000Z',
+                    'updated_at': '2018-01-01T00:00:00.000Z'}
+                return 201, self.public_job(self.jobs[job_id])
+
+            job = self.jobs.get(job_id)
+            if job is None:
+                return 404, {'error': ['Job with id {} not found'.format(job_id)]}
+            if method == 'DELETE':
+                job['status'] = 'cancelled'
+            elif job['status'] in ('pending', 'running'):
+                job['reads'] += 1
+                if job['reads'] >= self.job_reads:
+                    job['status'] = 'done'
+                    job['updated_at'] = '2018-01-01T00:00:01.000Z'
+                else:
+                    job['status'] = 'running'
+            return 200, self.public_job(job)
+
+    def public_job(self, job):
+        return {key: value for key, value in job.items() if key != 'reads'}
+
+    def file_import(self, method, import_id):
+        with self.lock:
+            if method == 'POST':
+                import_id = 'import-{}'.format(len(self.imports))
+                self.imports[import_id] = 0
+                return 200, {'item_queue_id': import_id, 'success': True}
+
+            if import_id not in self.imports:
+                return 404, {'errors': 'Not found'}
+            self.imports[import_id] += 1
+            state = 'complete' if self.imports[import_id] >= self.import_reads \
+                else 'importing'
+            return 200, {'id': import_id, 'item_queue_id': import_id,
+                         'state': state, 'success': True,
+                         'table_name': 'imported_{}'.format(import_id)}
+
+    def dataset(self, name):
+        return {
+            'id': name, 'name': name, 'type': 'table', 'likes': 0,
+            'locked': False, 'privacy': 'PRIVATE', 'description': None,
+            'license': None, 'attributions': None, 'tags': [],
+            'table': {'id': name, 'name': name,
+                      'size': self.rows * self.row_bytes,
+                      'row_count': self.rows,
+                      'geometry_types': ['ST_Point']}
+        }
+
+    def datasets(self, params):
+        page = int(params.get('page', 1))
+        per_page = int(params.get('per_page', 20))
+        names = self.tables[(page - 1) * per_page:page * per_page]
+        return {
+            'visualizations': [self.dataset(name) for name in names],
+            'total_entries': len(self.tables),
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                return body
+
+    def read_params(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.read_body()
+        content_type = self.headers.get('Content-Type', '')
+        if content_type == 'application/octet-stream':
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            params['body'] = body
+        elif body and content_type.startswith('application/json'):
+            params.update(json.loads(body.decode('utf-8')))
+        elif body and not content_type.startswith('multipart'):
+            params.update({key: values[0] for key, values in
+                           parse_qs(body.decode('utf-8')).items()})
+        return url.path.rstrip('/'), params
+
+    def reply(self, endpoint, body, code=200, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if endpoint:
+            self.server.fake.count(endpoint, len(body))
+
+    def dispatch(self, method):
+        fake = self.server.fake
+        path, params = self.read_params()
+
+        if path == '/__stats':
+            return self.reply(None, fake.stats)
+        if path == '/__reset':
+            fake.reset()
+            return self.reply(None, fake.stats)
+        if path == '/__rows':
+            # Grows or shrinks the tables
+            fake.rows = int(params['rows'])
+            return self.reply(None, {'rows': fake.rows})
+
+        time.sleep(fake.latency)
+        prefix = '/user/{}'.format(USER)
+        path = path[len(prefix):] if path.startswith(prefix) else path
+
+        if path == '/api/v2/sql':
+            body, content_type = fake.sql(params.get('q', ''), params.get('format'))
+            return self.reply('sql', body, content_type=content_type)
+        if path == '/api/v2/sql/copyto':
+            return self.reply('copyto', fake.copy_to(params['q']), content_type='text/csv')
+        if path == '/api/v2/sql/copyfrom':
+            return self.reply('copyfrom', fake.copy_from(params['q'], params['body']))
+        if path.startswith('/api/v2/sql/job'):
+            code, body = fake.batch(method, path[len('/api/v2/sql/job/'):], params)
+            return self.reply('batch', body, code)
+        if path.startswith('/api/v1/imports'):
+            code, body = fake.file_import(method, path[len('/api/v1/imports/'):])
+            return self.reply('imports', body, code)
+        if path == '/api/v1/viz':
+            return self.reply('datasets', fake.datasets(params))
+        if path.startswith('/api/v1/viz/'):
+            name = path[len('/api/v1/viz/'):]
+            if name not in fake.tables:
+                return self.reply('datasets', {'errors': 'Not found'}, 404)
+            if method == 'DELETE':
+                fake.tables.remove(name)
+                return self.reply('datasets', b'', 204)
+            if method == 'PUT' and params.get('name', name) != name:
+                fake.tables[fake.tables.index(name)] = params['name']
+                return self.reply('datasets', fake.dataset(params['name']))
+            return self.reply('datasets', dict(fake.dataset(name), **params))
+        self.reply('unknown', {'errors': ['Not found: {}'.format(path)]}, 404)
+
+
+def serve(port=0, **options):
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.fake = FakeCARTO(**options)
+    return server
+
+
+def api_url(server):
+    return 'http://127.0.0.1:{}/user/{}/'.format(server.server_address[1], USER)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=0,
+                        help='Port to listen on, a free one by default')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='Rows of every table')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to wait before answering every request')
+    parser.add_argument('--row-bytes', type=int, default=64,
+                        help='Length of the text column of every row')
+    parser.add_argument('--tables', type=int, default=5,
+                        help='Number of tables of the account')
+    parser.add_argument('--id-gap', type=int, default=1,
+                        help='Difference between consecutive cartodb_id values')
+    parser.add_argument('--job-reads', type=int, default=2,
+                        help='Reads of a Batch API job until it is done')
+    parser.add_argument('--import-reads', type=int, default=2,
+                        help='Reads of an import until it is complete')
+    args = vars(parser.parse_args())
+
+    server = serve(**args)
+    print(api_url(server))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Runs the carto_cli commands against the local fake CARTO API and writes the
+wall time, peak memory and number of API requests of every scenario to a
+JSON report.
+
+    python benchmarks/run.py -o report.json
+    python benchmarks/run.py -s download --baseline report.json
+
+Every run is a new process, so the timings include the interpreter start
+and imports, as they do in a shell script.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from urllib.request import urlopen, Request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+SERVER = {'rows': 20000, 'latency': 0.02, 'row_bytes': 64, 'tables': 5}
+
+# name: (module, arguments, extra environment, fake API options)
+SCENARIOS = [
+    ('sql_version', ['carto_cli.carto_sql', 'version'], {}, {}),
+    ('sql_run_json', ['carto_cli.carto_sql', 'run', 'select * from bench'], {}, {}),
+    ('sql_run_csv_file', ['carto_cli.carto_sql', 'run', '-f', 'csv',
+                          '-o', '{tmp}/bench.csv', 'select * from bench'], {}, {}),
+    ('sql_run_ndjson', ['carto_cli.carto_sql', 'run', '-f', 'ndjson',
+                        '-o', '{tmp}/bench.ndjson', 'select * from bench'], {}, {}),
+    ('dataset_list', ['carto_cli.carto_dataset', 'list'], {}, {}),
+    ('dataset_list_cached', ['carto_cli.carto_dataset', 'list'], {}, {'warm': True}),
+    ('dataset_describe', ['carto_cli.carto_dataset', 'describe', 'bench'], {}, {}),
+    ('dataset_describe_many', ['carto_cli.carto_dataset', 'describe',
+                               '-t', 'bench,bench_1,bench_2,bench_3,bench_4'], {}, {}),
+    ('dataset_download', ['carto_cli.carto_dataset', 'download', '-f', 'csv',
+                          '-o', '{tmp}/bench.csv', 'bench'], {}, {}),
+    ('dataset_download_chunked', ['carto_cli.carto_dataset', 'download', '-f', 'csv',
+                                  '-o', '{tmp}/bench.csv', 'bench'],
+     {'CARTO_SPLIT_EXPORT': '5000'}, {}),
+    ('dataset_download_sparse', ['carto_cli.carto_dataset', 'download', '-f', 'csv',
+                                 '-o', '{tmp}/bench.csv', 'bench'],
+     {'CARTO_SPLIT_EXPORT': '5000'}, {'id_gap': 7}),
+    ('batch_create', ['carto_cli.carto_batch', 'create', 'select 1'], {}, {}),
+    ('batch_read', ['carto_cli.carto_batch', 'read',
+                    '00000000-0000-0000-0000-000000000000'], {}, {'job': True}),
+]
+
+
+def start_server(options):
+    '''
+    Starts the fake API in its own process and returns it with its URL
+    '''
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_carto.py')]
+    for key, value in options.items():
+        command += ['--{}'.format(key.replace('_', '-')), str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    return process, process.stdout.readline().strip()
+
+
+def control(url, name, data=None):
+    root = url.split('/user/')[0]
+    request = Request('{}/__{}'.format(root, name), data=data)
+    with urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def run_command(command, env):
+    '''
+    Runs a command and returns its exit code, wall time in seconds and
+    peak resident memory in bytes
+    '''
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=ROOT_DIR,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status) \
+        if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return process.returncode, elapsed, peak, stderr.decode('utf-8', 'replace')
+
+
+def run_scenario(name, arguments, extra_env, options, server, repeat):
+    options = dict(options)
+    warm = options.pop('warm', False)
+    job = options.pop('job', False)
+
+    process, url = start_server(dict(server, **options))
+    tmp_dir = tempfile.mkdtemp(prefix='carto_bench_')
+    try:
+        env = dict(os.environ, CARTO_API_URL=url, CARTO_API_KEY='bench',
+                   CARTO_CACHE_PATH=os.path.join(tmp_dir, 'cache.sqlite'),
+                   PYTHONWARNINGS='ignore', **extra_env)
+        env.pop('CARTO_USER', None)
+        env.pop('CARTO_ORG', None)
+        command = [sys.executable, '-m'] + \
+            [argument.format(tmp=tmp_dir) for argument in arguments]
+
+        if job:
+            control(url, 'reset')
+            run_command([sys.executable, '-m', 'carto_cli.carto_batch',
+                         'create', 'select 1'], env)
+        if warm:
+            run_command(command, env)
+
+        runs = []
+        for _ in range(repeat):
+            control(url, 'reset', b'')
+            code, elapsed, peak, stderr = run_command(command, env)
+            stats = control(url, 'stats')
+            if code != 0:
+                raise Exception('{} failed with code {}: {}'.format(
+                    name, code, stderr.strip()))
+            runs.append({'seconds': elapsed, 'peak_rss': peak,
+                         'requests': stats['requests'], 'bytes': stats['bytes'],
+                         'endpoints': stats['endpoints']})
+            # Chunked downloads leave a state file that would resume them
+            for entry in os.listdir(tmp_dir):
+                if not (warm and entry == 'cache.sqlite'):
+                    os.remove(os.path.join(tmp_dir, entry))
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    seconds = [run['seconds'] for run in runs]
+    return {
+        'name': name,
+        'command': ' '.join(arguments),
+        'env': extra_env,
+        'server': dict(server, **options),
+        'runs': runs,
+        'seconds': {'min': min(seconds), 'median': statistics.median(seconds),
+                    'max': max(seconds)},
+        'peak_rss': max(run['peak_rss'] for run in runs),
+        'requests': runs[-1]['requests'],
+        'bytes': runs[-1]['bytes'],
+    }
+
+
+def compare(results, baseline):
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    lines = []
+    for scenario in results:
+        before = previous.get(scenario['name'])
+        if not before:
+            continue
+        lines.append('{:<28} time {:+7.1%}  memory {:+7.1%}  requests {:+d}'.format(
+            scenario['name'],
+            scenario['seconds']['median'] / before['seconds']['median'] - 1,
+            float(scenario['peak_rss']) / before['peak_rss'] - 1,
+            scenario['requests'] - before['requests']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-o', '--output', help='File to write the JSON report to')
+    parser.add_argument('-s', '--scenario', action='append',
+                        help='Run only the scenarios containing this text')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs of every scenario')
+    parser.add_argument('--rows', type=int, default=SERVER['rows'])
+    parser.add_argument('--latency', type=float, default=SERVER['latency'])
+    parser.add_argument('--row-bytes', type=int, default=SERVER['row_bytes'])
+    parser.add_argument('--baseline', type=argparse.FileType('r'),
+                        help='Previous report to compare the results with')
+    args = parser.parse_args()
+
+    server = dict(SERVER, rows=args.rows, latency=args.latency,
+                  row_bytes=args.row_bytes)
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.scenario or
+                 any(text in scenario[0] for text in args.scenario)]
+
+    results = []
+    for name, arguments, extra_env, options in scenarios:
+        result = run_scenario(name, arguments, extra_env, options, server,
+                              args.repeat)
+        results.append(result)
+        sys.stderr.write('{:<28} {:8.3f}s {:8.1f} MB {:5d} requests\n'.format(
+            name, result['seconds']['median'], result['peak_rss'] / 1048576.0,
+            result['requests']))
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'server': server,
+        'scenarios': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        sys.stderr.write(compare(results, json.load(args.baseline)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
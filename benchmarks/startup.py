@@ -0,0 +1,121 @@
+"""
+Measures the start up time of the commands that never reach the API, like
+`--help`, `version` or `carto_env load`, for the separate entry points and
+the unified `carto_cli` one.
+
+    python benchmarks/startup.py -o startup.json
+    python benchmarks/startup.py --baseline startup.json
+
+The number of imported modules is taken from `python -X importtime`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+CARTORC = '''
+bench:
+  user: bench
+  api_key: bench
+  url: http://127.0.0.1/user/bench/
+'''
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('carto_sql --help', ['-m', 'carto_cli.carto_sql', '--help']),
+    ('carto_sql version', ['-m', 'carto_cli.carto_sql', 'version']),
+    ('carto_sql run --help', ['-m', 'carto_cli.carto_sql', 'run', '--help']),
+    ('carto_dataset --help', ['-m', 'carto_cli.carto_dataset', '--help']),
+    ('carto_dataset version', ['-m', 'carto_cli.carto_dataset', 'version']),
+    ('carto_batch version', ['-m', 'carto_cli.carto_batch', 'version']),
+    ('carto_env load', ['-m', 'carto_cli.carto_env', 'load', 'bench']),
+    ('carto_cli --help', ['-m', 'carto_cli.app', '--help']),
+    ('carto_cli version', ['-m', 'carto_cli.app', 'version']),
+    ('carto_cli sql version', ['-m', 'carto_cli.app', 'sql', 'version']),
+    ('carto_cli env load', ['-m', 'carto_cli.app', 'env', 'load', 'bench']),
+]
+
+
+def measure(arguments, env, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        code = subprocess.call([sys.executable] + arguments, env=env,
+                               cwd=ROOT_DIR, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+        if code != 0:
+            return None
+
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                             env=env, cwd=ROOT_DIR, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE)
+    modules = [line for line in process.stderr.decode('utf-8').splitlines()
+               if line.startswith('import time:') and '|' in line][1:]
+    return {
+        'seconds': {'min': min(seconds), 'median': statistics.median(seconds),
+                    'max': max(seconds)},
+        'modules': len(modules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-o', '--output', help='File to write the JSON report to')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='Runs of every command')
+    parser.add_argument('--baseline', type=argparse.FileType('r'),
+                        help='Previous report to compare the results with')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        baseline = {command['name']: command
+                    for command in json.load(args.baseline)['commands']}
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml') as cartorc:
+        cartorc.write(CARTORC)
+        cartorc.flush()
+        env = dict(os.environ, CARTO_DB=cartorc.name, PYTHONWARNINGS='ignore')
+        env.pop('CARTO_ENV', None)
+
+        results = []
+        for name, arguments in COMMANDS:
+            result = measure(arguments, env, args.repeat)
+            if result is None:
+                sys.stderr.write('{:<24} not available\n'.format(name))
+                continue
+            result['name'] = name
+            results.append(result)
+
+            line = '{:<24} {:7.1f} ms {:5d} modules'.format(
+                name, result['seconds']['median'] * 1000, result['modules'])
+            if name in baseline:
+                line += '  ({:+.1%})'.format(
+                    result['seconds']['median'] /
+                    baseline[name]['seconds']['median'] - 1)
+            sys.stderr.write(line + '\n')
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'commands': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import click
+
+from .carto.version import version
+from .lazy import LazyGroup
+
+
+@click.group(cls=LazyGroup, help='Command line applications to interact with your CARTO account',
+             lazy_commands={
+                 'env': 'carto_cli.carto_env:cli',
+                 'sql': 'carto_cli.carto_sql:cli',
+                 'batch': 'carto_cli.carto_batch:cli',
+                 'dataset': 'carto_cli.carto_dataset:cli',
+                 'serve': 'carto_cli.server:serve',
+             })
+@click.help_option('-h', '--help')
+def cli():
+    pass
+
+cli.add_command(version)
+
+
+if __name__ == '__main__':
+    cli(obj={})
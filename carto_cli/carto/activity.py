@@ -0,0 +1,150 @@
+"""
+Sampling of the queries running on an account.
+
+Samples of pg_stat_activity are kept in a ring buffer so the longest,
+the most frequent and the waiting queries can be reported over time.
+Queries are grouped by a fingerprint that replaces their literals, so the
+same query with different values counts as one.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+
+from collections import deque
+
+from carto_cli.carto import queries
+
+HISTORY_SIZE = int(os.environ.get('CARTO_QUERIES_HISTORY', 1000))
+
+NORMALIZE = [
+    (re.compile(r'--[^\n]*'), ''),
+    (re.compile(r'/\*.*?\*/', re.S), ''),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize(query):
+    '''
+    Returns the query without comments and with its literals replaced
+    '''
+    for pattern, replacement in NORMALIZE:
+        query = pattern.sub(replacement, query or '')
+    return query.strip().lower()
+
+
+def fingerprint(query):
+    return hashlib.sha1(normalize(query).encode('utf-8')).hexdigest()[:12]
+
+
+def is_waiting(row):
+    return row.get('state') == 'active' and bool(row.get('wait_event_type'))
+
+
+class ActivityMonitor(object):
+    '''
+    Keeps the last `size` samples of the running queries of an account
+    '''
+
+    def __init__(self, carto_obj, size=HISTORY_SIZE):
+        self.carto_obj = carto_obj
+        self.samples = deque(maxlen=size)
+
+    def sample(self):
+        rows = self.carto_obj.execute_sql(queries.ACTIVITY_SAMPLE, do_post=True)['rows']
+        sampled_at = time.time()
+        for row in rows:
+            row['fingerprint'] = fingerprint(row.get('query'))
+        sample = {'sampled_at': sampled_at, 'rows': rows}
+        self.samples.append(sample)
+        return sample
+
+    @property
+    def last(self):
+        return self.samples[-1] if self.samples else {'rows': []}
+
+    def longest(self, top):
+        active = [row for row in self.last['rows'] if row.get('state') == 'active']
+        return sorted(active, key=lambda row: row.get('duration') or 0,
+                      reverse=True)[:top]
+
+    def waiting(self, top):
+        waiting = [row for row in self.last['rows'] if is_waiting(row)]
+        return sorted(waiting, key=lambda row: row.get('duration') or 0,
+                      reverse=True)[:top]
+
+    def frequent(self, top):
+        '''
+        Groups the active queries seen in all the samples by fingerprint.
+        An execution is a pid with a query start, so a query seen in many
+        samples counts once.
+        '''
+        groups = {}
+        for sample in self.samples:
+            for row in sample['rows']:
+                if row.get('state') != 'active':
+                    continue
+                group = groups.setdefault(row['fingerprint'], {
+                    'fingerprint': row['fingerprint'],
+                    'query': normalize(row.get('query')),
+                    'executions': set(),
+                    'samples': 0,
+                    'max_duration': 0,
+                    'waiting': 0,
+                })
+                group['executions'].add((row.get('pid'), row.get('query_start')))
+                group['samples'] += 1
+                group['max_duration'] = max(group['max_duration'], row.get('duration') or 0)
+                if is_waiting(row):
+                    group['waiting'] += 1
+
+        for group in groups.values():
+            group['executions'] = len(group['executions'])
+        return sorted(groups.values(),
+                      key=lambda group: (group['executions'], group['samples']),
+                      reverse=True)[:top]
+
+    def export(self, output):
+        '''
+        Writes one JSON line per query and sample
+        '''
+        lines = 0
+        for sample in self.samples:
+            for row in sample['rows']:
+                output.write(json.dumps(dict(row, sampled_at=sample['sampled_at'])) + '\n')
+                lines += 1
+        return lines
+
+
+def select_queries(rows, pattern=None, older_than=None):
+    '''
+    Returns the active queries matching a regular expression and running
+    for longer than some seconds
+    '''
+    regex = re.compile(pattern, re.I) if pattern else None
+    return [row for row in rows
+            if row.get('state') == 'active' and
+            (regex is None or regex.search(row.get('query') or '')) and
+            (older_than is None or (row.get('duration') or 0) > older_than)]
+
+
+def cancel_queries(carto_obj, targets):
+    '''
+    Cancels many queries with one statement, returning the pids that were
+    cancelled. The targets are (pid, query_start) pairs, and a backend is
+    only cancelled while it runs the same query, not one started after the
+    sampled one finished. The query start is compared to the millisecond,
+    the precision of the timestamps of the SQL API.
+    '''
+    if not targets:
+        return []
+    sql = queries.CANCEL_QUERIES.format(targets=','.join(
+        "({}, '{}'::timestamptz)".format(int(pid), str(query_start).replace("'", "''"))
+        for pid, query_start in targets))
+    rows = carto_obj.execute_sql(sql, do_post=True)['rows']
+    return [row['pid'] for row in rows if row['cancelled']]
@@ -0,0 +1,77 @@
+"""
+Operations on many datasets in one invocation.
+
+The names are taken from the arguments, from standard input (one per line,
+like the failures file written by a previous run) or from a glob pattern
+matched against the datasets of the account, which are listed only once.
+The operation runs on every dataset with a bounded thread pool and returns
+one result per name.
+"""
+
+import fnmatch
+import os
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+BULK_WORKERS = int(os.environ.get('CARTO_BULK_WORKERS', 8))
+
+
+def read_names(names, stdin=True):
+    '''
+    The names passed as arguments, or read from standard input when none
+    '''
+    names = [name for name in names if name]
+    if not names and stdin and not sys.stdin.isatty():
+        names = [line.strip() for line in sys.stdin.read().splitlines()]
+    return [name for name in names if name and not name.startswith('#')]
+
+
+def select_names(available, names=None, pattern=None):
+    '''
+    Returns the explicit names plus the available names matching a glob
+    pattern, keeping their order and without repeating them
+    '''
+    selected = []
+    for name in names or []:
+        if name not in selected:
+            selected.append(name)
+    if pattern:
+        for name in sorted(available):
+            if fnmatch.fnmatchcase(name, pattern) and name not in selected:
+                selected.append(name)
+    return selected
+
+
+def apply(names, operation, workers=BULK_WORKERS, callback=None):
+    '''
+    Runs operation(name) for every name, at most `workers` at the same time.
+    Returns a result per name, in the same order, with the value returned by
+    the operation or the error it raised. callback(result) is called when
+    every operation finishes.
+    '''
+    def run(name):
+        start = time.time()
+        try:
+            result = {'name': name, 'status': 'ok', 'result': operation(name)}
+        except Exception as e:
+            result = {'name': name, 'status': 'failed', 'error': str(e)}
+        result['seconds'] = round(time.time() - start, 3)
+        if callback:
+            callback(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return [result for result in executor.map(run, names)]
+
+
+def write_failures(output, results):
+    '''
+    Writes the names that failed one per line, so they can be piped into
+    the same command to retry them
+    '''
+    failed = [result['name'] for result in results if result['status'] == 'failed']
+    for name in failed:
+        output.write(name + '\n')
+    return len(failed)
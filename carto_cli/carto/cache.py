@@ -0,0 +1,135 @@
+"""
+Local cache for the results of catalog queries.
+
+Entries are stored in a SQLite file with the tables they depend on, so any
+command that changes a table can drop them. Entries older than the TTL are
+ignored and the least recently used ones are evicted when the cache grows
+over its maximum size.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from contextlib import contextmanager
+
+CACHE_PATH = os.environ.get('CARTO_CACHE_PATH', os.path.join(
+    os.path.expanduser('~'), '.carto_cli', 'cache.sqlite'))
+CACHE_TTL = int(os.environ.get('CARTO_CACHE_TTL', 300))
+CACHE_MAX_BYTES = int(os.environ.get('CARTO_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Tag for entries that depend on every table of the account, like listings
+ANY_TABLE = '*'
+
+
+class MetadataCache(object):
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute('''
+            create table if not exists entries (
+                key text primary key,
+                value text,
+                tables text,
+                size integer,
+                created real,
+                accessed real
+            )''')
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        '''
+        A connection whose changes are committed if the block succeeds, and
+        that is always closed
+        '''
+        connection = self.connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(
+            '\x00'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        Returns the stored value or None if it is missing or expired
+        '''
+        try:
+            with self.transaction() as connection:
+                row = connection.execute(
+                    'select value from entries where key = ? and created > ?',
+                    (key, time.time() - self.ttl)).fetchone()
+                if row is None:
+                    return None
+                connection.execute(
+                    'update entries set accessed = ? where key = ?',
+                    (time.time(), key))
+                return json.loads(row[0])
+        except (sqlite3.Error, OSError):
+            return None
+
+    def set(self, key, value, tables):
+        try:
+            data = json.dumps(value)
+        except (TypeError, ValueError):
+            return
+
+        tags = ',{},'.format(','.join(tables))
+        now = time.time()
+        try:
+            with self.transaction() as connection:
+                connection.execute(
+                    'insert or replace into entries values (?, ?, ?, ?, ?, ?)',
+                    (key, data, tags, len(data), now, now))
+                self.evict(connection)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def evict(self, connection):
+        connection.execute('delete from entries where created <= ?',
+                           (time.time() - self.ttl,))
+        total = 0
+        rows = connection.execute(
+            'select key, size from entries order by accessed desc')
+        stale = []
+        for key, size in rows:
+            total += size
+            if total > self.max_bytes:
+                stale.append((key,))
+        connection.executemany('delete from entries where key = ?', stale)
+
+    def invalidate(self, table_name=None):
+        '''
+        Drops the entries that depend on a table and the ones that depend on
+        any table. Without a table name only the latter are dropped, and with
+        ANY_TABLE, for changes to tables that are not known, all of them.
+        '''
+        if not os.path.exists(self.path):
+            return
+        try:
+            with self.transaction() as connection:
+                if table_name == ANY_TABLE:
+                    connection.execute('delete from entries')
+                    return
+                connection.execute(
+                    'delete from entries where instr(tables, ?) > 0 or '
+                    'instr(tables, ?) > 0',
+                    (',{},'.format(ANY_TABLE), ',{},'.format(table_name)))
+        except (sqlite3.Error, OSError):
+            pass
@@ -1,43 +1,42 @@
-from carto.exceptions import CartoException
-from carto.sql import SQLClient
-from carto.sql import BatchSQLClient
-from carto.auth import APIKeyAuthClient
-from carto.datasets import DatasetManager
-from carto.sync_tables import SyncTableJobManager
+import os
 
-import warnings
-import requests
-import contextlib
+from carto_cli.carto.cache import MetadataCache
+from carto_cli.carto.columnar import ColumnarResult
+from carto_cli.carto.jsonstream import JSONArrayStream
 
-try:
-    from functools import partialmethod
-except ImportError:
-    # Python 2 fallback: https://gist.github.com/carymrobbins/8940382
-    from functools import partial
+# The carto SDK and requests take most of the start up time, so they are
+# imported the first time an API is used instead of here.
 
-    class partialmethod(partial):
-        def __get__(self, instance, owner):
-            if instance is None:
-                return self
 
-            return partial(self.func, instance, *(self.args or ()), **(self.keywords or {}))
+STREAM_CHUNK_SIZE = int(os.environ.get('CARTO_STREAM_CHUNK_SIZE', 64 * 1024))
 
 
 class CARTOUser(object):
 
     def __init__(self, user_name=None, org_name=None,
-                 api_url=None, api_key=None, check_ssl=True):
+                 api_url=None, api_key=None, check_ssl=True,
+                 use_cache=True, refresh_cache=False):
         self.user_name = user_name
         self.org_name = org_name
         self.api_url = api_url
         self.api_key = api_key
+        self.check_ssl = check_ssl
+        self._session = None
+        self.use_cache = use_cache
+        self.refresh_cache = refresh_cache
+        self.cache = MetadataCache()
 
-        if not check_ssl:
-            old_request = requests.Session.request
-            requests.Session.request = partialmethod(old_request, verify=False)
-            warnings.filterwarnings('ignore', 'Unverified HTTPS request')
+    @property
+    def session(self):
+        if self._session is None:
+            from carto_cli.carto.session import TimedSession
+            self._session = TimedSession(check_ssl=self.check_ssl)
+        return self._session
 
     def initialize(self):
+        from carto.sql import SQLClient, BatchSQLClient, CopySQLClient
+        from carto.auth import APIKeyAuthClient
+
         if not self.api_url and self.user_name:
             self.api_url = "https://{}.carto.com/api/".format(self.user_name)
         elif not self.api_url and not self.user_name:
@@ -46,23 +45,150 @@ class CARTOUser(object):
 
         if self.org_name:
             self.client = APIKeyAuthClient(
-                self.api_url, self.api_key, self.org_name)
+                self.api_url, self.api_key, self.org_name,
+                session=self.session)
         else:
-            self.client = APIKeyAuthClient(self.api_url, self.api_key)
+            self.client = APIKeyAuthClient(self.api_url, self.api_key,
+                                           session=self.session)
 
         self.sql_client = SQLClient(self.client)
         self.batch_client = BatchSQLClient(self.client)
+        self.copy_client = CopySQLClient(self.client)
 
-    def execute_sql(self, query, parse_json=True, format=None, do_post=False):
-        try:
+    def execute_sql(self, query, parse_json=True, format=None, do_post=False,
+                    cache_tables=None, columnar=False):
+        '''
+        Runs a query on the SQL API. Passing the list of tables the result
+        depends on as cache_tables allows it to be served from the local
+        metadata cache. With columnar the JSON result is parsed as it is
+        received into a ColumnarResult, much smaller than the list of rows.
+        '''
+        from carto.exceptions import CartoException
+
+        if columnar and parse_json and not format:
+            if cache_tables is None:
+                return ColumnarResult.from_chunks(self.iter_sql(query))
+            return ColumnarResult.load(self.cached(
+                ('sql', 'columnar', query), cache_tables,
+                lambda: ColumnarResult.from_chunks(self.iter_sql(query)).dump()))
+
+        def send():
             try:
-                self.client
-            except AttributeError:
-                self.initialize()
-            return self.sql_client.send(query, parse_json=parse_json,
-                                        format=format, do_post=do_post)
+                try:
+                    self.client
+                except AttributeError:
+                    self.initialize()
+                return self.sql_client.send(query, parse_json=parse_json,
+                                            format=format, do_post=do_post)
+            except CartoException as e:
+                raise Exception(e.args[0].args[0][0])
+
+        if cache_tables is None or not parse_json:
+            return send()
+        return self.cached(('sql', format, query), cache_tables, send)
+
+    def cached(self, name, tables, fetch):
+        '''
+        Returns the cached value for this account and name, or stores the
+        result of fetch() tagged with the tables it depends on
+        '''
+        if not self.use_cache:
+            return fetch()
+
+        key = self.cache.key(self.user_name, self.org_name, self.api_url,
+                             self.api_key, name)
+        if not self.refresh_cache:
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+
+        value = fetch()
+        self.cache.set(key, value, tables)
+        return value
+
+    def invalidate_cache(self, table_name=None):
+        self.cache.invalidate(table_name)
+
+    def iter_sql(self, query, format=None, chunk_size=STREAM_CHUNK_SIZE):
+        '''
+        Runs a query and yields the raw response body in chunks as it is
+        received
+        '''
+        from carto.exceptions import CartoException
+
+        try:
+            self.client
+        except AttributeError:
+            self.initialize()
+
+        params = {'q': query}
+        if format:
+            params['format'] = format
+
+        try:
+            response = self.client.send(self.sql_client.api_url, 'POST',
+                                        data=params, stream=True)
         except CartoException as e:
-            raise Exception(e.args[0].args[0][0])
+            raise Exception(e.args[0])
+
+        try:
+            if response.status_code >= 400:
+                try:
+                    self.client.get_response_data(response)
+                except Exception as e:
+                    message = e.args[0]
+                    raise Exception(message[0] if isinstance(message, list) else message)
+
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+    def iter_rows(self, query, chunk_size=STREAM_CHUNK_SIZE):
+        '''
+        Runs a query and yields its rows as they are received, without
+        parsing the whole response first
+        '''
+        return JSONArrayStream(self.iter_sql(query, chunk_size=chunk_size))
+
+    def stream_sql(self, query, output, format=None, chunk_size=STREAM_CHUNK_SIZE):
+        '''
+        Runs a query writing the raw response body into the output file as
+        it is received, so the result is never held in memory. Returns the
+        number of bytes written.
+        '''
+        written = 0
+        for chunk in self.iter_sql(query, format=format, chunk_size=chunk_size):
+            output.write(chunk)
+            written += len(chunk)
+        return written
+
+    def copy_to(self, query, chunk_size=STREAM_CHUNK_SIZE):
+        '''
+        Runs a COPY ... TO STDOUT query and yields the data in chunks as it
+        is received
+        '''
+        try:
+            self.copy_client
+        except AttributeError:
+            self.initialize()
+        response = self.copy_client.copyto(query)
+        try:
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+    def copy_from(self, query, chunks):
+        '''
+        Runs a COPY ... FROM STDIN query sending the chunks of an iterable
+        as the data, returns the response with the number of rows loaded
+        '''
+        try:
+            self.copy_client
+        except AttributeError:
+            self.initialize()
+        return self.copy_client.copyfrom(query, chunks)
 
     def batch_check(self,job_id):
         try:
@@ -87,26 +213,57 @@ class CARTOUser(object):
 
     def get_dataset_manager(self):
         try:
-            self.sql_client
+            return self.dataset_manager
         except AttributeError:
-            self.initialize()
-        return DatasetManager(self.client)
+            pass
+        from carto.datasets import DatasetManager
 
+        try:
+            self.client
+        except AttributeError:
+            self.initialize()
+        self.dataset_manager = DatasetManager(self.client)
+        return self.dataset_manager
 
     def get_sync_manager(self):
         try:
-            self.sql_client
+            return self.sync_manager
+        except AttributeError:
+            pass
+        from carto.sync_tables import SyncTableJobManager
+
+        try:
+            self.client
         except AttributeError:
             self.initialize()
-        return SyncTableJobManager(self.client)
+        self.sync_manager = SyncTableJobManager(self.client)
+        return self.sync_manager
+
+    @property
+    def timings(self):
+        return self._session.timings if self._session else []
+
+    def reset_timings(self):
+        if self._session:
+            self._session.timings = []
+
+    def import_file(self, archive):
+        '''
+        Starts an Import API job for a URL, a local path or a file object
+        and returns it without waiting for the import to finish
+        '''
+        from carto.file_import import FileImportJobManager
 
-    def upload(self,uri,sync_time=None):
         try:
-            self.sql_client
+            self.client
         except AttributeError:
             self.initialize()
+        job = FileImportJobManager(self.client).create(archive)
+        job.run()
+        return job
 
-        dataset_manager = DatasetManager(self.client)
+    def upload(self,uri,sync_time=None):
+        dataset_manager = self.get_dataset_manager()
 
         if sync_time:
             return dataset_manager.create(uri, sync_time)
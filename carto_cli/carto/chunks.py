@@ -0,0 +1,171 @@
+"""
+Keyset chunking of big tables.
+
+Tables are split in windows of ids (``cartodb_id`` by default) so every chunk
+is an index range scan instead of an ``OFFSET`` that discards all the
+previous rows. Chunks are fetched concurrently and their state is kept in a
+small JSON file so a failed export can be resumed.
+"""
+
+import json
+import math
+import os
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from carto_cli.carto import queries
+from carto_cli.carto import convert
+from carto_cli.carto.jsonstream import JSONArrayStream, raise_for_error
+
+# When the id span is this many times bigger than the row count the ids are
+# considered too sparse for evenly sized windows and percentiles are used
+SPARSE_RATIO = 2
+
+# Formats sent as a JSON object, and the member holding their items, that
+# end with an error member when the query fails halfway through
+JSON_FORMATS = {'json': 'rows', 'geojson': 'features'}
+
+
+def plan_chunks(carto_obj, table_name, chunk_size, id_column='cartodb_id'):
+    '''
+    Returns the number of rows of the table and a list of (start, end) id
+    windows, end excluded, holding around chunk_size rows each
+    '''
+    sql = queries.ID_RANGE.format(table_name=table_name, id_column=id_column)
+    row = carto_obj.execute_sql(sql)['rows'][0]
+    count = int(row['count'])
+    if not count:
+        return count, []
+
+    min_id = int(row['min_id'])
+    max_id = int(row['max_id'])
+    windows = int(math.ceil(count / float(chunk_size)))
+    span = max_id - min_id + 1
+
+    if windows > 1 and span > count * SPARSE_RATIO:
+        fractions = ','.join(
+            str(float(i) / windows) for i in range(1, windows))
+        sql = queries.ID_PERCENTILES.format(table_name=table_name,
+                                            id_column=id_column,
+                                            fractions=fractions)
+        bounds = carto_obj.execute_sql(sql, do_post=True)['rows'][0]['bounds']
+        bounds = [int(bound) for bound in bounds]
+    else:
+        step = int(math.ceil(span / float(windows)))
+        bounds = range(min_id + step, max_id + 1, step)
+
+    edges = [min_id] + sorted(set(bounds)) + [max_id + 1]
+    return count, [(edges[i], edges[i + 1]) for i in range(len(edges) - 1)
+                   if edges[i] < edges[i + 1]]
+
+
+def chunk_query(table_name, start, end, id_column='cartodb_id', columns='*'):
+    return queries.CHUNK.format(table_name=table_name, id_column=id_column,
+                                columns=columns, start=start, end=end)
+
+
+def state_path(base):
+    return '{}.chunks.json'.format(base)
+
+
+def load_state(base):
+    try:
+        with open(state_path(base)) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return None
+
+
+def save_state(base, state):
+    tmp_path = state_path(base) + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_path, state_path(base))
+
+
+def new_state(table_name, format, count, windows, base, ext,
+              id_column='cartodb_id', columns='*'):
+    return {
+        'table_name': table_name,
+        'format': format,
+        'count': count,
+        'id_column': id_column,
+        'columns': columns,
+        'chunks': [
+            {
+                'index': index,
+                'start': start,
+                'end': end,
+                'path': '{}_{}{}'.format(base, index, ext),
+                'done': False
+            } for index, (start, end) in enumerate(windows, 1)
+        ]
+    }
+
+
+def pending_chunks(state):
+    return [chunk for chunk in state['chunks']
+            if not (chunk['done'] and os.path.exists(chunk['path']))]
+
+
+def stream_json(carto_obj, sql, output, format):
+    '''
+    Streams a JSON response into the output file, raising the error found
+    after its items instead of leaving a truncated chunk
+    '''
+    def written():
+        for data in carto_obj.iter_sql(sql, format=format):
+            output.write(data)
+            yield data
+
+    stream = JSONArrayStream(written(), JSON_FORMATS[format])
+    for _ in stream:
+        pass
+    raise_for_error(stream.tail)
+
+
+def fetch_chunk(carto_obj, state, chunk):
+    '''
+    Streams one chunk into a temporary file that is only moved to its
+    final path once it is complete
+    '''
+    sql = chunk_query(state['table_name'], chunk['start'], chunk['end'],
+                      id_column=state['id_column'],
+                      columns=state.get('columns', '*'))
+    tmp_path = chunk['path'] + '.part'
+    with open(tmp_path, 'wb') as chunk_file:
+        if state['format'] in convert.CONVERT_FORMATS:
+            convert.convert_sql(carto_obj, sql, chunk_file, state['format'])
+        elif state['format'] in JSON_FORMATS:
+            stream_json(carto_obj, sql, chunk_file, state['format'])
+        else:
+            carto_obj.stream_sql(sql, chunk_file, format=state['format'])
+    os.replace(tmp_path, chunk['path'])
+    return chunk
+
+
+def export_chunks(carto_obj, state, base, workers, callback=None):
+    '''
+    Fetches all the pending chunks of a state with a pool of workers,
+    saving the state after every finished chunk. Returns the list of
+    (chunk, exception) pairs that failed.
+    '''
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_chunk, carto_obj, state, chunk): chunk
+            for chunk in pending_chunks(state)
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                future.result()
+                chunk['done'] = True
+                save_state(base, state)
+                error = None
+            except Exception as e:
+                failures.append((chunk, e))
+                error = e
+            if callback:
+                callback(chunk, error)
+    return failures
@@ -0,0 +1,258 @@
+"""
+Columnar storage of SQL API results.
+
+A JSON result keeps a dictionary per row, repeating the name of every column
+in all of them. ColumnarResult parses the response as it is received and
+keeps a typed array per column instead: integers, floats and booleans in
+arrays of machine values, geometries as the bytes of their WKB and the rest
+as lists of values. Its rows are views that read the columns on access, so
+the code written for the list of dictionaries works with it unchanged.
+"""
+
+import binascii
+
+from array import array
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+from carto_cli.carto.jsonstream import JSONArrayStream
+
+INT64 = (-2 ** 63, 2 ** 63 - 1)
+
+# Largest integer a double keeps exactly
+EXACT_FLOAT = 2 ** 53
+
+TYPECODES = {'int': 'q', 'float': 'd', 'bool': 'b'}
+
+
+class Column(object):
+    '''
+    Values of a column, kept in an array of the type of the first ones
+    until a value of another type turns it into a list. The integers of a
+    column of floats, as the SQL API sends 3.0 as 3, are flagged in ints
+    so they are read back as integers.
+    '''
+
+    def __init__(self, length=0):
+        self.kind = None
+        self.values = []
+        self.nulls = None
+        self.ints = None
+        self.upper = False
+        for _ in range(length):
+            self.append(None)
+
+    def typed(self, value):
+        if isinstance(value, bool):
+            return 'bool'
+        if isinstance(value, int) and INT64[0] <= value <= INT64[1]:
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        return 'object'
+
+    def convert(self, kind):
+        if kind == 'object':
+            self.values = [self[index] for index in range(len(self.values))]
+            self.nulls = self.ints = None
+        elif kind == 'float' and self.kind == 'int':
+            self.ints = bytearray([1]) * len(self.values)
+            self.values = array('d', self.values)
+        else:
+            self.values = array(TYPECODES[kind], self.values)
+        self.kind = kind
+
+    def append(self, value):
+        if value is None and self.kind != 'object':
+            if self.nulls is None:
+                self.nulls = bytearray(len(self.values))
+            self.nulls.append(1)
+            self.values.append(0)
+            if self.ints is not None:
+                self.ints.append(0)
+            return
+
+        kind = self.typed(value)
+        if self.kind is None:
+            self.convert(kind)
+        elif kind != self.kind and self.kind != 'object':
+            numbers = {kind, self.kind} == {'int', 'float'}
+            if numbers and self.kind == 'int' and \
+                    all(abs(number) <= EXACT_FLOAT for number in self.values):
+                self.convert('float')
+            elif not (numbers and self.kind == 'float' and abs(value) <= EXACT_FLOAT):
+                self.convert('object')
+
+        if self.nulls is not None:
+            self.nulls.append(0)
+        if self.kind == 'float':
+            if self.ints is None and kind == 'int':
+                self.ints = bytearray(len(self.values))
+            if self.ints is not None:
+                self.ints.append(kind == 'int')
+        self.values.append(value)
+
+    def pack_geometries(self):
+        '''
+        Keeps the hexadecimal WKB of a geometry column as bytes, half its size
+        '''
+        if self.kind != 'object':
+            return
+        texts = [value for value in self.values if value is not None]
+        if not all(isinstance(value, str) for value in texts):
+            return
+        if all(value == value.upper() for value in texts):
+            self.upper = True
+        elif not all(value == value.lower() for value in texts):
+            return
+        try:
+            self.values = [None if value is None else binascii.unhexlify(value)
+                           for value in self.values]
+        except (binascii.Error, TypeError, ValueError):
+            return
+        self.kind = 'geometry'
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        value = self.values[index]
+        if self.kind == 'bool':
+            return bool(value)
+        if self.ints is not None and self.ints[index]:
+            return int(value)
+        if self.kind == 'geometry' and value is not None:
+            value = binascii.hexlify(value).decode('ascii')
+            return value.upper() if self.upper else value
+        return value
+
+
+class Row(Mapping):
+    '''
+    Read only view of a row of a ColumnarResult
+    '''
+
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.columns[key][self.index]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Rows(Sequence):
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self.columns, position)
+                    for position in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('row index out of range')
+        return Row(self.columns, index)
+
+
+class ColumnarResult(Mapping):
+    '''
+    SQL API result with its rows stored by column. It is read like the
+    dictionary of the JSON response: result['rows'], result['fields'],
+    result['time'] and result['total_rows'].
+    '''
+
+    def __init__(self):
+        self.columns = {}
+        self.length = 0
+        self.tail = {}
+
+    def add_row(self, row):
+        for key in row:
+            if key not in self.columns:
+                self.columns[key] = Column(self.length)
+        for key, column in self.columns.items():
+            column.append(row.get(key))
+        self.length += 1
+
+    def finish(self, tail):
+        self.tail = tail
+        for name, field in (tail.get('fields') or {}).items():
+            if field.get('type') == 'geometry' and name in self.columns:
+                self.columns[name].pack_geometries()
+        return self
+
+    @classmethod
+    def from_rows(cls, rows, tail=None):
+        result = cls()
+        for row in rows:
+            result.add_row(row)
+        return result.finish(tail or {})
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        '''
+        Parses a JSON response received as a sequence of byte chunks
+        '''
+        stream = JSONArrayStream(chunks)
+        result = cls()
+        for row in stream:
+            result.add_row(row)
+        return result.finish(stream.tail)
+
+    def dump(self):
+        '''
+        Plain columns of the result that load() turns back into one, to
+        store it in the metadata cache
+        '''
+        return dict(self.tail, columns={
+            name: [column[index] for index in range(self.length)]
+            for name, column in self.columns.items()
+        }, length=self.length)
+
+    @classmethod
+    def load(cls, data):
+        data = dict(data)
+        columns = data.pop('columns')
+        length = data.pop('length')
+        result = cls()
+        for name, values in columns.items():
+            column = result.columns[name] = Column()
+            for value in values:
+                column.append(value)
+        result.length = length
+        return result.finish(data)
+
+    def __getitem__(self, key):
+        if key == 'rows':
+            return Rows(self.columns, self.length)
+        return self.tail[key]
+
+    def __iter__(self):
+        yield 'rows'
+        for key in self.tail:
+            yield key
+
+    def __len__(self):
+        return len(self.tail) + 1
@@ -0,0 +1,169 @@
+"""
+Client side conversion of SQL API results into formats the API does not
+produce.
+
+The JSON (or GeoJSON) response is parsed row by row while it arrives, so
+only one batch of rows is kept in memory. Columnar formats need pyarrow,
+which is only imported when they are used, and take their column types
+from the `fields` the SQL API returns for the query.
+"""
+
+import json
+import os
+
+from carto_cli.carto import queries
+from carto_cli.carto.jsonstream import JSONArrayStream, raise_for_error
+
+CONVERT_BATCH_ROWS = int(os.environ.get('CARTO_CONVERT_BATCH_ROWS', 10000))
+
+# Output format: (SQL API format requested, member holding the items)
+CONVERT_FORMATS = {
+    'ndjson': ('json', 'rows'),
+    'geojsonseq': ('geojson', 'features'),
+    'parquet': ('json', 'rows'),
+    'arrow': ('json', 'rows'),
+}
+
+# Formats that can not be written to a terminal or a pipe
+BINARY_FORMATS = ('parquet', 'arrow')
+
+# RFC 8142 record separator
+RECORD_SEPARATOR = b'\x1e'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception('The parquet and arrow formats need pyarrow, '
+                        'install it with: pip install pyarrow')
+    return pyarrow
+
+
+def iter_items(carto_obj, sql, format):
+    '''
+    Yields the rows or features of a query, raising the error the SQL API
+    sends after them if the query fails halfway through
+    '''
+    api_format, key = CONVERT_FORMATS[format]
+    stream = JSONArrayStream(carto_obj.iter_sql(sql, format=api_format), key)
+    for item in stream:
+        yield item
+    raise_for_error(stream.tail)
+
+
+def write_ndjson(carto_obj, sql, output):
+    count = 0
+    for row in iter_items(carto_obj, sql, 'ndjson'):
+        output.write(json.dumps(row).encode('utf-8') + b'\n')
+        count += 1
+    return count
+
+
+def write_geojsonseq(carto_obj, sql, output):
+    count = 0
+    for feature in iter_items(carto_obj, sql, 'geojsonseq'):
+        output.write(RECORD_SEPARATOR + json.dumps(feature).encode('utf-8') + b'\n')
+        count += 1
+    return count
+
+
+def result_fields(carto_obj, sql):
+    '''
+    Returns the fields metadata of a query without fetching any row
+    '''
+    probe = queries.RESULT_FIELDS.format(sql=sql.strip().rstrip(';'))
+    return carto_obj.execute_sql(probe, do_post=True)['fields']
+
+
+def arrow_type(pa, field):
+    '''
+    Maps the SQL API type of a field to an Arrow type, anything unknown
+    is kept as a string
+    '''
+    pgtype = field.get('pgtype', '')
+    kind = field.get('type')
+    if pgtype in ('int2', 'int4', 'int8') or \
+            (kind == 'number' and pgtype.startswith('int')):
+        return pa.int64()
+    if kind == 'number':
+        return pa.float64()
+    if kind == 'boolean':
+        return pa.bool_()
+    if kind == 'date':
+        return pa.timestamp('us', tz='UTC')
+    if kind == 'geometry' or pgtype in ('geometry', 'geography'):
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(pa, fields):
+    return pa.schema([pa.field(name, arrow_type(pa, field))
+                      for name, field in fields.items()])
+
+
+def arrow_column(pa, values, arrow_field):
+    if arrow_field.type == pa.binary():
+        # Geometries are sent as hex encoded WKB
+        values = [bytes.fromhex(value) if value is not None else None
+                  for value in values]
+    elif pa.types.is_timestamp(arrow_field.type):
+        return pa.array(values, type=pa.string()).cast(arrow_field.type)
+    elif arrow_field.type == pa.string():
+        values = [value if value is None or isinstance(value, str)
+                  else json.dumps(value) for value in values]
+    return pa.array(values, type=arrow_field.type)
+
+
+def record_batch(pa, schema, rows):
+    columns = [arrow_column(pa, [row.get(field.name) for row in rows], field)
+               for field in schema]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def write_columnar(carto_obj, sql, output, format):
+    '''
+    Writes the result of a query as an Arrow IPC or a Parquet file, in
+    batches of CONVERT_BATCH_ROWS rows
+    '''
+    pa = import_pyarrow()
+    schema = arrow_schema(pa, result_fields(carto_obj, sql))
+
+    if format == 'parquet':
+        writer = pa.parquet.ParquetWriter(output, schema)
+        write = writer.write_table
+        make = lambda rows: pa.Table.from_batches([record_batch(pa, schema, rows)])
+    else:
+        writer = pa.ipc.new_file(output, schema)
+        write = writer.write_batch
+        make = lambda rows: record_batch(pa, schema, rows)
+
+    count = 0
+    rows = []
+    try:
+        for row in iter_items(carto_obj, sql, format):
+            rows.append(row)
+            if len(rows) >= CONVERT_BATCH_ROWS:
+                write(make(rows))
+                count += len(rows)
+                rows = []
+        if rows:
+            write(make(rows))
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def convert_sql(carto_obj, sql, output, format):
+    '''
+    Runs a query writing its result into the output file in one of the
+    CONVERT_FORMATS. Returns the number of rows written.
+    '''
+    if format == 'ndjson':
+        return write_ndjson(carto_obj, sql, output)
+    if format == 'geojsonseq':
+        return write_geojsonseq(carto_obj, sql, output)
+    return write_columnar(carto_obj, sql, output, format)
@@ -0,0 +1,155 @@
+"""
+Export of all the tables of an account into a directory.
+
+Tables are exported by a pool of workers, and the big ones in keyset chunks
+fetched concurrently into a directory named after the table. A manifest with
+the rows, the files, their sizes and checksums and the time spent on every
+table is saved as soon as a table is finished, so an interrupted dump is
+resumed skipping the tables already in the manifest, and the chunks already
+fetched of the unfinished ones.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from carto_cli.carto import chunks
+from carto_cli.carto import convert
+
+DUMP_WORKERS = int(os.environ.get('CARTO_DUMP_WORKERS', 4))
+
+MANIFEST = 'manifest.json'
+
+EXTENSIONS = {'gpkg': '.gpkg', 'csv': '.csv', 'shp': '.zip', 'geojson': '.geojson',
+              'ndjson': '.ndjson', 'geojsonseq': '.geojsons', 'parquet': '.parquet',
+              'arrow': '.arrow'}
+
+
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST)
+
+
+def load_manifest(directory):
+    try:
+        with open(manifest_path(directory)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+
+
+def save_manifest(directory, manifest):
+    tmp_path = manifest_path(directory) + '.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path(directory))
+
+
+def file_details(directory, path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as dumped:
+        for block in iter(lambda: dumped.read(1024 * 1024), b''):
+            digest.update(block)
+    return {'path': os.path.relpath(path, directory),
+            'bytes': os.path.getsize(path),
+            'sha256': digest.hexdigest()}
+
+
+def is_dumped(directory, manifest, table_name):
+    entry = manifest['tables'].get(table_name)
+    return entry is not None and all(
+        os.path.exists(os.path.join(directory, item['path'])) for item in entry['files'])
+
+
+def export_query(carto_obj, sql, path, format):
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as output:
+        if format in convert.CONVERT_FORMATS:
+            convert.convert_sql(carto_obj, sql, output, format)
+        else:
+            carto_obj.stream_sql(sql, output, format=format)
+    os.replace(tmp_path, path)
+
+
+def dump_table(carto_obj, table_name, directory, format, chunk_rows, chunk_workers):
+    '''
+    Exports a table into one file, or into a file per chunk when it has more
+    than chunk_rows rows, and returns its manifest entry
+    '''
+    start = time.time()
+    ext = EXTENSIONS[format]
+    # The chunks go to a directory of their own so they never clash with
+    # the file of another table, like bench_1 for the first chunk of bench
+    base = os.path.join(directory, table_name, table_name)
+
+    state = chunks.load_state(base)
+    if state is None:
+        try:
+            count, windows = chunks.plan_chunks(carto_obj, table_name, chunk_rows)
+        except Exception:
+            # Tables without cartodb_id are exported at once
+            count, windows = None, []
+        if len(windows) > 1:
+            if not os.path.isdir(os.path.dirname(base)):
+                os.makedirs(os.path.dirname(base))
+            state = chunks.new_state(table_name, format, count, windows, base, ext)
+            chunks.save_state(base, state)
+
+    if state:
+        failures = chunks.export_chunks(carto_obj, state, base, chunk_workers)
+        if failures:
+            raise Exception('{} of {} chunks failed: {}'.format(
+                len(failures), len(state['chunks']), failures[0][1]))
+        os.remove(chunks.state_path(base))
+        count = state['count']
+        paths = [chunk['path'] for chunk in state['chunks']]
+    else:
+        paths = [os.path.join(directory, table_name + ext)]
+        export_query(carto_obj, 'select * from {}'.format(table_name), paths[0], format)
+
+    return {'rows': count,
+            'files': [file_details(directory, path) for path in paths],
+            'seconds': round(time.time() - start, 1),
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+def dump(carto_obj, table_names, directory, format, workers=DUMP_WORKERS,
+         chunk_rows=500000, chunk_workers=2, callback=None):
+    '''
+    Exports the tables missing from the manifest of the directory. Returns
+    the manifest and the errors of the tables that failed by table name.
+    callback(table_name, entry, error) is called when every table finishes.
+    '''
+    manifest = load_manifest(directory)
+    if manifest and manifest.get('format') != format:
+        raise Exception('{} has a dump in {} format'.format(directory, manifest.get('format')))
+    if manifest is None:
+        manifest = {'user_name': carto_obj.user_name, 'format': format,
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'tables': {}}
+    pending = [name for name in table_names if not is_dumped(directory, manifest, name)]
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            executor.submit(dump_table, carto_obj, name, directory, format,
+                            chunk_rows, chunk_workers): name
+            for name in pending
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                entry = future.result()
+                error = None
+                manifest['tables'][name] = entry
+                save_manifest(directory, manifest)
+            except Exception as e:
+                entry = None
+                error = errors[name] = e
+            if callback:
+                callback(name, entry, error)
+
+    save_manifest(directory, manifest)
+    return manifest, errors
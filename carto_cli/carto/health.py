@@ -0,0 +1,96 @@
+"""
+Health report of all the tables of an account.
+
+Every table gets a list of issues (bloat, stale statistics, sequential
+scans, unused and missing spatial indexes) and a score that estimates the
+payoff of fixing them: the megabytes that stop being read or written on
+every scan or update, so big tables with small problems can rank above
+small tables with big ones.
+"""
+
+import json
+import os
+
+from carto_cli.carto import queries
+
+# Share of dead rows of a table to flag it as bloated
+BLOAT_RATIO = float(os.environ.get('CARTO_HEALTH_BLOAT_RATIO', 0.2))
+# Share of rows modified since the last analyze to flag stale statistics
+STALE_RATIO = float(os.environ.get('CARTO_HEALTH_STALE_RATIO', 0.1))
+# Tables with less rows are never flagged, a sequential scan is cheap on them
+MIN_ROWS = int(os.environ.get('CARTO_HEALTH_MIN_ROWS', 10000))
+
+MEGABYTE = 1024.0 * 1024
+
+
+def table_health(carto_obj, filter=None):
+    '''
+    Statistics, sizes and indexes of every table in a single catalog query
+    '''
+    schema_name = carto_obj.user_name if carto_obj.org_name else 'public'
+    sql = queries.TABLE_HEALTH.format(schema_name=schema_name,
+                                      table_name='%{}%'.format(filter or ''))
+    return carto_obj.execute_sql(sql, do_post=True)['rows']
+
+
+def json_column(value):
+    return json.loads(value) if isinstance(value, str) else value or []
+
+
+def diagnose(row):
+    '''
+    Adds the issues, score and fixing statements of a table to its row
+    '''
+    row['unused_indexes'] = json_column(row['unused_indexes'])
+    row['missing_spatial_indexes'] = json_column(row['missing_spatial_indexes'])
+    live = row['live_tup'] or 0
+    dead = row['dead_tup'] or 0
+    size = (row['table_size'] or 0) / MEGABYTE
+    issues = []
+    statements = []
+    score = 0.0
+    vacuum = False
+
+    if live + dead >= MIN_ROWS:
+        dead_ratio = float(dead) / (live + dead)
+        if dead_ratio >= BLOAT_RATIO:
+            issues.append('{:.0%} dead rows'.format(dead_ratio))
+            score += size * dead_ratio
+            vacuum = True
+
+        stale_ratio = float(row['mod_since_analyze'] or 0) / max(live, 1)
+        if not row['last_analyze'] or stale_ratio >= STALE_RATIO:
+            issues.append('stale statistics' if row['last_analyze'] else 'never analyzed')
+            score += size * min(stale_ratio, 1) if row['last_analyze'] else size
+            vacuum = True
+
+        scans = (row['seq_scan'] or 0) + row['idx_scan']
+        seq_ratio = float(row['seq_scan'] or 0) / scans if scans else 0
+        if seq_ratio > 0.5:
+            issues.append('{:.0%} sequential scans'.format(seq_ratio))
+            score += size * seq_ratio
+
+        for column in row['missing_spatial_indexes']:
+            issues.append('no spatial index on {}'.format(column))
+            statements.append('CREATE INDEX ON {} USING GIST ({})'.format(row['name'], column))
+            score += size
+
+    for index in row['unused_indexes']:
+        issues.append('unused index {}'.format(index['name']))
+        # Unused indexes only slow down the writes
+        score += index['size'] / MEGABYTE * 0.5
+
+    if vacuum:
+        statements.insert(0, 'VACUUM ANALYZE {}'.format(row['name']))
+
+    row.update({'issues': issues, 'statements': statements, 'score': round(score, 2)})
+    return row
+
+
+def rank(rows):
+    '''
+    Tables with issues, the biggest expected payoff first
+    '''
+    rows = [diagnose(row) for row in rows]
+    return sorted([row for row in rows if row['issues']],
+                  key=lambda row: (row['score'], row['table_size'] or 0), reverse=True)
@@ -0,0 +1,407 @@
+"""
+Incremental downloads of a table into a local CSV or GeoPackage file.
+
+A watermark, the maximum of an always growing column like ``cartodb_id`` or
+``updated_at``, is kept in a state file next to the output. Every run only
+fetches the rows above the last watermark and up to the current maximum,
+in keyset chunks when there are many, and merges them into the file: they
+are appended when the watermark is the id, and replace the previous version
+of the same rows otherwise. Deleted rows are not seen by the watermark, so
+an optional check compares a checksum of the ids with the table in CARTO.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+
+from carto_cli.carto import chunks
+from carto_cli.carto import queries
+
+INCREMENTAL_FORMATS = ('csv', 'gpkg')
+
+
+def state_path(path):
+    return '{}.incremental.json'.format(path)
+
+
+def load_state(path):
+    try:
+        with open(state_path(path)) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return None
+
+
+def save_state(path, state):
+    tmp_path = state_path(path) + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_path, state_path(path))
+
+
+def literal(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def current_watermark(carto_obj, table_name, key):
+    sql = queries.WATERMARK.format(table_name=table_name, key=key)
+    return carto_obj.execute_sql(sql)['rows'][0]['watermark']
+
+
+def delta_source(table_name, key, low, high):
+    '''
+    Subquery with the rows of a table between two watermarks, low excluded
+    '''
+    where = '{} <= {}'.format(key, literal(high))
+    if low is not None:
+        where = '{} > {} and {}'.format(key, literal(low), where)
+    return queries.DELTA.format(table_name=table_name, where=where)
+
+
+def ids_source(table_name, id_column, ids):
+    where = '{} in ({})'.format(id_column, ','.join(str(int(id)) for id in ids))
+    return queries.DELTA.format(table_name=table_name, where=where)
+
+
+def fetch_delta(carto_obj, source, format, base, ext, chunk_size, workers,
+                id_column='cartodb_id'):
+    '''
+    Downloads the rows of a subquery into part files, in keyset chunks of
+    the id column when there are more than chunk_size. Returns the number of
+    rows and the paths of the parts.
+    '''
+    count, windows = chunks.plan_chunks(carto_obj, source, chunk_size, id_column)
+    if not count:
+        return 0, []
+
+    state = chunks.new_state(source, format, count, windows, base, ext,
+                             id_column=id_column)
+    failures = chunks.export_chunks(carto_obj, state, base, workers)
+    if os.path.exists(chunks.state_path(base)):
+        os.remove(chunks.state_path(base))
+    paths = [chunk['path'] for chunk in state['chunks']]
+    if failures:
+        remove_files(paths)
+        raise Exception('{} of {} chunks failed: {}'.format(
+            len(failures), len(paths), failures[0][1]))
+    return count, paths
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def csv_writer(output, path):
+    '''
+    CSV writer with the line endings of an existing file
+    '''
+    with open(path, 'rb') as existing:
+        line = existing.readline()
+    return csv.writer(output, lineterminator='\r\n' if line.endswith(b'\r\n') else '\n')
+
+
+def merge_csv(path, parts, id_column, append):
+    '''
+    Appends the rows of the parts to a CSV file or, if not append, replaces
+    the rows with the same id
+    '''
+    with open(path, newline='') as existing:
+        header = next(csv.reader(existing), None)
+
+    new_ids = set()
+    for part in parts:
+        with open(part, newline='') as part_file:
+            reader = csv.reader(part_file)
+            if next(reader, None) != header:
+                raise Exception('The columns of the table changed')
+            if not append:
+                index = header.index(id_column)
+                new_ids.update(row[index] for row in reader)
+
+    if append:
+        with open(path, 'a', newline='') as output:
+            writer = csv_writer(output, path)
+            for part in parts:
+                with open(part, newline='') as part_file:
+                    reader = csv.reader(part_file)
+                    next(reader)
+                    writer.writerows(reader)
+        return
+
+    tmp_path = path + '.tmp'
+    index = header.index(id_column)
+    with open(tmp_path, 'w', newline='') as output:
+        writer = csv_writer(output, path)
+        with open(path, newline='') as existing:
+            reader = csv.reader(existing)
+            writer.writerow(next(reader))
+            writer.writerows(row for row in reader if row[index] not in new_ids)
+        for part in parts:
+            with open(part, newline='') as part_file:
+                reader = csv.reader(part_file)
+                next(reader)
+                writer.writerows(reader)
+    os.replace(tmp_path, path)
+
+
+def wkb_points(wkb, offset=0):
+    '''
+    Returns the (x, y) coordinates of a WKB geometry and the offset where it
+    ends
+    '''
+    order = '<' if wkb[offset] == 1 else '>'
+    kind, = struct.unpack_from(order + 'I', wkb, offset + 1)
+    offset += 5
+    dimensions = 2 + bool(kind & 0x80000000) + bool(kind & 0x40000000)
+    if kind & 0x20000000:
+        offset += 4
+    kind &= 0x0fffffff
+    dimensions += {1: 1, 2: 1, 3: 2}.get(kind // 1000, 0)
+    kind %= 1000
+
+    def read_points(offset, count):
+        points = []
+        for _ in range(count):
+            point = struct.unpack_from(order + 'dd', wkb, offset)
+            # Empty points have NaN coordinates
+            if point[0] == point[0]:
+                points.append(point)
+            offset += 8 * dimensions
+        return points, offset
+
+    if kind == 1:
+        return read_points(offset, 1)
+    count, = struct.unpack_from(order + 'I', wkb, offset)
+    offset += 4
+    if kind == 2:
+        return read_points(offset, count)
+
+    points = []
+    for _ in range(count):
+        if kind == 3:
+            size, = struct.unpack_from(order + 'I', wkb, offset)
+            ring, offset = read_points(offset + 4, size)
+        else:
+            ring, offset = wkb_points(wkb, offset)
+        points.extend(ring)
+    return points, offset
+
+
+def gpkg_envelope(blob):
+    '''
+    (min x, max x, min y, max y) of a GeoPackage geometry, None if empty
+    '''
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+    envelope = (flags >> 1) & 0x07
+    if envelope:
+        return struct.unpack_from(('<' if flags & 1 else '>') + '4d', blob, 8)
+
+    points, _ = wkb_points(blob, 8)
+    if not points:
+        return None
+    xs = [x for x, y in points]
+    ys = [y for x, y in points]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def envelope_function(position):
+    def function(blob):
+        envelope = gpkg_envelope(blob)
+        return envelope[position] if envelope else None
+    return function
+
+
+def connect_gpkg(path):
+    '''
+    Opens a GeoPackage with the functions its spatial index triggers call,
+    which SQLite does not have without SpatiaLite
+    '''
+    connection = sqlite3.connect(path)
+    connection.create_function('ST_IsEmpty', 1,
+                               lambda blob: int(gpkg_envelope(blob) is None))
+    for position, name in enumerate(['ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY']):
+        connection.create_function(name, 1, envelope_function(position))
+    return connection
+
+
+def gpkg_table(connection, schema='main'):
+    row = connection.execute(
+        "select table_name from {}.gpkg_contents "
+        "where data_type in ('features', 'attributes')".format(schema)).fetchone()
+    if row is None:
+        raise Exception('The GeoPackage has no tables')
+    return row[0]
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def merge_gpkg(path, parts, id_column, append):
+    '''
+    Inserts the rows of the GeoPackage parts into another one, deleting
+    first the rows with the same id if not append
+    '''
+    connection = connect_gpkg(path)
+    try:
+        table = quote(gpkg_table(connection))
+        for part in parts:
+            connection.execute('attach database ? as delta', (part,))
+            delta = quote(gpkg_table(connection, 'delta'))
+            columns = ', '.join(quote(row[1]) for row in connection.execute(
+                'pragma delta.table_info({})'.format(delta)) if not row[5])
+            if not append:
+                connection.execute('delete from main.{table} where {id} in '
+                                   '(select {id} from delta.{delta})'.format(
+                                       table=table, delta=delta, id=quote(id_column)))
+            connection.execute('insert into main.{} ({columns}) select {columns} '
+                               'from delta.{}'.format(table, delta, columns=columns))
+            connection.commit()
+            connection.execute('detach database delta')
+    finally:
+        connection.close()
+
+
+def merge(path, format, parts, id_column, append):
+    if not parts:
+        return
+    if not os.path.exists(path):
+        shutil.copyfile(parts[0], path)
+        parts = parts[1:]
+        append = True
+    if format == 'gpkg':
+        merge_gpkg(path, parts, id_column, append)
+    else:
+        merge_csv(path, parts, id_column, append)
+
+
+def local_ids(path, format, id_column):
+    if format == 'gpkg':
+        connection = connect_gpkg(path)
+        try:
+            rows = connection.execute('select {} from {}'.format(
+                quote(id_column), quote(gpkg_table(connection))))
+            return sorted(int(row[0]) for row in rows)
+        finally:
+            connection.close()
+
+    with open(path, newline='') as existing:
+        reader = csv.DictReader(existing)
+        return sorted(int(row[id_column]) for row in reader)
+
+
+def delete_rows(path, format, id_column, ids):
+    if not ids:
+        return
+    if format == 'gpkg':
+        connection = connect_gpkg(path)
+        try:
+            connection.executemany('delete from {} where {} = ?'.format(
+                quote(gpkg_table(connection)), quote(id_column)),
+                [(id,) for id in ids])
+            connection.commit()
+        finally:
+            connection.close()
+        return
+
+    ids = set(str(id) for id in ids)
+    tmp_path = path + '.tmp'
+    with open(path, newline='') as existing, open(tmp_path, 'w', newline='') as output:
+        reader = csv.reader(existing)
+        writer = csv_writer(output, path)
+        header = next(reader)
+        index = header.index(id_column)
+        writer.writerow(header)
+        writer.writerows(row for row in reader if row[index] not in ids)
+    os.replace(tmp_path, path)
+
+
+def checksum(ids):
+    return hashlib.md5(','.join(str(id) for id in ids).encode('utf-8')).hexdigest()
+
+
+def compare_ids(carto_obj, table_name, path, format, id_column):
+    '''
+    Returns the ids only in the local file and the ids only in CARTO. The
+    ids are only listed when the count or the checksum differ.
+    '''
+    ids = local_ids(path, format, id_column)
+    sql = queries.ID_CHECKSUM.format(table_name=table_name, id_column=id_column)
+    remote = carto_obj.execute_sql(sql)['rows'][0]
+    if int(remote['count']) == len(ids) and remote['checksum'] == checksum(ids):
+        return [], []
+
+    sql = queries.IDS.format(table_name=table_name, id_column=id_column)
+    remote_ids = set(int(row[id_column]) for row in carto_obj.execute_sql(sql)['rows'])
+    local = set(ids)
+    return sorted(local - remote_ids), sorted(remote_ids - local)
+
+
+def download(carto_obj, table_name, path, format, key='cartodb_id',
+             id_column='cartodb_id', chunk_size=100000, workers=4, verify=False):
+    '''
+    Brings a local copy of a table up to date, returning a summary with the
+    rows fetched, deleted and the new watermark
+    '''
+    state = load_state(path) if os.path.exists(path) else None
+    if state and (state['table_name'] != table_name or state['key'] != key):
+        raise Exception('{} was downloaded from {} using {}, remove {} to start again'.format(
+            path, state['table_name'], state['key'], state_path(path)))
+    if state is None and os.path.exists(path):
+        raise Exception('{} has no {}, remove it or choose another output to start again'.format(
+            path, state_path(path)))
+
+    low = state['watermark'] if state else None
+    high = current_watermark(carto_obj, table_name, key)
+    base, ext = os.path.splitext(path)
+    base += '.delta'
+
+    summary = {'table_name': table_name, 'rows': 0, 'deleted': 0, 'missing': 0,
+               'watermark': high if high is not None else low}
+
+    def save():
+        if os.path.exists(path):
+            save_state(path, {'table_name': table_name, 'key': key, 'id_column': id_column,
+                              'watermark': summary['watermark'], 'updated_at': time.time()})
+
+    if high is not None and high != low:
+        summary['rows'], parts = fetch_delta(
+            carto_obj, delta_source(table_name, key, low, high), format,
+            base, ext, chunk_size, workers, id_column)
+        try:
+            merge(path, format, parts, id_column, append=state is None or key == id_column)
+        finally:
+            remove_files(parts)
+        # Saved before verifying, so a failed verify can not leave the old
+        # watermark and append the same rows again on the next run
+        save()
+
+    if verify and os.path.exists(path):
+        deleted, missing = compare_ids(carto_obj, table_name, path, format, id_column)
+        delete_rows(path, format, id_column, deleted)
+        summary['deleted'] = len(deleted)
+        if missing:
+            summary['missing'], parts = fetch_delta(
+                carto_obj, ids_source(table_name, id_column, missing), format,
+                base, ext, chunk_size, workers, id_column)
+            try:
+                merge(path, format, parts, id_column, append=False)
+            finally:
+                remove_files(parts)
+
+    save()
+    return summary
@@ -0,0 +1,286 @@
+"""
+Submission and tracking of many Batch SQL API jobs at once.
+
+Jobs are submitted while there are less than a given number of them
+unfinished, and all the unfinished ones are read concurrently over the
+shared session, backing off while none of them changes.
+
+The Batch API runs every job with its id in a comment, so the jobs running
+right now can also be found in pg_stat_activity.
+"""
+
+import calendar
+import os
+import re
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from carto_cli.carto import queries
+from carto_cli.carto.polling import Backoff
+
+BATCH_CONCURRENCY = int(os.environ.get('CARTO_BATCH_CONCURRENCY', 10))
+READ_WORKERS = int(os.environ.get('CARTO_BATCH_READ_WORKERS', 8))
+READ_FAILURES = int(os.environ.get('CARTO_BATCH_READ_FAILURES', 5))
+
+FINAL_STATES = ('done', 'failed', 'cancelled', 'unknown')
+
+JOB_ID_COMMENT = re.compile(
+    r'/\* ([0-9a-z]*-[0-9a-z]*-[0-9a-z]*-[0-9a-z]*-[0-9a-z]*) \*/')
+
+
+def read_jobs(carto_obj, executor, job_ids):
+    '''
+    Reads the details of many jobs concurrently, a failed read is returned
+    as the exception instead of the job details
+    '''
+    def read(job_id):
+        try:
+            return carto_obj.batch_check(job_id)
+        except Exception as e:
+            return e
+    return dict(zip(job_ids, executor.map(read, job_ids)))
+
+
+def status_code(error):
+    '''
+    HTTP status of a failed request, the SDK wraps its exceptions in others
+    '''
+    while isinstance(error, Exception):
+        if getattr(error, 'status_code', None):
+            return error.status_code
+        error = error.args[0] if error.args else None
+    return None
+
+
+def is_final_error(error):
+    '''
+    Client errors, like a job that does not exist, fail the same way again
+    '''
+    code = status_code(error)
+    return code is not None and 400 <= code < 500 and code != 429
+
+
+class JobTracker(object):
+    '''
+    Keeps the last known details of a list of jobs, either submitted by the
+    tracker or already existing. callback(index, job) is called when a job
+    is submitted and every time its status changes. A job that cannot be
+    read `read_failures` times in a row, or gets a client error, is failed.
+    '''
+
+    def __init__(self, carto_obj, concurrency=BATCH_CONCURRENCY,
+                 callback=None, backoff=None, read_failures=READ_FAILURES):
+        if concurrency < 1:
+            raise Exception('The concurrency must be at least 1, not {}'.format(concurrency))
+        self.carto_obj = carto_obj
+        self.concurrency = concurrency
+        self.callback = callback
+        self.backoff = backoff or Backoff()
+        self.read_failures = read_failures
+        self.results = []
+        self.pending = deque()
+        self.running = {}
+        self.failures = {}
+
+    def submit(self, query):
+        '''
+        Queues a query, or a list of them, to be sent as a new job
+        '''
+        self.results.append(None)
+        self.pending.append((len(self.results) - 1, query))
+        return len(self.results) - 1
+
+    def track(self, job_id):
+        '''
+        Adds an existing job, its status is reported on the first read
+        '''
+        self.results.append({'job_id': job_id, 'status': None})
+        self.running[job_id] = len(self.results) - 1
+        return len(self.results) - 1
+
+    def update(self, index, job):
+        changed = self.results[index] is None or \
+            job['status'] != self.results[index]['status']
+        self.results[index] = job
+        if changed and self.callback:
+            self.callback(index, job)
+        return changed
+
+    def submit_pending(self):
+        submitted = False
+        while self.pending and len(self.running) < self.concurrency:
+            index, query = self.pending.popleft()
+            try:
+                job = self.carto_obj.batch_create(query)
+                self.running[job['job_id']] = index
+            except Exception as e:
+                job = {'status': 'failed', 'query': query,
+                       'failed_reason': str(e)}
+            self.update(index, job)
+            submitted = True
+        return submitted
+
+    def poll(self, executor):
+        changed = False
+        jobs = read_jobs(self.carto_obj, executor, list(self.running))
+        for job_id, job in jobs.items():
+            if isinstance(job, Exception):
+                self.failures[job_id] = self.failures.get(job_id, 0) + 1
+                if not is_final_error(job) and self.failures[job_id] < self.read_failures:
+                    # Transient read errors are retried on the next round
+                    continue
+                job = {'job_id': job_id, 'status': 'failed',
+                       'failed_reason': 'The job could not be read: {}'.format(job)}
+            self.failures.pop(job_id, None)
+            changed = self.update(self.running[job_id], job) or changed
+            if job['status'] in FINAL_STATES:
+                del self.running[job_id]
+        return changed
+
+    def discover(self, find_jobs):
+        '''
+        Tracks the jobs returned by find_jobs() that are not tracked yet
+        '''
+        known = set(job['job_id'] for job in self.results if job and 'job_id' in job)
+        found = [job_id for job_id in find_jobs() if job_id not in known]
+        for job_id in found:
+            self.track(job_id)
+        return found
+
+    def wait(self, find_jobs=None):
+        '''
+        Submits the queued queries and polls until every job is finished,
+        returning the last details of every job in the order they were added.
+        find_jobs() is called on every round to track new existing jobs.
+        '''
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            first = True
+            if find_jobs:
+                self.discover(find_jobs)
+            while self.pending or self.running:
+                if self.submit_pending():
+                    self.backoff.reset()
+                if not self.running:
+                    continue
+                # Tracked jobs are read right away to report their status
+                if not first:
+                    self.backoff.wait()
+                    if find_jobs and self.discover(find_jobs):
+                        self.backoff.reset()
+                first = False
+                if self.poll(executor):
+                    self.backoff.reset()
+        return self.results
+
+
+def run_jobs(carto_obj, queries, concurrency=BATCH_CONCURRENCY,
+             callback=None, backoff=None):
+    '''
+    Submits every query (a string or a list of them for multi query jobs)
+    as a Batch API job, never having more than `concurrency` of them
+    unfinished, and waits for all of them
+    '''
+    tracker = JobTracker(carto_obj, concurrency, callback, backoff)
+    for query in queries:
+        tracker.submit(query)
+    return tracker.wait()
+
+
+def wait_jobs(carto_obj, job_ids, callback=None, backoff=None, find_jobs=None):
+    '''
+    Waits for a list of existing jobs, and the ones returned by find_jobs(),
+    to finish
+    '''
+    tracker = JobTracker(carto_obj, callback=callback, backoff=backoff)
+    for job_id in job_ids:
+        tracker.track(job_id)
+    return tracker.wait(find_jobs)
+
+
+def running_jobs(carto_obj):
+    '''
+    Returns {job_id: activity row} for the jobs running right now
+    '''
+    rows = carto_obj.execute_sql(queries.CURRENT_RUNNING, format='json')['rows']
+    jobs = {}
+    for row in rows:
+        for job_id in JOB_ID_COMMENT.findall(row.get('query') or ''):
+            jobs.setdefault(job_id, row)
+    return jobs
+
+
+def parse_time(value):
+    '''
+    Seconds since the epoch of a Batch API timestamp, None if missing
+    '''
+    if not value:
+        return None
+    whole, _, fraction = value.rstrip('Z').partition('.')
+    return calendar.timegm(time.strptime(whole, '%Y-%m-%dT%H:%M:%S')) + \
+        float('0.' + (fraction or '0'))
+
+
+def seconds(start, end):
+    if start is None or end is None:
+        return None
+    return round(max(end - start, 0), 3)
+
+
+def job_queries(job):
+    '''
+    The queries of a multi query job, with or without fallbacks
+    '''
+    query = job.get('query')
+    if isinstance(query, dict):
+        query = query.get('query')
+    if isinstance(query, list):
+        return [item if isinstance(item, dict) else {'query': item} for item in query]
+    return []
+
+
+def job_times(job, seen=None):
+    '''
+    Seconds every job, and every query of a multi query job, spent queued
+    and running. The Batch API timestamps are used when the job has them,
+    otherwise `seen`, the local time every status was first seen.
+    '''
+    seen = seen or {}
+    created = parse_time(job.get('created_at'))
+    final = job.get('status') in FINAL_STATES
+    steps = []
+    previous_end = created
+    for index, query in enumerate(job_queries(job)):
+        started = parse_time(query.get('started_at'))
+        ended = parse_time(query.get('ended_at'))
+        steps.append({'index': index, 'status': query.get('status'),
+                      'queued': seconds(previous_end, started),
+                      'running': seconds(started, ended)})
+        previous_end = ended or previous_end
+
+    started = parse_time(job.get('started_at'))
+    if started is None and job_queries(job):
+        started = parse_time(job_queries(job)[0].get('started_at'))
+    ended = parse_time(job.get('ended_at')) or \
+        (parse_time(job.get('updated_at')) if final else None)
+
+    if started is not None:
+        times = {'queued': seconds(created, started), 'running': seconds(started, ended)}
+    else:
+        final_seen = [seen[status] for status in FINAL_STATES if status in seen]
+        final_seen = min(final_seen) if final_seen else None
+        running_seen = seen.get('running')
+        times = {'queued': seconds(seen.get('pending'), running_seen or final_seen),
+                 'running': seconds(running_seen, final_seen)}
+    if steps:
+        times['queries'] = steps
+    return times
+
+
+def count_states(results):
+    counts = {}
+    for job in results:
+        status = job['status'] if job else 'queued'
+        counts[status] = counts.get(status, 0) + 1
+    return counts
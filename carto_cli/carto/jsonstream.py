@@ -0,0 +1,87 @@
+"""
+Incremental parsing of SQL API JSON responses.
+
+The SQL API sends the rows (or GeoJSON features) as the first member of the
+response object, so they can be decoded one by one while the body arrives
+and the small members that follow them, like `fields` or `time`, are parsed
+once the array is finished.
+"""
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[\s,]*')
+
+
+class JSONArrayStream(object):
+    '''
+    Iterates over the items of the array under `key` in a JSON object sent
+    as a sequence of byte chunks. Once the iteration finishes the rest of
+    the members of the object are available in `tail`.
+    '''
+
+    def __init__(self, chunks, key='rows'):
+        self.chunks = chunks
+        self.key = key
+        self.tail = {}
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        marker = '"{}"'.format(self.key)
+        buffer = ''
+        position = 0
+        in_array = False
+        chunks = iter(self.chunks)
+
+        for chunk in chunks:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+            position = 0
+
+            if not in_array:
+                found = buffer.find(marker)
+                bracket = buffer.find('[', found + len(marker)) if found >= 0 else -1
+                if bracket < 0:
+                    # keep enough text to find a marker split between chunks
+                    position = max(0, len(buffer) - len(marker) - 64) if found < 0 else found
+                    continue
+                position = bracket + 1
+                in_array = True
+
+            while True:
+                position = WHITESPACE.match(buffer, position).end()
+                if position >= len(buffer):
+                    break
+                if buffer[position] == ']':
+                    self.parse_tail(buffer[position + 1:], chunks, text_decoder)
+                    return
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # the item is not complete yet
+                    break
+                yield item
+
+        if buffer[position:].strip():
+            raise ValueError('Unexpected end of the JSON response')
+
+    def parse_tail(self, rest, chunks, text_decoder):
+        rest = rest + ''.join(text_decoder.decode(chunk) for chunk in chunks)
+        rest = rest.strip().lstrip(',')
+        if rest.startswith('}'):
+            return
+        try:
+            self.tail = json.loads('{' + rest)
+        except ValueError:
+            self.tail = {}
+
+
+def raise_for_error(tail):
+    '''
+    Raises the error the SQL API appends after the rows when a query fails
+    once its response has started
+    '''
+    error = tail.get('error')
+    if error:
+        raise Exception(error[0] if isinstance(error, list) else error)
@@ -0,0 +1,107 @@
+import click
+import time
+
+from .carto_user import CARTOUser
+
+ACCOUNT_OPTIONS = [
+    click.option('-u','--user-name', envvar='CARTO_USER',
+                 help='Your CARTO.com user. It can be omitted if $CARTO_USER '+
+                 'is available'),
+    click.option('-o','--org-name', envvar='CARTO_ORG',
+                 help='Your organization name. It can be ommitted if $CARTO_ORG '+
+                 'is available'),
+    click.option('-a','--api-url', envvar='CARTO_API_URL',
+                 help='If you are not using carto.com you need to specify your ' +
+                 'API endpoint. It can be omitted if $CARTO_API_URL is available'),
+    click.option('-k','--api-key', envvar='CARTO_API_KEY',
+                 help='It can be omitted if $CARTO_API_KEY ' +
+                 'is available'),
+    click.option('-c','--check-ssl', default=True, envvar='CARTO_CHECK_SSL', type=bool,
+                 help='Check server SSL Certificate (default = True or CARTO_CHECK_SSL envvar)'),
+    click.option('--timings', is_flag=True, default=False,
+                 help='Print the time spent on every API request when finished'),
+    click.option('--trace', is_flag=True, default=False,
+                 help='Print a summary of the requests by API with their latency '
+                 'percentiles, retries, connections and bytes when finished'),
+    click.option('--metrics-file', type=click.Path(dir_okay=False), envvar='CARTO_METRICS_FILE',
+                 help='Write the metrics of the requests to this file, as JSON if it ends '
+                 'in .json and in the OpenMetrics text format otherwise'),
+    click.option('--spans-file', type=click.Path(dir_okay=False), envvar='CARTO_SPANS_FILE',
+                 help='Append a span per request to this file as OpenTelemetry JSON lines'),
+    click.option('--no-cache', is_flag=True, default=False, envvar='CARTO_NO_CACHE',
+                 help='Do not use the local cache of catalog queries'),
+    click.option('--refresh-cache', is_flag=True, default=False,
+                 help='Ignore the cached catalog queries and store them again'),
+]
+
+
+def account_options(func):
+    '''
+    Adds the options every command group needs to connect to an account
+    '''
+    for option in reversed(ACCOUNT_OPTIONS):
+        func = option(func)
+    return func
+
+
+def create_carto_user(ctx, user_name, org_name, api_url, api_key, check_ssl,
+                      timings, trace, metrics_file, spans_file, no_cache, refresh_cache):
+    '''
+    Sets the CARTOUser of the command. When ctx.obj has a `users` registry,
+    as it does in the server, the user of an account is created once and
+    reused by all the following commands
+    '''
+    if not ctx.obj:
+        ctx.obj = {}
+    users = ctx.obj.get('users')
+    key = (user_name, org_name, api_url, api_key, check_ssl)
+
+    if users is not None and key in users:
+        carto_obj = users[key]
+        carto_obj.use_cache = not no_cache
+        carto_obj.refresh_cache = refresh_cache
+        carto_obj.reset_timings()
+    else:
+        carto_obj = CARTOUser(
+            user_name=user_name,
+            org_name=org_name,
+            api_url=api_url,
+            api_key=api_key,
+            check_ssl=check_ssl,
+            use_cache=not no_cache,
+            refresh_cache=refresh_cache)
+        if users is not None:
+            users[key] = carto_obj
+    ctx.obj['carto'] = carto_obj
+
+    if timings:
+        from .session import format_timings
+        ctx.call_on_close(
+            lambda: click.echo(format_timings(carto_obj.timings), err=True))
+    if trace or metrics_file or spans_file:
+        ctx.call_on_close(report_requests(ctx, carto_obj, time.time(), trace,
+                                          metrics_file, spans_file))
+    return carto_obj
+
+
+def report_requests(ctx, carto_obj, start, trace, metrics_file, spans_file):
+    '''
+    Returns the function that reports the requests of the command once it
+    finishes
+    '''
+    def report():
+        from . import tracing
+
+        end = time.time()
+        timings = carto_obj.timings
+        command = ' '.join(name for name in (ctx.info_name, ctx.invoked_subcommand) if name)
+        if trace:
+            click.echo(tracing.format_trace(timings, end - start), err=True)
+        try:
+            if metrics_file:
+                tracing.write_metrics(metrics_file, timings, command, end - start)
+            if spans_file:
+                tracing.write_spans(spans_file, timings, command, start, end)
+        except (IOError, OSError) as e:
+            click.echo('Error writing the request metrics: {}'.format(e), err=True)
+    return report
@@ -0,0 +1,160 @@
+"""
+Rendering of rows in the output formats of the commands.
+
+All the writers take an iterable of rows and write them as they come, in
+batches of OUTPUT_FLUSH_ROWS rows, so a long listing starts showing up at
+once and is never held in memory as a whole. The pretty tables compute the
+width of their columns from the first PRETTY_SAMPLE rows and cut the values
+wider than PRETTY_MAX_WIDTH, instead of measuring every row before printing.
+"""
+
+import click
+import csv
+import json
+import os
+
+from itertools import chain, islice
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+OUTPUT_FLUSH_ROWS = int(os.environ.get('CARTO_OUTPUT_FLUSH_ROWS', 500))
+PRETTY_SAMPLE = int(os.environ.get('CARTO_PRETTY_SAMPLE', 1000))
+PRETTY_MAX_WIDTH = int(os.environ.get('CARTO_PRETTY_MAX_WIDTH', 80))
+
+FORMATS = ['json', 'ndjson', 'csv', 'pretty']
+
+
+def echo(text):
+    click.echo(text, nl=False)
+
+
+def batches(items, size=OUTPUT_FLUSH_ROWS):
+    items = iter(items)
+    while True:
+        batch = [item for item in islice(items, max(size, 1))]
+        if not batch:
+            return
+        yield batch
+
+
+def plain(value):
+    '''
+    JSON encoding of the rows and row views of the columnar results
+    '''
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Sequence):
+        return [item for item in value]
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def dumps(row):
+    return json.dumps(row, default=plain)
+
+
+def write_json(rows, write=echo):
+    '''
+    Writes the rows as a JSON array, the same text json.dumps gives for
+    the whole list
+    '''
+    write('[')
+    separator = ''
+    for batch in batches(rows):
+        write(separator + ', '.join(dumps(row) for row in batch))
+        separator = ', '
+    write(']\n')
+
+
+def write_ndjson(rows, write=echo):
+    for batch in batches(rows):
+        write(''.join(dumps(row) + '\n' for row in batch))
+
+
+def write_csv(rows, fieldnames, write=echo):
+    '''
+    Writes the fieldnames of the rows as CSV, leaving out any other column
+    '''
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    for batch in batches(rows):
+        writer.writerows(batch)
+        write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    write(buffer.getvalue())
+
+
+def cell(value):
+    return ' '.join(value.split()) if isinstance(value, str) else str(value)
+
+
+def fit(text, width, align):
+    if len(text) > width:
+        text = text[:max(width - 3, 0)] + '...'[:width]
+    if align == 'r':
+        return text.rjust(width)
+    if align == 'c':
+        return text.center(width)
+    return text.ljust(width)
+
+
+def write_pretty(rows, fieldnames, write=echo, headers=None, align='l',
+                 sample=PRETTY_SAMPLE, max_width=PRETTY_MAX_WIDTH):
+    '''
+    Writes the rows as a table like the PrettyTable ones. headers are the
+    titles of the columns, the fieldnames by default, and align is 'l', 'c'
+    or 'r', or a dictionary of them by fieldname. With no max_width the
+    widths come from all the rows instead of a sample, so no value is cut.
+    '''
+    headers = headers or fieldnames
+    aligns = [align.get(name, 'l') if isinstance(align, dict) else align
+              for name in fieldnames]
+
+    rows = iter(rows)
+    if not max_width:
+        sample = None
+    first = [[cell(row[name]) for name in fieldnames] for row in islice(rows, sample)]
+    widths = [len(header) for header in headers]
+    for values in first:
+        widths = [max(width, len(value)) for width, value in zip(widths, values)]
+    if max_width:
+        widths = [min(width, max(max_width, len(header)))
+                  for width, header in zip(widths, headers)]
+
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+\n'
+
+    def line(values, aligns):
+        return '| ' + ' | '.join(fit(value, width, value_align) for value, width, value_align
+                                 in zip(values, widths, aligns)) + ' |\n'
+
+    write(border + line(headers, aligns) + border)
+    rest = ([cell(row[name]) for name in fieldnames] for row in rows)
+    for batch in batches(chain(first, rest)):
+        write(''.join(line(values, aligns) for values in batch))
+    write(border)
+
+
+def write_rows(rows, format, fieldnames=None, write=echo, **pretty_options):
+    '''
+    Writes the rows in one of FORMATS. The csv and pretty formats need the
+    fieldnames, the extra options are passed to write_pretty.
+    '''
+    if format == 'json':
+        write_json(rows, write)
+    elif format == 'ndjson':
+        write_ndjson(rows, write)
+    elif format == 'csv':
+        write_csv(rows, fieldnames, write)
+    elif format == 'pretty':
+        write_pretty(rows, fieldnames, write, **pretty_options)
+    else:
+        raise Exception('Unknown output format {}'.format(format))
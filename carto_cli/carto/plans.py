@@ -0,0 +1,209 @@
+"""
+Aggregation of EXPLAIN ANALYZE plans over many runs of a query.
+
+Every node of the plan is identified by its position in the tree, its type
+and the relation it reads, so the same node can be followed across runs and
+compared with a previous profile of the query.
+"""
+
+import math
+
+from carto_cli.carto import queries
+from carto_cli.carto.statements import is_read_only
+
+EXPLAIN = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}'
+
+# Row estimates this many times off the actual rows are flagged
+MISESTIMATE_FACTOR = 10
+
+
+def explain(carto_obj, sql):
+    '''
+    Runs the query once with EXPLAIN ANALYZE and returns the plan document
+    '''
+    result = carto_obj.execute_sql(EXPLAIN.format(sql.strip().rstrip(';')),
+                                   do_post=True)
+    plan = result['rows'][0]['QUERY PLAN']
+    return plan[0] if isinstance(plan, list) else plan
+
+
+def walk(node, path='0', depth=0):
+    '''
+    Yields (path, depth, node) for every node of a plan tree
+    '''
+    yield path, depth, node
+    for index, child in enumerate(node.get('Plans', [])):
+        for item in walk(child, '{}.{}'.format(path, index), depth + 1):
+            yield item
+
+
+def node_label(node):
+    label = node['Node Type']
+    if node.get('Relation Name'):
+        label += ' on {}'.format(node['Relation Name'])
+    if node.get('Index Name'):
+        label += ' using {}'.format(node['Index Name'])
+    return label
+
+
+def node_stats(node):
+    '''
+    Times are multiplied by the loops of the node so they are the total
+    time spent on it, self time leaves out the time of its children. Rows
+    are per loop, like the estimate they are compared with.
+    '''
+    loops = node.get('Actual Loops', 1) or 1
+    total = node.get('Actual Total Time', 0) * loops
+    children = sum(child.get('Actual Total Time', 0) * (child.get('Actual Loops', 1) or 1)
+                   for child in node.get('Plans', []))
+    return {
+        'time': total,
+        'self_time': max(total - children, 0),
+        'plan_rows': node.get('Plan Rows', 0),
+        'actual_rows': node.get('Actual Rows', 0),
+        'shared_hit': node.get('Shared Hit Blocks', 0),
+        'shared_read': node.get('Shared Read Blocks', 0),
+    }
+
+
+def percentile(values, fraction):
+    '''
+    Nearest rank percentile
+    '''
+    values = sorted(values)
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def summary(values):
+    return {
+        'min': min(values),
+        'median': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+    }
+
+
+def estimate_error(plan_rows, actual_rows):
+    '''
+    Factor between the estimated and the actual rows, always >= 1
+    '''
+    plan_rows = max(plan_rows, 1)
+    actual_rows = max(actual_rows, 1)
+    return float(max(plan_rows, actual_rows)) / min(plan_rows, actual_rows)
+
+
+def aggregate(sql, documents):
+    '''
+    Builds a profile from the plan documents of many runs of a query
+    '''
+    nodes = {}
+    order = []
+    for document in documents:
+        for path, depth, node in walk(document['Plan']):
+            key = '{} {}'.format(path, node_label(node))
+            if key not in nodes:
+                order.append(key)
+                nodes[key] = {'key': key, 'path': path, 'depth': depth,
+                              'label': node_label(node),
+                              'node_type': node['Node Type'],
+                              'relation': node.get('Relation Name'),
+                              'runs': []}
+            nodes[key]['runs'].append(node_stats(node))
+
+    profile_nodes = []
+    for key in order:
+        node = nodes[key]
+        runs = node.pop('runs')
+        plan_rows = runs[0]['plan_rows']
+        actual_rows = percentile([run['actual_rows'] for run in runs], 0.5)
+        node.update({
+            'time': summary([run['time'] for run in runs]),
+            'self_time': summary([run['self_time'] for run in runs]),
+            'plan_rows': plan_rows,
+            'actual_rows': actual_rows,
+            'estimate_error': round(estimate_error(plan_rows, actual_rows), 2),
+            'shared_hit': percentile([run['shared_hit'] for run in runs], 0.5),
+            'shared_read': percentile([run['shared_read'] for run in runs], 0.5),
+            'flags': [],
+        })
+        if node['estimate_error'] >= MISESTIMATE_FACTOR:
+            node['flags'].append('rows estimate off by {:.0f}x'.format(node['estimate_error']))
+        profile_nodes.append(node)
+
+    return {
+        'sql': sql,
+        'runs': len(documents),
+        'planning_time': summary([document.get('Planning Time', 0) for document in documents]),
+        'execution_time': summary([document.get('Execution Time', 0) for document in documents]),
+        'nodes': profile_nodes,
+    }
+
+
+def flag_seq_scans(carto_obj, profile):
+    '''
+    Flags the sequential scans on tables that have indexes
+    '''
+    indexes = {}
+    for node in profile['nodes']:
+        table_name = node['relation']
+        if node['node_type'] != 'Seq Scan' or not table_name:
+            continue
+        if table_name not in indexes:
+            sql = queries.INDEXES.format(table_name=table_name)
+            rows = carto_obj.execute_sql(sql, cache_tables=[table_name])['rows']
+            indexes[table_name] = sorted(set(
+                '{} ({})'.format(row['index_name'], row['column_name']) for row in rows))
+        if indexes[table_name]:
+            node['flags'].append('seq scan, table has indexes: {}'.format(
+                ', '.join(indexes[table_name])))
+    return profile
+
+
+def profile_query(carto_obj, sql, runs, warmup=0, callback=None):
+    '''
+    Profiles a query that does not write, as EXPLAIN ANALYZE runs it every
+    time
+    '''
+    if not is_read_only(sql):
+        raise Exception('Only queries that do not write can be profiled, '
+                        'EXPLAIN ANALYZE would run it {} times'.format(warmup + runs))
+    for _ in range(warmup):
+        explain(carto_obj, sql)
+    documents = []
+    for run in range(runs):
+        documents.append(explain(carto_obj, sql))
+        if callback:
+            callback(run + 1, documents[-1])
+    return flag_seq_scans(carto_obj, aggregate(sql, documents))
+
+
+def diff(baseline, profile):
+    '''
+    Compares the median times of two profiles node by node. Nodes only in
+    one of them mean the plan changed.
+    '''
+    before = {node['key']: node for node in baseline['nodes']}
+    after = {node['key']: node for node in profile['nodes']}
+    keys = [node['key'] for node in baseline['nodes']] + \
+        [node['key'] for node in profile['nodes'] if node['key'] not in before]
+
+    rows = []
+    for key in keys:
+        old = before.get(key)
+        new = after.get(key)
+        node = new or old
+        rows.append({
+            'key': key,
+            'depth': node['depth'],
+            'label': node['label'],
+            'status': 'removed' if not new else 'added' if not old else '',
+            'before': old['time']['median'] if old else None,
+            'after': new['time']['median'] if new else None,
+        })
+    return {
+        'execution_time': {'before': baseline['execution_time']['median'],
+                           'after': profile['execution_time']['median']},
+        'planning_time': {'before': baseline['planning_time']['median'],
+                          'after': profile['planning_time']['median']},
+        'plan_changed': any(row['status'] for row in rows),
+        'nodes': rows,
+    }
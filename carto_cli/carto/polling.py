@@ -0,0 +1,53 @@
+"""
+Adaptive polling of asynchronous API jobs.
+
+Jobs are checked often right after they start, when most of the short ones
+finish, and less and less often while they keep running.
+"""
+
+import os
+import time
+
+POLL_INITIAL = float(os.environ.get('CARTO_POLL_INITIAL', 1))
+POLL_MAX = float(os.environ.get('CARTO_POLL_MAX', 30))
+POLL_FACTOR = float(os.environ.get('CARTO_POLL_FACTOR', 1.5))
+IMPORT_TIMEOUT = float(os.environ.get('CARTO_IMPORT_TIMEOUT', 3600))
+
+IMPORT_FINAL_STATES = ('complete', 'success', 'failure')
+
+
+class Backoff(object):
+
+    def __init__(self, initial=POLL_INITIAL, maximum=POLL_MAX,
+                 factor=POLL_FACTOR):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def wait(self):
+        time.sleep(self.delay)
+        self.delay = min(self.delay * self.factor, self.maximum)
+
+    def reset(self):
+        self.delay = self.initial
+
+
+def wait_for_import(job, backoff=None, timeout=IMPORT_TIMEOUT, callback=None):
+    '''
+    Refreshes an Import API or sync table job until it finishes, calling
+    callback(job) after every check
+    '''
+    backoff = backoff or Backoff()
+    start = time.time()
+
+    job.refresh()
+    while job.state not in IMPORT_FINAL_STATES:
+        if time.time() - start > timeout:
+            raise Exception('Import not finished after {:.0f} seconds, '
+                            'last state: {}'.format(timeout, job.state))
+        backoff.wait()
+        job.refresh()
+        if callback:
+            callback(job)
+    return job
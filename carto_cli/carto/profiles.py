@@ -0,0 +1,51 @@
+"""
+Accounts stored in the ~/.cartorc.yaml configuration file.
+
+Every entry is a profile name with the `api_key` and optionally the `user`
+(the profile name by default), `organization`, `url` and `check_ssl` of an
+account.
+"""
+
+import os
+
+from carto_cli.carto.carto_user import CARTOUser
+
+CONFIG_FILE = os.environ.get(
+    'CARTO_DB', os.path.join(os.path.expanduser("~"), '.cartorc.yaml'))
+
+
+def read_profiles(config_file):
+    '''
+    Parses a configuration file object
+    '''
+    import yaml
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(config_file.read(), Loader=loader) or {}
+
+
+def profile_account(config, name):
+    '''
+    Returns the account settings of a profile
+    '''
+    if name not in config:
+        raise Exception('User {} not found on config'.format(name))
+    profile = config[name]
+    user = profile.get('user', name)
+    return {
+        'user_name': user,
+        'org_name': profile.get('organization'),
+        'api_url': profile.get('url', 'https://{}.carto.com/'.format(user)),
+        'api_key': profile['api_key'],
+        'check_ssl': profile.get('check_ssl', True),
+    }
+
+
+def profile_user(name, config_file=None):
+    '''
+    Creates the CARTOUser of a profile of the configuration file
+    '''
+    with open(config_file or CONFIG_FILE) as config:
+        account = profile_account(read_profiles(config), name)
+    account['check_ssl'] = str(account['check_ssl']).lower() not in ('false', '0', 'no')
+    return CARTOUser(**account)
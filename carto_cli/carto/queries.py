@@ -80,4 +80,163 @@ select pg_proc.oid as oid,
  where pg_proc.proowner = pg_roles.oid and
        pg_roles.rolname = current_user
 '''
-FUNCTIONS_HEADER = ['oid','name','arguments']
\ No newline at end of file
+FUNCTIONS_HEADER = ['oid','name','arguments']
+
+ID_RANGE = '''
+select count(*) as count,
+       min({id_column}) as min_id,
+       max({id_column}) as max_id
+  from {table_name}
+'''
+
+ID_PERCENTILES = '''
+select percentile_disc(array[{fractions}])
+       within group (order by {id_column}) as bounds
+  from {table_name}
+'''
+
+CHUNK = '''
+select {columns}
+  from {table_name}
+ where {id_column} >= {start} and
+       {id_column} < {end}
+ order by {id_column}
+'''
+
+DELETE_CHUNK = '''
+delete from {table_name}
+ where {id_column} >= {start} and
+       {id_column} < {end}
+'''
+
+WATERMARK = '''
+select max({key}) as watermark
+  from {table_name}
+'''
+
+DELTA = '''
+(select *
+   from {table_name}
+  where {where}) _delta
+'''
+
+ID_CHECKSUM = '''
+select count(*) as count,
+       md5(coalesce(string_agg({id_column}::text, ',' order by {id_column}), '')) as checksum
+  from {table_name}
+'''
+
+IDS = '''
+select {id_column}
+  from {table_name}
+ order by {id_column}
+'''
+
+TABLES_SCHEMA = '''
+select c.relname as table_name,
+       a.attname as attribute,
+       format_type(a.atttypid, a.atttypmod) as type
+  from pg_attribute a
+  join pg_class c on a.attrelid = c.oid
+  join pg_roles on pg_roles.oid = c.relowner and pg_roles.rolname = current_user
+ where c.relname in ({table_names}) and
+       attisdropped = false and
+       attnum > 0
+ order by c.relname, attnum
+'''
+
+RESULT_FIELDS = '''
+select * from ({sql}) _q limit 0
+'''
+
+ACTIVITY_SAMPLE = '''
+select pid,
+       state,
+       wait_event_type,
+       wait_event,
+       application_name,
+       query_start,
+       extract(epoch from now() - query_start) as duration,
+       query
+  from pg_stat_activity
+ where usename = current_user and
+       pid <> pg_backend_pid()
+'''
+
+CANCEL_QUERIES = '''
+select a.pid,
+       pg_cancel_backend(a.pid) as cancelled
+  from pg_stat_activity a
+  join (values {targets}) as t(pid, query_start)
+    on a.pid = t.pid and
+       abs(extract(epoch from a.query_start - t.query_start)) < 0.001
+ where a.usename = current_user
+'''
+
+TABLE_HEALTH = '''
+select c.relname as name,
+       s.seq_scan,
+       coalesce(s.idx_scan, 0) as idx_scan,
+       s.n_live_tup as live_tup,
+       s.n_dead_tup as dead_tup,
+       s.n_mod_since_analyze as mod_since_analyze,
+       greatest(s.last_analyze, s.last_autoanalyze) as last_analyze,
+       greatest(s.last_vacuum, s.last_autovacuum) as last_vacuum,
+       pg_relation_size(c.oid) as table_size,
+       pg_indexes_size(c.oid) as indexes_size,
+       coalesce(pg_total_relation_size(nullif(c.reltoastrelid, 0)), 0) as toast_size,
+       (select coalesce(json_agg(json_build_object(
+                   'name', ui.indexrelname,
+                   'size', pg_relation_size(ui.indexrelid))), '[]')
+          from pg_stat_user_indexes ui
+          join pg_index ix on ix.indexrelid = ui.indexrelid
+         where ui.relid = c.oid and
+               ui.idx_scan = 0 and
+               not ix.indisunique) as unused_indexes,
+       (select coalesce(json_agg(a.attname), '[]')
+          from pg_attribute a
+         where a.attrelid = c.oid and
+               a.attname in ('the_geom', 'the_geom_webmercator') and
+               not a.attisdropped and
+               not exists (
+                 select 1
+                   from pg_index ix
+                   join pg_class i on i.oid = ix.indexrelid
+                   join pg_am am on am.oid = i.relam
+                  where ix.indrelid = c.oid and
+                        a.attnum = any(ix.indkey) and
+                        am.amname in ('gist', 'spgist', 'brin'))) as missing_spatial_indexes
+  from pg_class c
+  join pg_namespace n on n.oid = c.relnamespace
+  join pg_roles on pg_roles.oid = c.relowner and pg_roles.rolname = current_user
+  join pg_stat_user_tables s on s.relid = c.oid
+ where c.relkind = 'r' and
+       n.nspname like '{schema_name}' and
+       c.relname like '{table_name}'
+'''
+
+TABLE_EXISTS = '''
+select to_regclass('{table_name}') is not null as exists
+'''
+
+TABLE_INDEXES = '''
+select indexname as index_name,
+       indexdef as definition
+  from pg_indexes
+ where schemaname = '{schema_name}' and
+       tablename = '{table_name}'
+'''
+
+COPY_TO = '''
+COPY ({query}) TO STDOUT WITH (FORMAT csv)
+'''
+
+COPY_FROM = '''
+COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)
+'''
+
+STAGE_EXPORT = '''
+CREATE TABLE {staging} AS
+SELECT row_number() OVER (ORDER BY {order_by}) AS {export_id}, source.*
+  FROM ({query}) source
+'''
@@ -0,0 +1,133 @@
+"""
+HTTP session shared by all the API clients of a CARTOUser.
+
+It keeps a pool of keep-alive connections so the TLS handshake is paid once
+per connection instead of once per request, retries failed connections and
+throttled responses with an exponential backoff and records every request:
+its time until the headers and until the last byte of the body, the bytes
+sent and received, the retries, whether it opened a new connection and the
+end of its body, where the SQL API reports its own time.
+"""
+
+import os
+import time
+import warnings
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+POOL_SIZE = int(os.environ.get('CARTO_POOL_SIZE', 10))
+RETRIES = int(os.environ.get('CARTO_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('CARTO_BACKOFF_FACTOR', 0.5))
+RETRY_STATUS = (429, 502, 503, 504)
+
+# Bytes of the end of every response body kept to read the SQL API `time`
+BODY_TAIL = 2048
+
+
+class TimedSession(requests.Session):
+
+    def __init__(self, check_ssl=True, pool_size=POOL_SIZE, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR):
+        super(TimedSession, self).__init__()
+        self.verify = check_ssl
+        self.timings = []
+
+        if not check_ssl:
+            warnings.filterwarnings('ignore', 'Unverified HTTPS request')
+
+        # Only idempotent methods are retried on bad status codes, SQL API
+        # POSTs are only retried when the connection could not be made
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        record = {
+            'method': method.upper(),
+            'path': urlparse(url).path,
+            'start': time.time(),
+            'request_bytes': 0,
+            'response_bytes': 0,
+            'retries': 0,
+            'tail': b''
+        }
+        hooks = dict(kwargs.pop('hooks', None) or {})
+        hooks['response'] = list(hooks.get('response') or []) + [
+            lambda response, *args, **kwargs: self.track(response, record)]
+
+        # Approximate when other threads open connections at the same time
+        connections = self.opened_connections(url)
+        try:
+            return super(TimedSession, self).request(method, url, *args,
+                                                     hooks=hooks, **kwargs)
+        except Exception as e:
+            record.setdefault('status', None)
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['new_connection'] = self.opened_connections(url) > connections
+            record['seconds'] = time.time() - record['start']
+            record['end'] = max(record.get('end', 0), record['start'] + record['seconds'])
+            self.timings.append(record)
+
+    def opened_connections(self, url):
+        manager = self.get_adapter(url).poolmanager
+        return sum(manager.pools[key].num_connections for key in manager.pools.keys())
+
+    def track(self, response, record):
+        '''
+        Response hook that records the status, sizes and retries of a request
+        and counts the body as it is read, also when it is streamed
+        '''
+        record['status'] = response.status_code
+        body = response.request.body
+        if isinstance(body, (bytes, str)):
+            record['request_bytes'] = len(body)
+        history = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        record['retries'] = len(history or ())
+
+        def count(data):
+            if data:
+                record['response_bytes'] += len(data)
+                record['tail'] = (record['tail'] + data)[-BODY_TAIL:]
+            record['end'] = time.time()
+
+        read = response.raw.read
+
+        def counted_read(*args, **kwargs):
+            data = read(*args, **kwargs)
+            count(data)
+            return data
+
+        response.raw.read = counted_read
+
+        # urllib3 reads chunked bodies with read_chunked instead of read
+        read_chunked = getattr(response.raw, 'read_chunked', None)
+        if read_chunked:
+            def counted_read_chunked(*args, **kwargs):
+                for data in read_chunked(*args, **kwargs):
+                    count(data)
+                    yield data
+                count(None)
+
+            response.raw.read_chunked = counted_read_chunked
+        return response
+
+
+def format_timings(timings):
+    lines = ['{method:6} {status} {ms:10.1f} ms  {path}'.format(
+        ms=timing['seconds'] * 1000, **timing) for timing in timings]
+    total = sum(timing['seconds'] for timing in timings)
+    lines.append('{} requests in {:.1f} ms'.format(len(timings), total * 1000))
+    return '\n'.join(lines)
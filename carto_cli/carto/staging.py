@@ -0,0 +1,98 @@
+"""
+Export of huge tables staged with the Batch API.
+
+A Batch API job, which is not limited by the timeout of the SQL API,
+copies the table or query into a staging table with a dense `_export_id`
+row number and an index on it. The staging table is then fetched through
+the SQL API in keyset chunks of that id, many at a time, and dropped once
+all of them are on disk.
+"""
+
+import os
+import time
+
+from carto_cli.carto import chunks
+from carto_cli.carto import queries
+from carto_cli.carto.jobs import run_jobs
+
+EXPORT_ID = '_export_id'
+STAGING_PREFIX = '_export_'
+
+
+def staging_name(table_name):
+    # Table names are limited to 63 characters
+    return '{}{}_{}'.format(STAGING_PREFIX, table_name[:40], int(time.time()))
+
+
+def staging_statements(query, staging, order_by='cartodb_id'):
+    return [
+        'DROP TABLE IF EXISTS {}'.format(staging),
+        queries.STAGE_EXPORT.format(staging=staging, order_by=order_by,
+                                    export_id=EXPORT_ID, query=query).strip(),
+        'CREATE UNIQUE INDEX ON {} ({})'.format(staging, EXPORT_ID),
+        'ANALYZE {}'.format(staging)
+    ]
+
+
+def stage(carto_obj, query, staging, order_by='cartodb_id', callback=None):
+    '''
+    Runs the multi query job that creates the staging table of a query
+    and waits for it
+    '''
+    job = run_jobs(carto_obj, [staging_statements(query, staging, order_by)],
+                   callback=callback)[0]
+    if job['status'] != 'done':
+        raise Exception('The staging job did not finish: {}'.format(
+            job.get('failed_reason') or job['status']))
+    return job
+
+
+def staging_columns(carto_obj, staging):
+    '''
+    Columns of the staging table except its row number
+    '''
+    rows = carto_obj.execute_sql(queries.SCHEMA.format(table_name=staging))['rows']
+    return ', '.join('"{}"'.format(row['attribute'].replace('"', '""'))
+                     for row in rows if row['attribute'] != EXPORT_ID)
+
+
+def drop_staging(carto_obj, staging):
+    carto_obj.execute_sql('DROP TABLE IF EXISTS {}'.format(staging), do_post=True)
+
+
+def plan(carto_obj, table_name, format, base, ext, chunk_rows, query=None,
+         order_by='cartodb_id', callback=None):
+    '''
+    Stages a table, or a query over it, and returns the chunks state to
+    fetch it. When it fits in one chunk this is written to base + ext. The
+    staging table is dropped if it cannot be saved in the state.
+    '''
+    staging = staging_name(table_name)
+    try:
+        stage(carto_obj, query or 'SELECT * FROM {}'.format(table_name), staging,
+              order_by, callback)
+
+        count, windows = chunks.plan_chunks(carto_obj, staging, chunk_rows, EXPORT_ID)
+        state = chunks.new_state(staging, format, count, windows or [(1, 1)], base, ext,
+                                 id_column=EXPORT_ID,
+                                 columns=staging_columns(carto_obj, staging))
+        state['staging'] = staging
+        state['source'] = table_name
+        if len(state['chunks']) == 1:
+            state['chunks'][0]['path'] = base + ext
+        chunks.save_state(base, state)
+    except BaseException:
+        try:
+            drop_staging(carto_obj, staging)
+        except Exception:
+            pass
+        raise
+    return state
+
+
+def finish(carto_obj, state, base):
+    '''
+    Drops the staging table of a fully fetched state and its state file
+    '''
+    drop_staging(carto_obj, state['staging'])
+    os.remove(chunks.state_path(base))
@@ -0,0 +1,88 @@
+"""
+Splitting of SQL scripts into statements.
+
+Semicolons inside quoted strings, quoted identifiers, dollar quoted bodies
+and comments do not end a statement.
+"""
+
+import re
+
+DOLLAR_QUOTE = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+
+READ_STATEMENT = re.compile(r'^\s*(select|with|show|values|explain)\b', re.I)
+
+# Words of statements that change tables, or may through a function
+WRITE_WORDS = re.compile(
+    r'\b(insert|update|delete|merge|create|drop|alter|truncate|grant|revoke|'
+    r'comment|copy|vacuum|analyze|reindex|cluster|refresh|into|cdb_\w+)\b', re.I)
+
+
+def split_semicolons(text):
+    statements = []
+    start = 0
+    position = 0
+    length = len(text)
+
+    while position < length:
+        char = text[position]
+        if char in ("'", '"'):
+            end = text.find(char, position + 1)
+            # Doubled quotes are escaped quotes
+            while end != -1 and text[end + 1:end + 2] == char:
+                end = text.find(char, end + 2)
+            position = length if end == -1 else end + 1
+        elif text.startswith('--', position):
+            end = text.find('\n', position)
+            position = length if end == -1 else end + 1
+        elif text.startswith('/*', position):
+            end = text.find('*/', position + 2)
+            position = length if end == -1 else end + 2
+        elif char == '$' and DOLLAR_QUOTE.match(text, position):
+            tag = DOLLAR_QUOTE.match(text, position).group(0)
+            end = text.find(tag, position + len(tag))
+            position = length if end == -1 else end + len(tag)
+        elif char == ';':
+            statements.append(text[start:position])
+            position += 1
+            start = position
+        else:
+            position += 1
+
+    statements.append(text[start:])
+    return statements
+
+
+def is_empty(statement):
+    '''
+    True for statements with only white space and comments
+    '''
+    without_comments = re.sub(r'--[^\n]*|/\*.*?\*/', '', statement, flags=re.S)
+    return not without_comments.strip()
+
+
+def is_read_only(statement):
+    '''
+    True for queries that cannot change a table. Anything that is not
+    clearly a query, such as a select calling a CARTO function, is taken
+    as a write.
+    '''
+    statement = re.sub(r'--[^\n]*|/\*.*?\*/', '', statement, flags=re.S)
+    return bool(READ_STATEMENT.match(statement)) and not WRITE_WORDS.search(statement)
+
+
+def split_statements(text, delimiter='auto'):
+    '''
+    Returns the statements of a script separated by semicolons or by new
+    lines. With `auto` semicolons are used when the script has any.
+    '''
+    if delimiter == 'auto':
+        semicolons = split_semicolons(text)
+        delimiter = 'semicolon' if len(semicolons) > 1 else 'newline'
+
+    if delimiter == 'semicolon':
+        statements = split_semicolons(text)
+    else:
+        statements = text.splitlines()
+
+    return [statement.strip() for statement in statements
+            if not is_empty(statement)]
@@ -0,0 +1,234 @@
+"""
+Summaries, metrics and spans of the requests recorded by TimedSession.
+
+The requests are grouped by API (SQL, Batch, Import, datasets...) to print
+a summary with the latency percentiles, to write metrics in the OpenMetrics
+text format, or in JSON when the file name ends in .json, and to write one
+span per request as JSON lines with the fields of the OpenTelemetry spans,
+all of them children of a span of the whole command.
+"""
+
+import binascii
+import json
+import os
+import re
+
+API_PATHS = [
+    ('batch', re.compile(r'/api/v\d+/sql/job')),
+    ('copy', re.compile(r'/api/v\d+/sql/copy')),
+    ('sql', re.compile(r'/api/v\d+/sql')),
+    ('import', re.compile(r'/api/v\d+/(imports|synchronizations)')),
+    ('datasets', re.compile(r'/api/v\d+/viz')),
+]
+
+SQL_TIME = re.compile(br'"time"\s*:\s*([0-9.eE+-]+)')
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def api_name(path):
+    for name, pattern in API_PATHS:
+        if pattern.search(path):
+            return name
+    return 'other'
+
+
+def server_seconds(timing):
+    '''
+    Time the SQL API reports for a query, read from the end of its body
+    '''
+    if api_name(timing['path']) != 'sql':
+        return None
+    found = SQL_TIME.findall(timing.get('tail') or b'')
+    try:
+        return float(found[-1]) if found else None
+    except ValueError:
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def total_seconds(timing):
+    return timing.get('end', timing['start'] + timing['seconds']) - timing['start']
+
+
+def summarize(timings):
+    '''
+    Totals and latency percentiles of the requests by API
+    '''
+    apis = {}
+    for timing in timings:
+        apis.setdefault(api_name(timing['path']), []).append(timing)
+
+    summary = {}
+    for name, group in sorted(apis.items()):
+        durations = [total_seconds(timing) for timing in group]
+        server = [value for value in (server_seconds(timing) for timing in group)
+                  if value is not None]
+        summary[name] = {
+            'requests': len(group),
+            'errors': sum(1 for timing in group
+                          if timing.get('error') or (timing.get('status') or 0) >= 400),
+            'retries': sum(timing.get('retries', 0) for timing in group),
+            'new_connections': sum(1 for timing in group if timing.get('new_connection')),
+            'bytes_sent': sum(timing.get('request_bytes', 0) for timing in group),
+            'bytes_received': sum(timing.get('response_bytes', 0) for timing in group),
+            'seconds': sum(durations),
+            'first_byte_seconds': sum(timing['seconds'] for timing in group),
+            'server_seconds': sum(server),
+            'quantiles': {str(quantile): percentile(durations, quantile)
+                          for quantile in QUANTILES},
+            'max_seconds': max(durations)
+        }
+    return summary
+
+
+def format_trace(timings, elapsed):
+    summary = summarize(timings)
+    lines = ['{:9} {:>8} {:>6} {:>7} {:>5} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+        'API', 'Requests', 'Errors', 'Retries', 'Conns', 'p50 ms', 'p90 ms', 'p99 ms',
+        'Max ms', 'Server ms', 'Sent', 'Received')]
+    for name, api in summary.items():
+        lines.append('{:9} {:8} {:6} {:7} {:5} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {:10.1f} '
+                     '{:>10} {:>10}'.format(
+                         name, api['requests'], api['errors'], api['retries'],
+                         api['new_connections'],
+                         api['quantiles']['0.5'] * 1000, api['quantiles']['0.9'] * 1000,
+                         api['quantiles']['0.99'] * 1000, api['max_seconds'] * 1000,
+                         api['server_seconds'] * 1000,
+                         pretty_bytes(api['bytes_sent']), pretty_bytes(api['bytes_received'])))
+    seconds = sum(api['seconds'] for api in summary.values())
+    lines.append('{} requests, {:.1f} ms in requests, {:.1f} ms in the command'.format(
+        len(timings), seconds * 1000, elapsed * 1000))
+    return '\n'.join(lines)
+
+
+def pretty_bytes(value):
+    for unit in ('B', 'KB', 'MB'):
+        if value < 1024:
+            return '{:.0f} {}'.format(value, unit) if unit == 'B' \
+                else '{:.1f} {}'.format(value, unit)
+        value /= 1024.0
+    return '{:.1f} GB'.format(value)
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def openmetrics(timings, command):
+    '''
+    Metrics of the requests in the OpenMetrics text format
+    '''
+    summary = summarize(timings)
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append('# TYPE {} {}'.format(name, kind))
+        lines.append('# HELP {} {}'.format(name, help))
+        for suffix, labels, value in samples:
+            labels = dict(labels, command=command)
+            lines.append('{}{}{{{}}} {}'.format(name, suffix, ','.join(
+                '{}="{}"'.format(key, label_value(labels[key])) for key in sorted(labels)),
+                repr(float(value))))
+
+    metric('carto_requests', 'counter', 'API requests',
+           [('_total', {'api': name}, api['requests']) for name, api in summary.items()])
+    metric('carto_request_errors', 'counter', 'API requests that failed',
+           [('_total', {'api': name}, api['errors']) for name, api in summary.items()])
+    metric('carto_request_retries', 'counter', 'Retries of the API requests',
+           [('_total', {'api': name}, api['retries']) for name, api in summary.items()])
+    metric('carto_connections', 'counter', 'Connections opened',
+           [('_total', {'api': name}, api['new_connections'])
+            for name, api in summary.items()])
+    metric('carto_request_duration_seconds', 'summary',
+           'Time of the API requests until the last byte of the response',
+           [sample for name, api in summary.items() for sample in
+            [('', {'api': name, 'quantile': quantile}, value)
+             for quantile, value in sorted(api['quantiles'].items())] +
+            [('_sum', {'api': name}, api['seconds']),
+             ('_count', {'api': name}, api['requests'])]])
+    metric('carto_server_seconds', 'counter', 'Time reported by the SQL API',
+           [('_total', {'api': name}, api['server_seconds'])
+            for name, api in summary.items() if name == 'sql'])
+    metric('carto_bytes', 'counter', 'Bytes of the requests and responses',
+           [sample for name, api in summary.items() for sample in
+            [('_total', {'api': name, 'direction': 'sent'}, api['bytes_sent']),
+             ('_total', {'api': name, 'direction': 'received'}, api['bytes_received'])]])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path, timings, command, elapsed):
+    '''
+    Writes the metrics of a command, as JSON if the file ends in .json and
+    in the OpenMetrics text format otherwise
+    '''
+    with open(path, 'w') as metrics_file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            json.dump({'command': command, 'seconds': elapsed,
+                       'apis': summarize(timings)}, metrics_file, indent=2, sort_keys=True)
+        else:
+            metrics_file.write(openmetrics(timings, command))
+
+
+def random_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def nanoseconds(seconds):
+    return int(seconds * 1e9)
+
+
+def spans(timings, command, start, end):
+    '''
+    A span of the command and one for every request under it
+    '''
+    trace_id = random_id(16)
+    root_id = random_id(8)
+    yield {
+        'traceId': trace_id, 'spanId': root_id, 'parentSpanId': '',
+        'name': command, 'kind': 'SPAN_KIND_INTERNAL',
+        'startTimeUnixNano': nanoseconds(start), 'endTimeUnixNano': nanoseconds(end),
+        'attributes': {'carto.requests': len(timings)}
+    }
+    for timing in timings:
+        attributes = {
+            'http.request.method': timing['method'],
+            'url.path': timing['path'],
+            'http.response.status_code': timing.get('status'),
+            'http.request.body.size': timing.get('request_bytes', 0),
+            'http.response.body.size': timing.get('response_bytes', 0),
+            'carto.api': api_name(timing['path']),
+            'carto.retries': timing.get('retries', 0),
+            'carto.new_connection': bool(timing.get('new_connection')),
+            'carto.first_byte_seconds': timing['seconds'],
+        }
+        if server_seconds(timing) is not None:
+            attributes['carto.server_seconds'] = server_seconds(timing)
+        if timing.get('error'):
+            attributes['error.type'] = timing['error']
+        yield {
+            'traceId': trace_id, 'spanId': random_id(8), 'parentSpanId': root_id,
+            'name': '{} {}'.format(timing['method'], timing['path']),
+            'kind': 'SPAN_KIND_CLIENT',
+            'startTimeUnixNano': nanoseconds(timing['start']),
+            'endTimeUnixNano': nanoseconds(timing['start'] + total_seconds(timing)),
+            'status': {'code': 'STATUS_CODE_ERROR' if timing.get('error') or
+                       (timing.get('status') or 0) >= 400 else 'STATUS_CODE_UNSET'},
+            'attributes': attributes
+        }
+
+
+def write_spans(path, timings, command, start, end):
+    '''
+    Appends the spans of a command to a file as JSON lines
+    '''
+    with open(path, 'a') as spans_file:
+        for span in spans(timings, command, start, end):
+            spans_file.write(json.dumps(span) + '\n')
@@ -0,0 +1,179 @@
+"""
+Copy of tables between two accounts.
+
+The table is split in keyset windows of its id column, and every window is
+streamed with the COPY endpoints of the SQL API: the CSV received from the
+source account is sent to the target account as it arrives, so nothing is
+written to disk and many windows are copied at the same time. Every window
+is loaded in its own COPY and retried when it fails, deleting its rows from
+the target first, as a COPY may be committed after the client sees an error.
+"""
+
+import os
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from carto_cli.carto import chunks
+from carto_cli.carto import queries
+from carto_cli.carto.jobs import run_jobs
+
+COPY_WORKERS = int(os.environ.get('CARTO_COPY_WORKERS', 4))
+COPY_CHUNK_ROWS = int(os.environ.get('CARTO_COPY_CHUNK_ROWS', 200000))
+COPY_RETRIES = int(os.environ.get('CARTO_COPY_RETRIES', 2))
+
+# Created again by the cartodbfication of the copied table
+CARTODBFY_COLUMNS = ('the_geom_webmercator',)
+CARTODBFY_INDEXES = re.compile(r'\((cartodb_id|the_geom|the_geom_webmercator)\)$')
+
+INDEX_DEFINITION = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )(\S+)( .*)$', re.S)
+
+
+def schema_name(carto_obj):
+    return carto_obj.user_name if carto_obj.org_name else 'public'
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def table_columns(carto_obj, table_name):
+    '''
+    (name, type) of the columns of a table, except the ones the
+    cartodbfication creates
+    '''
+    rows = carto_obj.execute_sql(queries.SCHEMA.format(table_name=table_name))['rows']
+    if not rows:
+        raise Exception('The table {} does not exist'.format(table_name))
+    return [(row['attribute'], row['type']) for row in rows
+            if row['attribute'] not in CARTODBFY_COLUMNS]
+
+
+def account(carto_obj):
+    api_url = carto_obj.api_url or 'https://{}.carto.com/api/'.format(carto_obj.user_name)
+    return carto_obj.user_name, carto_obj.org_name, api_url.rstrip('/')
+
+
+def same_account(source, target):
+    '''
+    Whether two users, even read from different profiles, are the same
+    account
+    '''
+    return account(source) == account(target)
+
+
+def table_exists(carto_obj, table_name):
+    sql = queries.TABLE_EXISTS.format(table_name=table_name)
+    return carto_obj.execute_sql(sql, do_post=True)['rows'][0]['exists']
+
+
+def index_statements(carto_obj, table_name, target_name, cartodbfy=True):
+    '''
+    CREATE INDEX statements of the indexes of a table for the copied table,
+    leaving out the ones the cartodbfication creates when it runs. The
+    indexes are left unnamed, so Postgres names them after the copied table
+    and they never clash with the ones of the source.
+    '''
+    sql = queries.TABLE_INDEXES.format(schema_name=schema_name(carto_obj),
+                                       table_name=table_name)
+    statements = []
+    for row in carto_obj.execute_sql(sql)['rows']:
+        definition = row['definition']
+        match = INDEX_DEFINITION.match(definition)
+        if not match or (cartodbfy and (row['index_name'].endswith('_pkey') or
+                                        CARTODBFY_INDEXES.search(definition))):
+            continue
+        create, _, on, _, rest = match.groups()
+        statements.append(create + on.lstrip() + quote(target_name) + rest)
+    return statements
+
+
+def copy_window(source, target, query, copy_from, clear=None, retries=COPY_RETRIES):
+    '''
+    Streams the result of a query in the source account into a table of the
+    target account, returning the number of rows loaded. `clear` deletes
+    the rows of the window in the target before every retry.
+    '''
+    for attempt in range(retries + 1):
+        try:
+            if attempt and clear:
+                target.execute_sql(clear, do_post=True)
+            result = target.copy_from(copy_from, source.copy_to(
+                queries.COPY_TO.format(query=query.strip())))
+            return int(result['total_rows'])
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def copy_table(source, target, table_name, target_name=None, id_column='cartodb_id',
+               chunk_rows=COPY_CHUNK_ROWS, workers=COPY_WORKERS, overwrite=False,
+               cartodbfy_query=None, callback=None):
+    '''
+    Copies a table from the source to the target account, creates its
+    indexes, cartodbfies it when cartodbfy_query is given and checks the
+    number of rows. callback(step, details) is called on every step.
+    '''
+    target_name = target_name or table_name
+    callback = callback or (lambda step, details: None)
+    start = time.time()
+    if target_name == table_name and same_account(source, target):
+        raise Exception('The table {} can not be copied onto itself'.format(table_name))
+
+    columns = table_columns(source, table_name)
+    if table_exists(target, target_name):
+        if not overwrite:
+            raise Exception('The table {} already exists in the target account'.format(
+                target_name))
+        target.execute_sql('DROP TABLE {}'.format(quote(target_name)), do_post=True)
+    target.execute_sql('CREATE TABLE {} ({})'.format(quote(target_name), ', '.join(
+        '{} {}'.format(quote(name), type) for name, type in columns)), do_post=True)
+    target.invalidate_cache(target_name)
+    callback('create', {'table_name': target_name, 'columns': len(columns)})
+
+    count, windows = chunks.plan_chunks(source, table_name, chunk_rows, id_column)
+    column_list = ', '.join(quote(name) for name, type in columns)
+    copy_from = queries.COPY_FROM.format(table_name=quote(target_name),
+                                         columns=column_list).strip()
+
+    copied = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            executor.submit(copy_window, source, target,
+                            chunks.chunk_query(table_name, window_start, window_end,
+                                               id_column=id_column, columns=column_list),
+                            copy_from,
+                            queries.DELETE_CHUNK.format(
+                                table_name=quote(target_name), id_column=quote(id_column),
+                                start=window_start, end=window_end).strip()): index
+            for index, (window_start, window_end) in enumerate(windows, 1)
+        }
+        for future in as_completed(futures):
+            rows = future.result()
+            copied += rows
+            callback('chunk', {'index': futures[future], 'chunks': len(windows),
+                               'rows': rows, 'copied': copied, 'count': count})
+
+    statements = []
+    if cartodbfy_query:
+        statements.append(cartodbfy_query)
+    statements += index_statements(source, table_name, target_name,
+                                   cartodbfy=bool(cartodbfy_query))
+    if statements:
+        # One multi query job, the indexes are created once the table is cartodbfied
+        job = run_jobs(target, [statements])[0]
+        if job['status'] != 'done':
+            raise Exception('The cartodbfication and indexes job did not finish: {}'.format(
+                job.get('failed_reason') or job['status']))
+        callback('indexes', {'statements': statements})
+
+    sql = 'select count(*) from {}'.format(quote(target_name))
+    target_count = int(target.execute_sql(sql, do_post=True)['rows'][0]['count'])
+    if target_count != count:
+        raise Exception('The table {} has {} rows in the source account and {} in the target'.format(
+            table_name, count, target_count))
+
+    return {'table_name': table_name, 'target_name': target_name, 'rows': count,
+            'chunks': len(windows), 'seconds': round(time.time() - start, 1)}
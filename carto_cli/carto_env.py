@@ -1,18 +1,17 @@
 import click
 import os.path
-import yaml
 
 from carto_cli.utils import check_piped_arg
 
+from .carto.profiles import CONFIG_FILE, read_profiles, profile_account
 from .carto.version import version
 
-default_config_file = os.environ.get(
-    'CARTO_DB', os.path.join(os.path.expanduser("~"), '.cartorc.yaml'))
+default_config_file = CONFIG_FILE
 
 
 @click.group(help='Allows you to get the account details')
 @click.option('-c', '--config-file', type=click.File('r'),
-              default=default_config_file,
+              default=default_config_file, envvar='CARTO_DB',
               help="Configuration file to read, defaults to ~/.cartorc.yaml " +
                    "or the environment variable $CARTO_DB")
 @click.help_option('-h', '--help')
@@ -23,7 +22,7 @@ def cli(ctx, config_file):
     '''
     if not ctx.obj:
         ctx.obj = {}
-    ctx.obj['config'] = yaml.load(config_file.read())
+    ctx.obj['config'] = read_profiles(config_file)
 
 
 @cli.command(help='List your stored users')
@@ -70,23 +69,20 @@ def load(ctx, output_file, user):
     if not user in config:
         ctx.fail('User not found on config')
     else:
-        user_config = config[user]
-        api_key = user_config['api_key']
-
-        final_user = user_config['user'] if 'user' in user_config else user
-        org = user_config['organization'] if 'organization' in user_config else None
-        url = user_config['url'] if 'url' in user_config else 'https://{}.carto.com/'.format(final_user)
+        account = profile_account(config, user)
+        org = account['org_name']
 
         result = '''
 export CARTO_USER="{user}"
 export CARTO_API_KEY="{api_key}"
-export CARTO_API_URL="{url}"'''.format(user=final_user, org=org, api_key=api_key, url=url)
+export CARTO_API_URL="{url}"'''.format(user=account['user_name'], org=org,
+                                         api_key=account['api_key'], url=account['api_url'])
 
         if org != None:
             result = result + '\nexport CARTO_ORG="{org}"'.format(org=org)
 
-        if 'check_ssl' in user_config:
-            result = result + '\nexport CARTO_CHECK_SSL="{}"'.format(user_config['check_ssl'])
+        if 'check_ssl' in config[user]:
+            result = result + '\nexport CARTO_CHECK_SSL="{}"'.format(config[user]['check_ssl'])
 
         result = result + '\n'
 
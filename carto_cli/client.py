@@ -0,0 +1,166 @@
+"""
+Thin client of the `carto_cli serve` server.
+
+The console scripts start here. When a server is listening on the socket
+the command line is sent to it, and its output is copied back as it is
+produced, so the command runs without paying for the imports, the client
+set up and the TLS handshakes again. Otherwise the command runs in this
+process as usual. Only the standard library is imported until then.
+
+Messages in both directions are frames of one channel byte and the length
+of the data: `r` request, `o` standard output, `e` standard error, `i`
+standard input (a request of the server with the number of bytes or the
+data sent by the client) and `x` the exit code.
+"""
+
+import importlib
+import json
+import os
+import socket
+import struct
+import sys
+
+SOCKET_PATH = os.environ.get('CARTO_SOCKET', os.path.join(
+    os.path.expanduser('~'), '.carto_cli', 'server.sock'))
+
+COMMANDS = {
+    'carto_cli': 'carto_cli.app',
+    'carto_env': 'carto_cli.carto_env',
+    'carto_sql': 'carto_cli.carto_sql',
+    'carto_batch': 'carto_cli.carto_batch',
+    'carto_dataset': 'carto_cli.carto_dataset',
+}
+
+HEADER = struct.Struct('!cI')
+
+
+def send_frame(connection, channel, data=b''):
+    connection.sendall(HEADER.pack(channel, len(data)) + data)
+
+
+def read_exactly(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(connection):
+    '''
+    Returns the channel and data of the next frame, or (None, None) if the
+    connection is closed
+    '''
+    header = read_exactly(connection, HEADER.size)
+    if header is None:
+        return None, None
+    channel, size = HEADER.unpack(header)
+    data = read_exactly(connection, size) if size else b''
+    if data is None:
+        return None, None
+    return channel, data
+
+
+def load_cli(command):
+    return importlib.import_module(COMMANDS[command]).cli
+
+
+def connect(path=SOCKET_PATH):
+    if not os.path.exists(path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except (IOError, OSError):
+        connection.close()
+        return None
+    return connection
+
+
+def read_stdin(size):
+    try:
+        return os.read(sys.stdin.fileno(), size)
+    except (AttributeError, ValueError, OSError):
+        return b''
+
+
+def run_remote(command, args, path=SOCKET_PATH):
+    '''
+    Runs a command in the server and returns its exit code, or None if there
+    is no server to run it
+    '''
+    if os.environ.get('CARTO_NO_SERVER'):
+        return None
+    connection = connect(path)
+    if connection is None:
+        return None
+
+    try:
+        stdin_tty = sys.stdin is None or sys.stdin.isatty()
+    except ValueError:
+        stdin_tty = True
+    request = {
+        'command': command,
+        'prog': os.path.basename(sys.argv[0]),
+        'args': args,
+        'cwd': os.getcwd(),
+        'env': {key: value for key, value in os.environ.items()
+                if key.startswith('CARTO_')},
+        'stdin_tty': stdin_tty,
+    }
+
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = getattr(sys.stderr, 'buffer', sys.stderr)
+    try:
+        send_frame(connection, b'r', json.dumps(request).encode('utf-8'))
+        while True:
+            channel, data = read_frame(connection)
+            if channel == b'o':
+                stdout.write(data)
+                stdout.flush()
+            elif channel == b'e':
+                stderr.write(data)
+                stderr.flush()
+            elif channel == b'i':
+                send_frame(connection, b'i', read_stdin(int(data)))
+            elif channel == b'x':
+                return int(data)
+            else:
+                stderr.write(b'Error: the carto_cli server closed the connection\n')
+                return 1
+    except BrokenPipeError:
+        # The output was closed, like when piping into head
+        return 1
+    finally:
+        connection.close()
+
+
+def main(command):
+    args = sys.argv[1:]
+    if not (command == 'carto_cli' and args[:1] == ['serve']):
+        code = run_remote(command, args)
+        if code is not None:
+            sys.exit(code)
+    load_cli(command)(obj={})
+
+
+def carto_cli():
+    main('carto_cli')
+
+
+def carto_env():
+    main('carto_env')
+
+
+def carto_sql():
+    main('carto_sql')
+
+
+def carto_batch():
+    main('carto_batch')
+
+
+def carto_dataset():
+    main('carto_dataset')
@@ -1,32 +1,48 @@
 import click
 import json
-import re
 import sys
+import time
 
-from carto_cli.carto import queries
+from concurrent.futures import ThreadPoolExecutor
+
+from carto_cli.carto.cache import ANY_TABLE
+from carto_cli.carto.jobs import BATCH_CONCURRENCY, READ_WORKERS, FINAL_STATES, \
+    run_jobs, wait_jobs, count_states, read_jobs, running_jobs, job_times
 from carto_cli.utils import check_piped_arg
 
 
 @click.command(help="Display the ids of all your running jobs")
+@click.option('-d', '--details', is_flag=True, default=False,
+              help="Print the Batch API details of every job as JSON lines")
 @click.help_option('-h', '--help')
 @click.pass_context
-def list(ctx):
+def list(ctx, details):
     '''
     Reads using SQL API the list of batch API jobs
     leveraging that the JOB_ID is inside a comment
     '''
     carto_obj = ctx.obj['carto']
-    sql = queries.CURRENT_RUNNING
     try:
-        query = carto_obj.execute_sql(sql,format='json')
-        regex = "\/\*\ ([0-9a-z]*-[0-9a-z]*-[0-9a-z]*-[0-9a-z]*-[0-9a-z]*)\ \*\/"
-        for row in query['rows']:
-            for result in re.findall(regex,row['query']):
-                click.echo(result)
+        jobs = running_jobs(carto_obj)
+        if not details:
+            for job_id in jobs:
+                click.echo(job_id)
+            return
 
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            reads = read_jobs(carto_obj, executor, [job_id for job_id in jobs])
     except Exception as e:
         ctx.fail("Error executing your SQL: {}".format(e))
 
+    for job_id, row in jobs.items():
+        job = reads[job_id]
+        if isinstance(job, Exception):
+            job = {'job_id': job_id, 'status': 'unknown', 'error': str(job)}
+        job.update(job_times(job))
+        job['activity'] = {key: row.get(key) for key in
+                           ('pid', 'state', 'wait_event_type', 'query_start')}
+        click.echo(json.dumps(job))
+
 
 
 @click.command(help="Returns details about a job id (JSON)")
@@ -59,6 +75,8 @@ def create(ctx,sql):
         sql = ' '.join(sql)
 
     job_details = carto_obj.batch_create(sql)
+    # The job is not followed, the tables it changes are not known either
+    carto_obj.invalidate_cache(ANY_TABLE)
 
     click.echo(job_details['job_id'])
 
@@ -76,4 +94,184 @@ def cancel(ctx,job_id):
 
     job_details = carto_obj.batch_cancel(job_id)
 
-    click.echo(json.dumps(job_details))
\ No newline at end of file
+    click.echo(json.dumps(job_details))
+
+
+def read_statements(statements_file):
+    '''
+    Reads the jobs to submit from a YAML manifest, a list of jobs or a
+    mapping with a `jobs` key where every job is a query, a list of queries
+    or a mapping with `query` and an optional `name`, or from a plain file
+    with one statement per line
+    '''
+    content = statements_file.read()
+    if statements_file.name.endswith(('.yml', '.yaml')):
+        import yaml
+
+        manifest = yaml.safe_load(content) or []
+        if isinstance(manifest, dict):
+            manifest = manifest.get('jobs', [])
+        jobs = []
+        for index, item in enumerate(manifest, 1):
+            if isinstance(item, dict):
+                jobs.append((item.get('name', str(index)), item['query']))
+            else:
+                jobs.append((str(index), item))
+        return jobs
+
+    lines = [line.strip() for line in content.splitlines()]
+    return [(str(index), line) for index, line
+            in enumerate([line for line in lines if line and not line.startswith('--')], 1)]
+
+
+@click.command(help="Submits many jobs from a file and waits for all of them")
+@click.option('-f', '--file', 'statements_file', type=click.File('r'), default='-',
+              help="File with one statement per line or a YAML manifest (.yml), defaults to stdin")
+@click.option('-c', '--concurrency', default=BATCH_CONCURRENCY, type=click.IntRange(min=1),
+              help="Maximum number of unfinished jobs at the same time")
+@click.help_option('-h', '--help')
+@click.pass_context
+def submit(ctx, statements_file, concurrency):
+    '''
+    Submits the jobs keeping at most `concurrency` of them unfinished,
+    printing every status change and exiting with an error if any job fails
+    '''
+    carto_obj = ctx.obj['carto']
+    jobs = read_statements(statements_file)
+    if not jobs:
+        ctx.fail('No statements to submit')
+
+    names = [name for name, query in jobs]
+    latest = [None] * len(jobs)
+    start = time.time()
+
+    def progress(index, job):
+        latest[index] = job
+        click.echo('{}\t{}\t{}'.format(names[index], job.get('job_id', '-'), job['status']))
+        if job['status'] == 'failed':
+            click.echo('{}: {}'.format(names[index], job.get('failed_reason')), err=True)
+
+        counts = count_states(latest)
+        click.echo('\r[{:.0f}s] '.format(time.time() - start) + ' | '.join(
+            '{} {}'.format(status, counts[status]) for status in sorted(counts)),
+            err=True, nl=not sys.stderr.isatty())
+
+    results = run_jobs(carto_obj, [query for name, query in jobs],
+                       concurrency=concurrency, callback=invalidating(carto_obj, progress))
+    if sys.stderr.isatty():
+        click.echo('', err=True)
+
+    failed = [names[index] for index, job in enumerate(results) if job['status'] != 'done']
+    if failed:
+        ctx.fail('{} of {} jobs did not finish: {}'.format(
+            len(failed), len(jobs), ', '.join(failed)))
+
+
+def invalidating(carto_obj, callback):
+    '''
+    Wraps a JobTracker callback to drop the metadata cache every time a job
+    finishes, as the tables it changed are not known
+    '''
+    def finished(index, job):
+        if job['status'] in FINAL_STATES:
+            carto_obj.invalidate_cache(ANY_TABLE)
+        callback(index, job)
+    return finished
+
+
+def read_job_ids(job_ids):
+    job_ids = [job_id for job_id in job_ids if job_id]
+    if not job_ids and not sys.stdin.isatty():
+        job_ids = sys.stdin.read().split()
+    return job_ids
+
+
+def transition_printer(output):
+    '''
+    Returns a JobTracker callback that prints every status change as a
+    JSON line with the time spent queued and running so far
+    '''
+    seen = {}
+    previous = {}
+
+    def transition(index, job):
+        job_id = job['job_id']
+        status = job['status']
+        now = time.time()
+        seen.setdefault(job_id, {}).setdefault(status, now)
+        record = {
+            'job_id': job_id,
+            'status': status,
+            'previous': previous.get(job_id),
+            'at': round(now, 3),
+        }
+        record.update(job_times(job, seen[job_id]))
+        if status == 'failed':
+            record['failed_reason'] = job.get('failed_reason')
+        previous[job_id] = status
+        output(json.dumps(record))
+
+    return transition
+
+
+@click.command(help="Waits for jobs to finish printing their status changes")
+@click.argument('job_ids', nargs=-1, required=False)
+@click.help_option('-h', '--help')
+@click.pass_context
+def wait(ctx, job_ids):
+    '''
+    Polls the jobs with a growing interval until all of them are finished,
+    exiting with an error if any of them is not done
+    '''
+    carto_obj = ctx.obj['carto']
+    job_ids = read_job_ids(job_ids)
+    if not job_ids:
+        ctx.fail('Missing argument: JOB_IDS.\nEither pass them explicitly or pipe into the command')
+
+    try:
+        results = wait_jobs(carto_obj, job_ids,
+                            callback=invalidating(carto_obj, transition_printer(click.echo)))
+    except Exception as e:
+        ctx.fail("Error reading your jobs: {}".format(e))
+
+    failed = [job['job_id'] for job in results if job['status'] != 'done']
+    if failed:
+        ctx.fail('{} of {} jobs did not finish: {}'.format(
+            len(failed), len(job_ids), ', '.join(failed)))
+
+
+@click.command(help="Follows all your running jobs until they finish")
+@click.option('-f', '--forever', is_flag=True, default=False,
+              help="Keep looking for new jobs instead of exiting when all finish")
+@click.option('-i', '--interval', default=5.0, type=float,
+              help="Seconds to wait for new jobs with --forever")
+@click.help_option('-h', '--help')
+@click.pass_context
+def watch(ctx, forever, interval):
+    '''
+    Finds the running jobs on every polling round and prints the status
+    changes of all of them as JSON lines
+    '''
+    carto_obj = ctx.obj['carto']
+    ids = []
+
+    def find_jobs():
+        found = [job_id for job_id in running_jobs(carto_obj) if job_id not in ids]
+        ids.extend(found)
+        return found
+
+    callback = invalidating(carto_obj, transition_printer(click.echo))
+    try:
+        while True:
+            results = wait_jobs(carto_obj, [], callback=callback, find_jobs=find_jobs)
+            if not forever:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return
+    except Exception as e:
+        ctx.fail("Error reading your jobs: {}".format(e))
+
+    counts = count_states(results)
+    click.echo(' | '.join('{} {}'.format(status, counts[status])
+                          for status in sorted(counts)) or 'No running jobs', err=True)
@@ -0,0 +1,71 @@
+import click
+
+from carto_cli.carto import transfer
+from carto_cli.carto.profiles import CONFIG_FILE, profile_user
+from carto_cli.commands.dataset.dataset import get_cartodbfy_query
+
+
+@click.command(help="Copies a table to another account streaming it in parallel chunks")
+@click.option('--from', 'source_profile',
+              help="Profile of ~/.cartorc.yaml to copy from, defaults to the current account")
+@click.option('--to', 'target_profile',
+              help="Profile of ~/.cartorc.yaml to copy to, defaults to the current account")
+@click.option('--config-file', type=click.Path(dir_okay=False),
+              default=CONFIG_FILE, envvar='CARTO_DB',
+              help="Configuration file with the profiles, defaults to ~/.cartorc.yaml " +
+                   "or the environment variable $CARTO_DB")
+@click.option('-n', '--name', 'target_name',
+              help="Name of the table in the target account, the same by default")
+@click.option('-w', '--workers', default=transfer.COPY_WORKERS, type=int,
+              help="Number of chunks copied at the same time")
+@click.option('-r', '--chunk-rows', default=transfer.COPY_CHUNK_ROWS, type=int,
+              help="Rows of every chunk")
+@click.option('--overwrite', is_flag=True, default=False,
+              help="Replace the table if it exists in the target account")
+@click.option('--no-cartodbfy', is_flag=True, default=False,
+              help="Leave the copied table as a plain Postgres table")
+@click.help_option('-h', '--help')
+@click.argument('table_name')
+@click.pass_context
+def copy(ctx, source_profile, target_profile, config_file, target_name, workers,
+         chunk_rows, overwrite, no_cartodbfy, table_name):
+    '''
+    Streams the rows from the COPY TO of the source account into a COPY FROM
+    of the target one, then creates the indexes and checks the row count
+    '''
+    try:
+        source = profile_user(source_profile, config_file) if source_profile \
+            else ctx.obj['carto']
+        target = profile_user(target_profile, config_file) if target_profile \
+            else ctx.obj['carto']
+    except Exception as e:
+        ctx.fail("Error reading the profiles: {}".format(e))
+    if (target_name or table_name) == table_name and transfer.same_account(source, target):
+        ctx.fail('Pass another account with --from/--to or another --name')
+
+    cartodbfy_query = None if no_cartodbfy else get_cartodbfy_query(
+        org=target.org_name, user=target.user_name, table_name=target_name or table_name)
+
+    def report(step, details):
+        if step == 'create':
+            click.echo("Table {} created with {} columns".format(
+                details['table_name'], details['columns']), err=True)
+        elif step == 'chunk':
+            click.echo("Chunk {} of {}: {:,} rows ({:,} of {:,})".format(
+                details['index'], details['chunks'], details['rows'],
+                details['copied'], details['count']), err=True)
+        else:
+            click.echo("{} cartodbfy and index statements run".format(
+                len(details['statements'])), err=True)
+
+    try:
+        result = transfer.copy_table(source, target, table_name, target_name,
+                                     chunk_rows=chunk_rows, workers=workers,
+                                     overwrite=overwrite, cartodbfy_query=cartodbfy_query,
+                                     callback=report)
+    except Exception as e:
+        ctx.fail("Error copying {}: {}".format(table_name, e))
+
+    click.echo("Table {} copied as {}: {:,} rows in {} chunks and {} seconds".format(
+        result['table_name'], result['target_name'], result['rows'],
+        result['chunks'], result['seconds']))
@@ -1,25 +1,41 @@
 import click
-import json
 import warnings
-import csv
 import os
 import time
-
+import glob
+import gzip
+import re
+import shutil
+import tempfile
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from prettytable import PrettyTable
 from carto_cli.carto import queries
+from carto_cli.carto import chunks
+from carto_cli.carto import convert
+from carto_cli.carto import bulk
+from carto_cli.carto import output
+from carto_cli.carto import incremental as incremental_download
+from carto_cli.carto import staging
+from carto_cli.carto.bulk import BULK_WORKERS
+from carto_cli.carto.cache import ANY_TABLE
+from carto_cli.carto.polling import wait_for_import
+from carto_cli.carto.jobs import BATCH_CONCURRENCY, run_jobs, wait_jobs
 from carto_cli.commands.sql.execute_sql import run as run_sql
 from carto_cli.utils import check_piped_arg
 
-from carto.permissions import PRIVATE, PUBLIC, LINK
-
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-
 warnings.filterwarnings('ignore')
 
 SPLIT_EXPORT = int(os.environ.get("CARTO_SPLIT_EXPORT", 500000))
+EXPORT_WORKERS = int(os.environ.get("CARTO_EXPORT_WORKERS", 4))
+DESCRIBE_WORKERS = int(os.environ.get("CARTO_DESCRIBE_WORKERS", 8))
+MERGE_UNION_ROWS = int(os.environ.get("CARTO_MERGE_UNION_ROWS", 1000000))
+UPLOAD_WORKERS = int(os.environ.get("CARTO_UPLOAD_WORKERS", 4))
+UPLOAD_COMPRESS_SIZE = int(os.environ.get("CARTO_UPLOAD_COMPRESS_SIZE", 10 * 1024 * 1024))
+
+SHAPEFILE_SIDECARS = ('.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx')
+COMPRESSED_EXTENSIONS = ('.zip', '.gz', '.tgz', '.kmz', '.bz2', '.carto')
 
 def prettyMBprint(value):
     try:
@@ -45,22 +61,38 @@ def get_cartodbfy_query(user,org,table_name):
 def get_vrt_type(postgis_type):
     return postgis_type.replace('ST_','wkb')
 
+DATASET_FIELDS = ['name', 'likes', 'locked', 'privacy', 'description', 'license',
+                  'attributions', 'tags', 'size', 'row_count']
+
+VRT_LAYER = '''
+<OGRVRTLayer name="{layer}">
+    <LayerSRS>EPSG:4326</LayerSRS>
+    <SrcDataSource>Carto:{user}</SrcDataSource>
+    <GeometryType>{geomtype}</GeometryType>
+    <SrcLayer>{layer}</SrcLayer>
+</OGRVRTLayer>'''
+
+def write_vrt(user_name, rows, geometry_types):
+    output.echo('<OGRVRTDataSource>')
+    for row in rows:
+        types = geometry_types[row['name']]
+        if types and len(types) == 1:
+            output.echo(VRT_LAYER.format(layer=row['name'], geomtype=get_vrt_type(types[0]),
+                                         user=user_name))
+    output.echo('\r\n</OGRVRTDataSource>\r\n')
+
 @click.command(help="Display all your CARTO datasets")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty','vrt']))
+              type=click.Choice(output.FORMATS + ['vrt']))
 @click.option('-t', '--filter', help="Filter the datasets")
 @click.help_option('-h', '--help')
 @click.pass_context
 def list(ctx, format, filter):
     carto_obj = ctx.obj['carto']
-    manager = carto_obj.get_dataset_manager()
-    try:
-        all_datasets =  manager.all()
-        datasets = [d for d in all_datasets if not filter or d.name.find(filter) > -1]
 
-        dataset_names = [dataset.name for dataset in datasets]
-
-        results = [
+    def fetch_datasets():
+        manager = carto_obj.get_dataset_manager()
+        return [
             {
                 'name': dataset.name,
                 'likes': dataset.likes,
@@ -71,73 +103,45 @@ def list(ctx, format, filter):
                 'attributions': dataset.attributions,
                 'tags': dataset.tags,
                 'size': dataset.table.size,
-                'row_count': dataset.table.row_count
-            } for dataset in datasets
+                'row_count': dataset.table.row_count,
+                'geometry_types': dataset.table.geometry_types
+            } for dataset in manager.all()
         ]
 
-        if format == 'json':
-            raw_result = json.dumps(results)
+    try:
+        all_datasets = carto_obj.cached('datasets', [ANY_TABLE], fetch_datasets)
+        results = [d for d in all_datasets if not filter or d['name'].find(filter) > -1]
+        geometry_types = {row['name']: row.pop('geometry_types') for row in results}
+
+        if format == 'vrt':
+            write_vrt(carto_obj.user_name, results, geometry_types)
+        elif format == 'pretty':
+            output.write_pretty(
+                ({
+                    'name': row['name'],
+                    'privacy': row['privacy'],
+                    'locked': row['locked'],
+                    'likes': row['likes'],
+                    'size': prettyMBprint(row['size']),
+                    'row_count': prettyIntPrint(row['row_count']),
+                    'tags': ", ".join(row['tags'])
+                } for row in results),
+                ['name', 'privacy', 'locked', 'likes', 'size', 'row_count', 'tags'],
+                headers=['Table Name', 'Privacy', 'Locked', 'Likes', 'Size', 'Rows', 'Tags'],
+                align={'name': 'l', 'privacy': 'c', 'locked': 'r', 'likes': 'r',
+                       'size': 'r', 'row_count': 'r', 'tags': 'l'})
         elif format == 'csv':
-            with StringIO() as csvfile:
-                fieldnames = ['name', 'likes', 'locked', 'privacy',
-                              'description', 'license', 'attributions',
-                              'tags', 'size', 'row_count']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                writer.writeheader()
-                for row in results:
-                    row['tags'] = ", ".join(row['tags'])
-                    writer.writerow(row)
-
-                raw_result = csvfile.getvalue()
-        elif format == 'vrt':
-            with StringIO() as vrtfile:
-                vrtfile.write('<OGRVRTDataSource>')
-                for dataset in datasets:
-                    types = dataset.table.geometry_types
-                    if types and len(types) == 1:
-                        geom_type = get_vrt_type(types[0])
-                        template = '''
-<OGRVRTLayer name="{layer}">
-    <LayerSRS>EPSG:4326</LayerSRS>
-    <SrcDataSource>Carto:{user}</SrcDataSource>
-    <GeometryType>{geomtype}</GeometryType>
-    <SrcLayer>{layer}</SrcLayer>
-</OGRVRTLayer>'''.format(layer=dataset.name, geomtype=geom_type, user = carto_obj.user_name)
-
-                        vrtfile.write(template)
-                vrtfile.write('\r\n</OGRVRTDataSource>\r\n')
-                raw_result = vrtfile.getvalue()
+            output.write_csv((dict(row, tags=", ".join(row['tags'])) for row in results),
+                             DATASET_FIELDS)
         else:
-            table_general = PrettyTable(
-                ['Table Name', 'Privacy', 'Locked', 'Likes', 'Size',
-                 'Rows', 'Tags'])
-            table_general.align = "r"
-            table_general.align['Table Name'] = "l"
-            table_general.align['Privacy'] = "c"
-            table_general.align['Tags'] = "l"
-
-            for row in results:
-                table_general.add_row([
-                    row['name'],
-                    row['privacy'],
-                    row['locked'],
-                    row['likes'],
-                    prettyMBprint(row['size']),
-                    prettyIntPrint(row['row_count']),
-                    ", ".join(row['tags'])
-                ])
-
-            raw_result = table_general.get_string()
-
-        click.echo(raw_result, nl=format in ['json', 'pretty'])
+            output.write_rows(results, format)
     except Exception as e:
         ctx.fail("Error retrieving the list of datasets: {}".format(e))
 
 
 @click.command(help="List tables and their main Postgres statistics")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty','vrt']))
+              type=click.Choice(output.FORMATS + ['vrt']))
 @click.option('-t', '--filter', help="Filter the tables")
 @click.help_option('-h', '--help')
 @click.pass_context
@@ -150,38 +154,16 @@ def list_tables(ctx, format, filter):
         schema_name = 'public'
 
     sql = queries.LIST_TABLES.format(schema_name=schema_name,table_name='%{}%'.format(filter if filter else ''))
-    result = carto_obj.execute_sql(sql)
-
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            fieldnames = queries.LIST_TABLES_HEADER
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    result = carto_obj.execute_sql(sql, cache_tables=[ANY_TABLE], columnar=True)
 
-            writer.writeheader()
-            for row in result['rows']:
-                writer.writerow(row)
-
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(queries.LIST_TABLES_HEADER)
-        table_general.align = "r"
-        table_general.align['name'] = "l"
-
-        for row in result['rows']:
-            pretty_row = []
-            for key in queries.LIST_TABLES_HEADER:
-                pretty_row.append(row[key])
-            table_general.add_row(pretty_row)
-
-        raw_result = table_general.get_string()
-
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+    # vrt is only meaningful for the datasets, the tables are printed as pretty
+    output.write_rows(result['rows'], 'pretty' if format == 'vrt' else format,
+                      queries.LIST_TABLES_HEADER,
+                      align=dict({name: 'r' for name in queries.LIST_TABLES_HEADER}, name='l'))
 
 @click.command(help="Shows your dataset attributes and types")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty']))
+              type=click.Choice(output.FORMATS))
 @click.help_option('-h', '--help')
 @click.argument('table_name', callback=check_piped_arg, required=False)
 @click.pass_context
@@ -189,35 +171,14 @@ def schema(ctx, format, table_name):
     carto_obj = ctx.obj['carto']
 
     sql = queries.SCHEMA.format(table_name=table_name)
-    result = carto_obj.execute_sql(sql)
-
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
-
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            fieldnames = ['attribute', 'type']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    result = carto_obj.execute_sql(sql, cache_tables=[table_name])
 
-            writer.writeheader()
-            for row in result['rows']:
-                writer.writerow(row)
-
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(['attribute', 'type'])
-        table_general.align = "l"
-
-        for row in result['rows']:
-            table_general.add_row(row.values())
-
-        raw_result = table_general.get_string()
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+    output.write_rows(result['rows'], format, ['attribute', 'type'])
 
 
 @click.command(help="List your table associated triggers")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty']))
+              type=click.Choice(output.FORMATS))
 @click.help_option('-h', '--help')
 @click.argument('table_name', callback=check_piped_arg, required=False)
 @click.pass_context
@@ -225,36 +186,15 @@ def triggers(ctx, format, table_name):
     carto_obj = ctx.obj['carto']
 
     sql = queries.TRIGGERS.format(table_name=table_name)
-    result = carto_obj.execute_sql(sql)
+    result = carto_obj.execute_sql(sql, cache_tables=[table_name])
     fieldnames = ['tgname']
 
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
-
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            #import ipdb; ipdb.set_trace()
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            writer.writeheader()
-            for row in result['rows']:
-                writer.writerow(row)
-
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(fieldnames)
-        table_general.align = "l"
-
-        for row in result['rows']:
-            table_general.add_row(row.values())
-
-        raw_result = table_general.get_string()
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+    output.write_rows(result['rows'], format, fieldnames)
 
 
 @click.command(help="List your table associated indexes")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty']))
+              type=click.Choice(output.FORMATS))
 @click.help_option('-h', '--help')
 @click.argument('table_name', callback=check_piped_arg, required=False)
 @click.pass_context
@@ -262,69 +202,53 @@ def indexes(ctx, format, table_name):
     carto_obj = ctx.obj['carto']
 
     sql = queries.INDEXES.format(table_name=table_name)
-    result = carto_obj.execute_sql(sql)
+    result = carto_obj.execute_sql(sql, cache_tables=[table_name])
     fieldnames = ['index_name', 'column_name', 'index_type']
 
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
+    output.write_rows(result['rows'], format, fieldnames)
 
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for row in result['rows']:
-                writer.writerow(row)
 
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(fieldnames)
-        table_general.align = "l"
-
-        for row in result['rows']:
-            table_general.add_row(row.values())
 
-        raw_result = table_general.get_string()
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+def submit_table_report(carto_obj, executor, table_name):
+    '''
+    Sends all the independent queries of a table report at once, returning
+    a dictionary of futures
+    '''
+    def rows(query):
+        sql = query.format(schema_name=carto_obj.user_name, table_name=table_name)
+        return carto_obj.execute_sql(sql)['rows']
 
+    return {
+        'metadata': executor.submit(rows, queries.LIST_TABLES),
+        'dataset': executor.submit(carto_obj.get_dataset_manager().get, table_name),
+        'schema': executor.submit(rows, queries.SCHEMA),
+        'indexes': executor.submit(rows, queries.INDEXES),
+        'triggers': executor.submit(rows, queries.TRIGGERS)
+    }
 
 
-@click.command(help="Report of all your table details")
-@click.option('-r','--refresh',is_flag=True,default=False,
-    help="Force statistics refresh")
-@click.help_option('-h', '--help')
-@click.argument('table_name', callback=check_piped_arg, required=False)
-@click.pass_context
-def describe(ctx, refresh, table_name):
-    carto_obj = ctx.obj['carto']
-
+def print_table_report(table_name, report):
     try:
-        if refresh:
-            result = carto_obj.execute_sql('vacuum analyze {}'.format(table_name))
-
-        sql = queries.LIST_TABLES.format(schema_name=carto_obj.user_name,
-                table_name=table_name)
-        result = carto_obj.execute_sql(sql)
-        table_general = PrettyTable(['Property','Value'])
-        table_general.align = "l"
-
-        if not result['rows']:
+        metadata = report['metadata'].result()
+        if not metadata:
             raise Exception('This table does not exist.')
-        else:
-            for row in result['rows']:
-                for key in row.keys():
-                    table_general.add_row([key,row[key]])
-
-        click.echo('\r\n# Report for table: {}'.format(table_name))
-        click.echo('\r\n## Postgres Metadata\r\n')
-        click.echo(table_general.get_string())
     except Exception as e:
         click.echo(e)
-        ctx.fail('Error retrieving information, is your table name correct?')
+        return False
+
+    table_general = PrettyTable(['Property','Value'])
+    table_general.align = "l"
+    for row in metadata:
+        for key in row.keys():
+            table_general.add_row([key,row[key]])
+
+    click.echo('\r\n# Report for table: {}'.format(table_name))
+    click.echo('\r\n## Postgres Metadata\r\n')
+    click.echo(table_general.get_string())
 
-    manager = carto_obj.get_dataset_manager()
     click.echo('\r\n## CARTO Metadata\r\n')
     try:
-        dataset = manager.get(table_name)
+        dataset = report['dataset'].result()
 
         if dataset:
             table_general = PrettyTable(['Property','Value'])
@@ -344,122 +268,432 @@ def describe(ctx, refresh, table_name):
     except Exception as e:
         click.echo("Table is not CartoDBfied")
 
-    click.echo('\r\n## Schema\r\n')
-    ctx.invoke(schema, format = 'pretty', table_name = table_name)
+    sections = [
+        ('Schema', 'schema', ['attribute', 'type']),
+        ('Indexes', 'indexes', ['index_name', 'column_name', 'index_type']),
+        ('Triggers', 'triggers', ['tgname'])
+    ]
+    for title, key, fieldnames in sections:
+        click.echo('\r\n## {}\r\n'.format(title))
+        try:
+            # Short sections, printed without cutting their values
+            output.write_pretty(report[key].result(), fieldnames, max_width=None)
+        except Exception as e:
+            click.echo(e)
+
+    return True
+
+
+@click.command(help="Report of all your table details")
+@click.option('-r','--refresh',is_flag=True,default=False,
+    help="Force statistics refresh")
+@click.option('-t','--tables',
+    help="Comma separated list of tables to describe in the same pass")
+@click.help_option('-h', '--help')
+@click.argument('table_name', callback=check_piped_arg, required=False)
+@click.pass_context
+def describe(ctx, refresh, tables, table_name):
+    carto_obj = ctx.obj['carto']
+    table_names = [name.strip() for name in tables.split(',')] if tables else []
+    if table_name:
+        table_names.insert(0, table_name)
+
+    # Initializes the clients before they are shared between threads
+    carto_obj.get_dataset_manager()
+
+    with ThreadPoolExecutor(max_workers=DESCRIBE_WORKERS) as executor:
+        if refresh:
+            vacuums = [executor.submit(carto_obj.execute_sql,
+                                       'vacuum analyze {}'.format(name))
+                       for name in table_names]
+            for vacuum in vacuums:
+                vacuum.result()
+
+        reports = [(name, submit_table_report(carto_obj, executor, name))
+                   for name in table_names]
 
-    click.echo('\r\n## Indexes\r\n')
-    ctx.invoke(indexes, format = 'pretty', table_name = table_name)
+        found = [print_table_report(name, report) for name, report in reports]
 
-    click.echo('\r\n## Triggers\r\n')
-    ctx.invoke(triggers, format = 'pretty', table_name = table_name)
+    if not all(found):
+        ctx.fail('Error retrieving information, is your table name correct?')
 
 
 
 @click.command(help="Download a dataset")
 @click.help_option('-h', '--help')
 @click.option('-f','--format',default="gpkg",help="Format of your results",
-    type=click.Choice(['gpkg','csv', 'shp','geojson']))
-@click.option('-o','--output',type=click.File('wb'),
+    type=click.Choice(['gpkg','csv', 'shp','geojson'] + sorted(convert.CONVERT_FORMATS)))
+@click.option('-o','--output','output_file',type=click.File('wb', lazy=True),
               help="Output file to generate")
+@click.option('-w','--workers',default=EXPORT_WORKERS,type=int,
+              help="Number of chunks downloaded at the same time")
+@click.option('-r','--resume',is_flag=True,default=False,
+              help="Resume a chunked download, fetching only the missing chunks")
+@click.option('-i','--incremental',is_flag=True,default=False,
+              help="Only fetch the rows added or changed since the last download "
+                   "and merge them into the output (csv and gpkg)")
+@click.option('-k','--key',default='cartodb_id',
+              help="Always growing column used as watermark with --incremental, like updated_at")
+@click.option('--verify',is_flag=True,default=False,
+              help="With --incremental, compare a checksum of the ids with CARTO "
+                   "to remove the deleted rows and fetch the missing ones")
+@click.option('-b','--via-batch',is_flag=True,default=False,
+              help="Copy the table into a staging table with a Batch API job and "
+                   "download it in chunks, for tables that time out on the SQL API")
 @click.argument('table_name', callback=check_piped_arg, required=False)
 @click.pass_context
-def download(ctx, format, output, table_name):
+def download(ctx, format, output_file, workers, resume, incremental, key, verify, via_batch,
+             table_name):
     carto_obj = ctx.obj['carto']
 
-    # Check table size
-    sql = "select count(*) from {}".format(table_name)
-    result = carto_obj.execute_sql(sql)
-    counts = int(result['rows'][0]['count'])
-
-    if counts > SPLIT_EXPORT:
-        click.echo("Table is too big ({}), we need to download it in chunks of {} rows".format(counts, SPLIT_EXPORT))
-        ind = 1
-        base, ext = os.path.splitext(output.name)
-        for i in range(1,counts,SPLIT_EXPORT):
-            sql = '''
-                    select * 
-                      from {table_name}
-                     order by cartodb_id
-                     limit {limit} 
-                    offset {offset}
-                  '''.format(
-                        table_name = table_name,
-                        limit = SPLIT_EXPORT,
-                        offset = i)
-            output = open('{}_{}{}'.format(base,ind,ext),'wb')
-            ctx.invoke(run_sql,
-                format = format,
-                output = output ,
-                explain = False,
-                explain_analyze = False,
-                sql = sql)
-
-            click.echo("Chunk {} exported to {}".format(ind,output.name))
-            ind = ind + 1
+    if output_file is None:
+        ctx.fail('Downloads need an output file, set it with -o')
+
+    if incremental and via_batch:
+        ctx.fail('--incremental and --via-batch can not be used together')
+
+    if incremental:
+        if format not in incremental_download.INCREMENTAL_FORMATS or output_file.name == '-':
+            ctx.fail('Incremental downloads need an output file in one of these formats: {}'.format(
+                ', '.join(incremental_download.INCREMENTAL_FORMATS)))
+        try:
+            summary = incremental_download.download(
+                carto_obj, table_name, output_file.name, format, key=key,
+                chunk_size=SPLIT_EXPORT, workers=workers, verify=verify)
+        except Exception as e:
+            ctx.fail("Error downloading {}: {}".format(table_name, e))
+        click.echo("Table {} merged into {}: {} new or changed rows, {} deleted, "
+                   "{} missing, watermark {}".format(
+                       table_name, output_file.name, summary['rows'], summary['deleted'],
+                       summary['missing'], summary['watermark']))
+        return
+
+    base, ext = os.path.splitext(output_file.name)
+    state = chunks.load_state(base) if resume else None
+    # Staged downloads fetch their chunks from the staging table
+    downloaded = state and state.get('source', state['table_name'])
+    if downloaded and downloaded != table_name:
+        ctx.fail('{} is a download of {}, run it without --resume to start again'.format(
+            chunks.state_path(base), downloaded))
+
+    if state is None and via_batch:
+        def staging_progress(index, job):
+            click.echo("Staging job {} {}".format(job.get('job_id', '-'), job['status']), err=True)
+
+        try:
+            state = staging.plan(carto_obj, table_name, format, base, ext, SPLIT_EXPORT,
+                                 callback=staging_progress)
+        except Exception as e:
+            ctx.fail("Error staging {}: {}".format(table_name, e))
+        click.echo("Table staged as {} with {} rows, we will download it in {} chunks".format(
+            state['staging'], state['count'], len(state['chunks'])))
+
+    elif state is None:
+        # Check table size
+        counts, windows = chunks.plan_chunks(carto_obj, table_name, SPLIT_EXPORT)
+
+        if counts > SPLIT_EXPORT:
+            state = chunks.new_state(table_name, format, counts, windows, base, ext)
+            chunks.save_state(base, state)
+            click.echo("Table is too big ({}), we need to download it in {} chunks of around {} rows".format(
+                counts, len(windows), SPLIT_EXPORT))
+
+    if state:
+        def report(chunk, error):
+            if error:
+                click.echo("Chunk {} failed: {}".format(chunk['index'], error), err=True)
+            else:
+                click.echo("Chunk {} exported to {}".format(chunk['index'], chunk['path']))
+
+        failures = chunks.export_chunks(carto_obj, state, base, workers, callback=report)
+        if failures:
+            ctx.fail("{} chunks failed, run again with --resume to fetch them".format(len(failures)))
+
+        if state.get('staging'):
+            try:
+                staging.finish(carto_obj, state, base)
+            except Exception as e:
+                ctx.fail("Error dropping the staging table {}: {}".format(state['staging'], e))
+            click.echo("Table {} exported, staging table {} dropped".format(
+                table_name, state['staging']))
 
     else:
         ctx.invoke(run_sql,
             format = format,
-            output = output,
+            output = output_file,
             explain = False,
             explain_analyze = False,
             sql = "select * from {}".format(table_name))
-        click.echo("Table {} exported to {}".format(table_name,output.name))
+        click.echo("Table {} exported to {}".format(table_name,output_file.name))
+
+
+
+def expand_upload_paths(paths):
+    '''
+    Returns the URLs and files from a list of URLs, files, glob patterns and
+    directories. Shapefile sidecar files are left out as they are sent
+    along with their .shp file.
+    '''
+    expanded = []
+    for path in paths:
+        if path[:4] == 'http':
+            expanded.append(path)
+            continue
+
+        if os.path.isdir(path):
+            candidates = sorted(os.path.join(path, name) for name in os.listdir(path))
+        elif glob.has_magic(path):
+            candidates = sorted(glob.glob(path))
+        else:
+            candidates = [path]
+
+        for candidate in candidates:
+            name = os.path.basename(candidate)
+            extension = os.path.splitext(name)[1].lower()
+            if os.path.isdir(candidate) or name.startswith('.') or \
+                    (extension in SHAPEFILE_SIDECARS and candidate != path):
+                continue
+            expanded.append(candidate)
+    return expanded
+
+
+def prepare_upload(path, compress_size):
+    '''
+    Returns the file to send for a local path and the temporary directory
+    to remove afterwards, if any. Shapefiles are zipped with their sidecar
+    files and big uncompressed files are gzipped.
+    '''
+    base, extension = os.path.splitext(path)
+    extension = extension.lower()
+
+    if extension == '.shp':
+        tmp_dir = tempfile.mkdtemp()
+        archive = os.path.join(tmp_dir, os.path.basename(base) + '.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for sidecar in ('.shp',) + SHAPEFILE_SIDECARS:
+                for candidate in (base + sidecar, base + sidecar.upper()):
+                    if os.path.exists(candidate):
+                        zip_file.write(candidate, os.path.basename(candidate))
+                        break
+        return archive, tmp_dir
+
+    if compress_size and extension not in COMPRESSED_EXTENSIONS and \
+            os.path.getsize(path) > compress_size:
+        tmp_dir = tempfile.mkdtemp()
+        archive = os.path.join(tmp_dir, os.path.basename(path) + '.gz')
+        with open(path, 'rb') as source, \
+                gzip.open(archive, 'wb', compresslevel=1) as target:
+            shutil.copyfileobj(source, target)
+        return archive, tmp_dir
+
+    return path, None
+
+
+def upload_resource(carto_obj, path, sync, compress_size):
+    '''
+    Imports a URL or a local file waiting for the import to finish and
+    returns the details for the summary
+    '''
+    start = time.time()
+    details = {'path': path, 'size': None, 'sent': None}
+    tmp_dir = None
+    try:
+        if path[:4] == 'http':
+            if sync:
+                job = carto_obj.get_sync_manager().create(path, sync)
+            else:
+                job = carto_obj.import_file(path)
+        else:
+            details['size'] = os.path.getsize(path)
+            archive, tmp_dir = prepare_upload(path, compress_size)
+            details['sent'] = os.path.getsize(archive)
+            with open(archive, 'rb') as archive_file:
+                job = carto_obj.import_file(archive_file)
+
+        wait_for_import(job)
+        if job.state == 'failure':
+            details['error'] = 'Import failed ({}): {}'.format(
+                job.error_code, getattr(job, 'error_message', None) or job.get_error_text)
+        else:
+            details['table'] = getattr(job, 'table_name', None) or getattr(job, 'name', None)
+    except Exception as e:
+        details['error'] = str(e)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
+    details['seconds'] = time.time() - start
+    return details
 
 
-@click.command(help="Upload a new dataset from a file on your computer")
+@click.command(help="Upload new datasets from files, directories, glob patterns or URLs")
 @click.help_option('-h', '--help')
 @click.option('-s','--sync',default=None,help="Seconds between sync updates",
     type=int)
-@click.argument('path', callback=check_piped_arg, required=False)
+@click.option('-w','--workers',default=UPLOAD_WORKERS,type=int,
+              help="Number of files uploaded at the same time")
+@click.option('-z','--compress-size',default=UPLOAD_COMPRESS_SIZE,type=int,
+              help="Gzip files bigger than this number of bytes before sending them, 0 to disable")
+@click.argument('paths', nargs=-1, callback=check_piped_arg, required=False)
 @click.pass_context
-def upload(ctx, sync, path):
+def upload(ctx, sync, workers, compress_size, paths):
     carto_obj = ctx.obj['carto']
 
-    # Check the resource
-    if path[:4] == 'http':
-        sync_manager = carto_obj.get_sync_manager()
-        if sync:
-            task = sync_manager.create(path,sync)
-            click.echo("You can safely abort now if you don't want to wait for the import to finish")
-
-            # Check the import
-            sync_id = task.get_id()
-            while(task.state != 'success'):
-                time.sleep(5)
-                click.echo("Checking status of the import...")
-                task.refresh()
-                if (task.state == 'failure'):
-                    print('The error code is: ' + str(task.error_code))
-                    print('The error message is: ' + str(task.error_message))
-                    break
-            click.echo("Dataset imported!")
+    if not isinstance(paths, tuple):
+        paths = paths.splitlines()
+    resources = expand_upload_paths(paths)
+
+    missing = [path for path in resources
+               if path[:4] != 'http' and not os.path.exists(path)]
+    if not resources or missing:
+        ctx.fail("The resource provided is not a valid URL or an existing file: {}".format(
+            ', '.join(missing)))
+
+    if sync:
+        click.echo("You can safely abort now if you don't want to wait for the import to finish")
+
+    # Initializes the clients before they are shared between threads
+    carto_obj.get_sync_manager()
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(upload_resource, carto_obj, path, sync, compress_size)
+                   for path in resources]
+        for future in as_completed(futures):
+            details = future.result()
+            results.append(details)
+            if 'error' in details:
+                click.echo("{} failed: {}".format(details['path'], details['error']), err=True)
+            else:
+                click.echo("{} imported as {}".format(details['path'], details['table']))
+
+    carto_obj.invalidate_cache()
+
+    table_general = PrettyTable(['File', 'Size', 'Sent', 'Seconds', 'MB/s', 'Result'])
+    table_general.align = "r"
+    table_general.align['File'] = "l"
+    table_general.align['Result'] = "l"
+    for details in sorted(results, key=lambda details: details['path']):
+        if details['size']:
+            throughput = "{:.2f}".format(
+                details['size'] / (1024.0 * 1024) / max(details['seconds'], 0.001))
         else:
-            task = carto_obj.upload(path)
+            throughput = ''
+        table_general.add_row([
+            details['path'],
+            prettyMBprint(details['size']) if details['size'] is not None else '',
+            prettyMBprint(details['sent']) if details['sent'] is not None else '',
+            "{:.1f}".format(details['seconds']),
+            throughput,
+            details.get('error') or details['table']
+        ])
+    click.echo(table_general.get_string())
+
+    total_sent = sum(details['sent'] or 0 for details in results)
+    failed = [details for details in results if 'error' in details]
+    click.echo("{} resources, {} imported, {} failed, {} sent".format(
+        len(results), len(results) - len(failed), len(failed), prettyMBprint(total_sent)))
+    if failed:
+        ctx.exit(1)
+
+
+def bulk_options(command):
+    '''
+    Options of the commands that work on many datasets at once
+    '''
+    options = [
+        click.option('-g', '--glob', 'pattern',
+                     help="Also work on the datasets matching this pattern, like 'tmp_*'"),
+        click.option('-n', '--dry-run', is_flag=True, default=False,
+                     help="Print the datasets that would change without changing them"),
+        click.option('-w', '--workers', default=BULK_WORKERS, type=int,
+                     help="Number of datasets changed at the same time"),
+        click.option('--failures', type=click.File('w'),
+                     help="Write the names that failed to this file, pipe it into "
+                          "the same command to retry them"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
 
 
-    elif os.path.exists(path):
-        task = carto_obj.upload(path)
-        click.echo("Local resource uploaded!")
-    else:
-        ctx.fail("The resource provided is not a valid URL or an existing file")
+def dataset_lookup(carto_obj, names, pattern=None):
+    '''
+    Returns the names of the datasets to select from and a function giving
+    the dataset of a name. The datasets of the account are listed only once
+    for a pattern or several names, a single name is fetched on its own.
+    '''
+    manager = carto_obj.get_dataset_manager()
+    if not pattern and len(names) <= 1:
+        def get(name):
+            dataset = manager.get(name)
+            if not dataset:
+                raise Exception('The dataset does not exist!')
+            return dataset
+        return names, get
+
+    datasets = {dataset.name: dataset for dataset in manager.all()}
+
+    def lookup(name):
+        if name not in datasets:
+            raise Exception('The dataset does not exist!')
+        return datasets[name]
+    return datasets, lookup
+
+
+def run_bulk(ctx, names, operation, action, dry_run, workers, failures):
+    '''
+    Applies an operation to every name printing a line per result and a
+    summary, and exits with an error if any of them failed. The operations
+    invalidate the cache of what they change, as this does not return then.
+    '''
+    if not names:
+        ctx.fail('Missing argument: no datasets selected.\n'
+                 'Pass their names, a --glob pattern or pipe them into the command')
+
+    if dry_run:
+        for name in names:
+            click.echo("{}\twould {}".format(name, action))
+        return []
+
+    def report(result):
+        if result['status'] == 'ok':
+            click.echo("{}\t{}".format(result['name'], result['result']))
+        else:
+            click.echo("{}\tfailed: {}".format(result['name'], result['error']), err=True)
 
+    results = bulk.apply(names, operation, workers=workers, callback=report)
+    failed = bulk.write_failures(failures, results) if failures else \
+        len([result for result in results if result['status'] == 'failed'])
+    if len(names) > 1:
+        click.echo("{} datasets, {} done, {} failed".format(
+            len(results), len(results) - failed, failed), err=True)
+    if failed:
+        ctx.exit(1)
+    return results
 
-@click.command(help="Deletes a dataset from your account")
+
+@click.command(help="Deletes datasets from your account")
 @click.help_option('-h', '--help')
-@click.argument('table_name', callback=check_piped_arg, required=False)
+@bulk_options
+@click.argument('table_names', nargs=-1, required=False)
 @click.pass_context
-def delete(ctx, table_name):
+def delete(ctx, pattern, dry_run, workers, failures, table_names):
+    '''
+    Deletes the datasets passed as arguments, piped one per line or
+    matching a pattern, listing the datasets of the account only once
+    '''
     carto_obj = ctx.obj['carto']
+    names = bulk.read_names(table_names, not pattern)
+    available, get_dataset = dataset_lookup(carto_obj, names, pattern)
+    names = bulk.select_names(available, names, pattern)
 
-    dataset_manager = carto_obj.get_dataset_manager()
-    dataset = dataset_manager.get(table_name)
-    if dataset:
-        dataset.delete()
-        click.echo("Dataset deleted!")
-    else:
-        ctx.fail('The dataset does not exist!')
+    def delete_dataset(name):
+        get_dataset(name).delete()
+        carto_obj.invalidate_cache(name)
+        return 'deleted'
+
+    run_bulk(ctx, names, delete_dataset, 'be deleted', dry_run, workers, failures)
 
 
 @click.command(help="Edit dataset properties")
@@ -473,13 +707,24 @@ def delete(ctx, table_name):
 @click.option('-l', '--license', help="Set your dataset license")
 @click.option('-a', '--attributions', help="Set your dataset attributions")
 @click.option('-t', '--tags', help="Set your dataset tags, use commas to separate them")
-@click.argument('dataset_name', callback=check_piped_arg, required=False)
+@bulk_options
+@click.argument('dataset_names', nargs=-1, required=False)
 @click.pass_context
-def edit(ctx, description, privacy, locked, license, attributions, tags, dataset_name):
+def edit(ctx, description, privacy, locked, license, attributions, tags,
+         pattern, dry_run, workers, failures, dataset_names):
+    '''
+    Edits the datasets passed as arguments, piped one per line or matching
+    a pattern, listing the datasets of the account only once
+    '''
+    from carto.permissions import PRIVATE, PUBLIC, LINK
+
     carto_obj = ctx.obj['carto']
-    dataset_manager = carto_obj.get_dataset_manager()
-    try:
-        dataset = dataset_manager.get(dataset_name)
+    names = bulk.read_names(dataset_names, not pattern)
+    available, get_dataset = dataset_lookup(carto_obj, names, pattern)
+    names = bulk.select_names(available, names, pattern)
+
+    def edit_dataset(name):
+        dataset = get_dataset(name)
         if privacy:
             if privacy == 'PRIVATE':
                 dataset.privacy = PRIVATE
@@ -499,82 +744,215 @@ def edit(ctx, description, privacy, locked, license, attributions, tags, dataset
             dataset.tags = tags.split(',')
 
         dataset.save()
-        click.echo("Dataset edited!")
-    except:
-        ctx.fail('The dataset does not exist!')
+        carto_obj.invalidate_cache(name)
+        return 'edited'
+
+    run_bulk(ctx, names, edit_dataset, 'be edited', dry_run, workers, failures)
 
-@click.command(help="Renames a dataset from your account")
+
+@click.command(help="Renames datasets from your account")
 @click.help_option('-h', '--help')
-@click.argument('old')
-@click.argument('new')
+@click.option('-s', '--sub', nargs=2, default=None,
+              help="Rename the datasets replacing a regular expression, like -s '^tmp_' ''")
+@bulk_options
+@click.argument('names', nargs=-1, required=False)
 @click.pass_context
-def rename(ctx, old, new):
+def rename(ctx, sub, pattern, dry_run, workers, failures, names):
+    '''
+    Renames OLD NEW, every "OLD NEW" line piped into the command or, with
+    --sub, the datasets passed as arguments, piped or matching a pattern
+    '''
     carto_obj = ctx.obj['carto']
-    dataset_manager = carto_obj.get_dataset_manager()
-    dataset = dataset_manager.get(old)
-    if dataset:
+
+    if sub:
+        regex = re.compile(sub[0])
+        olds = bulk.read_names(names, not pattern)
+        available, get_dataset = dataset_lookup(carto_obj, olds, pattern)
+        olds = bulk.select_names(available, olds, pattern)
+        renames = ['{} {}'.format(old, regex.sub(sub[1], old)) for old in olds]
+        renames = [item for item in renames if item.split()[0] != item.split()[-1]]
+    else:
+        if len(names) == 2:
+            renames = [' '.join(names)]
+        elif not names:
+            renames = bulk.read_names(names)
+        else:
+            ctx.fail('Pass OLD NEW, pipe "OLD NEW" lines or use --sub')
+        available, get_dataset = dataset_lookup(
+            carto_obj, [item.split()[0] for item in renames])
+
+    def rename_dataset(item):
+        if len(item.split()) != 2:
+            raise Exception('Expected "OLD NEW", got "{}"'.format(item))
+        old, new = item.split()
+        dataset = get_dataset(old)
         dataset.name = new
         dataset.save()
-        click.echo("Dataset renamed!")
-    else:
-        ctx.fail('The dataset does not exist!')
+        carto_obj.invalidate_cache(old)
+        carto_obj.invalidate_cache(new)
+        return 'renamed to {}'.format(new)
+
+    run_bulk(ctx, renames, rename_dataset, 'be renamed', dry_run, workers, failures)
+
+
+
+def merge_columns(carto_obj, tables):
+    '''
+    Returns the columns of the first table, except cartodb_id, and a
+    dictionary with the differences of every table whose columns or types
+    do not match them
+    '''
+    sql = queries.TABLES_SCHEMA.format(
+        table_names=','.join("'{}'".format(table) for table in tables))
+    result = carto_obj.execute_sql(sql, do_post=True)
+
+    schemas = dict((table, []) for table in tables)
+    for row in result['rows']:
+        if row['attribute'] != 'cartodb_id':
+            schemas[row['table_name']].append((row['attribute'], row['type']))
+
+    reference = schemas[tables[0]]
+    differences = {}
+    for table in tables[1:]:
+        missing = set(reference) - set(schemas[table])
+        extra = set(schemas[table]) - set(reference)
+        if missing or extra:
+            differences[table] = (sorted(missing), sorted(extra))
+
+    return [attribute for attribute, type in reference], differences
+
 
+def job_reporter(names):
+    '''
+    Returns a job tracker callback that prints every status change of the
+    jobs with the seconds since they were submitted
+    '''
+    started = {}
+
+    def report(index, job):
+        started.setdefault(index, time.time())
+        click.echo("{}\t{}\t{:.1f}s".format(names[index], job['status'],
+                                              time.time() - started[index]))
+        if job.get('failed_reason'):
+            click.echo("{}: {}".format(names[index], job['failed_reason']), err=True)
+    return report
 
 
 @click.command(help="Merges a number of datasets")
 @click.help_option('-h', '--help')
+@click.option('-s','--strategy',default='auto',
+              type=click.Choice(['auto', 'union', 'parallel']),
+              help="Merge with one UNION ALL statement, with a parallel job per table "
+                   "or choose by the number of rows (auto)")
+@click.option('-c','--concurrency',default=BATCH_CONCURRENCY,type=click.IntRange(min=1),
+              help="Maximum number of parallel insert jobs")
+@click.option('-w','--wait',is_flag=True,default=False,
+              help="Wait for the union job to finish, parallel merges always wait")
 @click.argument('table_name_prefix')
 @click.argument('new_table_name')
 @click.pass_context
-def merge(ctx, table_name_prefix,new_table_name):
+def merge(ctx, strategy, concurrency, wait, table_name_prefix, new_table_name):
     carto_obj = ctx.obj['carto']
     # get the list of tables
     sql = queries.LIST_TABLES.format(schema_name=carto_obj.user_name,table_name='{}%'.format(table_name_prefix))
     result = carto_obj.execute_sql(sql)
     tables = [row['name'] for row in result['rows']]
+    total_rows = sum(int(row['stats_live_tup'] or 0) for row in result['rows'])
+
+    if not tables:
+        ctx.fail('There are no tables starting with {}'.format(table_name_prefix))
 
     click.echo("Tables to merge:")
     for table in tables:
         click.echo("\t{}".format(table))
 
-
-    # get the list of columns from the first table
-    sql = queries.SCHEMA.format(table_name=tables[0])
-    result = carto_obj.execute_sql(sql)
-    columns = ",".join([row['attribute'] for row in result['rows'] if row['attribute'] != 'cartodb_id'])
-
-    # build the list of queries
-    query_list = [
-        'CREATE TABLE {} AS SELECT {} FROM {}'.format(new_table_name,columns,tables[0])
-    ]
-    for table in tables[1:]:
-        query_list.append('''INSERT INTO {first_table} SELECT {columns} FROM {table}'''.format(
-                first_table = new_table_name,
-                columns = columns,
-                table = table
-            ))
-
-    # add cartodbfication of the new table
-    query_list.append(get_cartodbfy_query(org=carto_obj.org_name,
+    # check that all the tables have the columns of the first one
+    columns, differences = merge_columns(carto_obj, tables)
+    if differences:
+        for table, (missing, extra) in sorted(differences.items()):
+            click.echo("{} lacks [{}] and adds [{}] compared to {}".format(
+                table,
+                ', '.join('{} {}'.format(*column) for column in missing),
+                ', '.join('{} {}'.format(*column) for column in extra),
+                tables[0]), err=True)
+        ctx.fail('The tables to merge do not have the same columns')
+    columns = ",".join(columns)
+
+    if strategy == 'auto':
+        strategy = 'union' if total_rows <= MERGE_UNION_ROWS else 'parallel'
+    click.echo("Merging around {:,} rows with the {} strategy".format(total_rows, strategy))
+
+    cartodbfy_query = get_cartodbfy_query(org=carto_obj.org_name,
         user=carto_obj.user_name,
-        table_name = new_table_name))
-
-    # start a batch sql api job
-    job_details = carto_obj.batch_create(query_list)
-    click.echo("Batch SQL API job launched to merge all tables")
-    click.echo(job_details['job_id'])
-
-@click.command(help="Runs the cartodbfication of a table to convert it into a dataset")
+        table_name = new_table_name)
+
+    start = time.time()
+    if strategy == 'union':
+        # one statement and the cartodbfication in a single job
+        query_list = [
+            'CREATE TABLE {} AS {}'.format(new_table_name, ' UNION ALL '.join(
+                'SELECT {} FROM {}'.format(columns, table) for table in tables)),
+            cartodbfy_query
+        ]
+        job_details = carto_obj.batch_create(query_list)
+        click.echo("Batch SQL API job launched to merge all tables")
+        click.echo(job_details['job_id'])
+        if not wait:
+            # Nothing follows the job, the table is dropped from the cache now
+            carto_obj.invalidate_cache(new_table_name)
+            return
+        results = wait_jobs(carto_obj, [job_details['job_id']],
+                            callback=job_reporter([new_table_name]))
+        carto_obj.invalidate_cache(new_table_name)
+    else:
+        # an empty table and a job per table inserting into it
+        carto_obj.execute_sql('CREATE TABLE {} AS SELECT {} FROM {} WITH NO DATA'.format(
+            new_table_name, columns, tables[0]), do_post=True)
+        carto_obj.invalidate_cache(new_table_name)
+        results = run_jobs(carto_obj, [
+                'INSERT INTO {} SELECT {} FROM {}'.format(new_table_name, columns, table)
+                for table in tables
+            ], concurrency=concurrency, callback=job_reporter(tables))
+        carto_obj.invalidate_cache(new_table_name)
+
+        failed = [table for table, job in zip(tables, results) if job['status'] != 'done']
+        if failed:
+            ctx.fail("The rows of {} could not be inserted into {}".format(
+                ', '.join(failed), new_table_name))
+
+        results = run_jobs(carto_obj, [cartodbfy_query],
+                           callback=job_reporter(['cartodbfy']))
+        carto_obj.invalidate_cache(new_table_name)
+
+    if results[-1]['status'] != 'done':
+        ctx.fail("The merge job did not finish: {}".format(results[-1]['status']))
+    click.echo("Tables merged into {} in {:.1f} seconds".format(new_table_name, time.time() - start))
+
+@click.command(help="Runs the cartodbfication of tables to convert them into datasets")
 @click.help_option('-h', '--help')
-@click.argument('table_name', callback=check_piped_arg, required=False)
+@bulk_options
+@click.argument('table_names', nargs=-1, required=False)
 @click.pass_context
-def cartodbfy(ctx, table_name):
+def cartodbfy(ctx, pattern, dry_run, workers, failures, table_names):
+    '''
+    Launches a Batch SQL API job per table, passed as arguments, piped one
+    per line or matching a pattern, and prints their ids
+    '''
     carto_obj = ctx.obj['carto']
+    names = bulk.read_names(table_names, not pattern)
+    if pattern:
+        schema_name = carto_obj.user_name if carto_obj.org_name else 'public'
+        sql = queries.LIST_TABLES.format(schema_name=schema_name, table_name='%')
+        tables = [row['name'] for row in carto_obj.execute_sql(sql)['rows']]
+        names = bulk.select_names(tables, names, pattern)
+
+    def cartodbfy_table(name):
+        job_details = carto_obj.batch_create(get_cartodbfy_query(
+            org=carto_obj.org_name,
+            user=carto_obj.user_name,
+            table_name=name
+            ))
+        carto_obj.invalidate_cache(name)
+        return job_details['job_id']
 
-    job_details = carto_obj.batch_create(get_cartodbfy_query(
-        org=carto_obj.org_name,
-        user=carto_obj.user_name,
-        table_name = table_name
-        ))
-    click.echo("Batch SQL API job launched to cartodbfy the table")
-    click.echo(job_details['job_id'])
+    run_bulk(ctx, names, cartodbfy_table, 'be cartodbfied', dry_run, workers, failures)
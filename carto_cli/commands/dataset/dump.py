@@ -0,0 +1,60 @@
+import click
+import os
+
+from carto_cli.carto import dump as account_dump
+from carto_cli.carto import queries
+from carto_cli.commands.dataset.dataset import SPLIT_EXPORT, EXPORT_WORKERS, prettyMBprint
+
+
+@click.command(help="Exports all your tables into a directory with a manifest")
+@click.option('-d', '--directory', default='.', type=click.Path(file_okay=False),
+              help="Directory to write the tables and the manifest.json to")
+@click.option('-f', '--format', default="gpkg", type=click.Choice(sorted(account_dump.EXTENSIONS)),
+              help="Format of the exported tables")
+@click.option('-t', '--filter', help="Only export the tables containing this text")
+@click.option('-w', '--workers', default=account_dump.DUMP_WORKERS, type=int,
+              help="Number of tables exported at the same time")
+@click.option('-c', '--chunk-workers', default=EXPORT_WORKERS, type=int,
+              help="Number of chunks of a big table downloaded at the same time")
+@click.option('-r', '--chunk-rows', default=SPLIT_EXPORT, type=int,
+              help="Tables with more rows are exported in chunks of this size")
+@click.help_option('-h', '--help')
+@click.pass_context
+def dump(ctx, directory, format, filter, workers, chunk_workers, chunk_rows):
+    '''
+    Lists the tables once and exports the ones missing from the manifest,
+    so running it again resumes an interrupted dump
+    '''
+    carto_obj = ctx.obj['carto']
+    schema_name = carto_obj.user_name if carto_obj.org_name else 'public'
+    sql = queries.LIST_TABLES.format(schema_name=schema_name,
+                                     table_name='%{}%'.format(filter if filter else ''))
+    try:
+        table_names = [row['name'] for row in carto_obj.execute_sql(sql)['rows']]
+    except Exception as e:
+        ctx.fail("Error listing your tables: {}".format(e))
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    def report(table_name, entry, error):
+        if error:
+            click.echo("{} failed: {}".format(table_name, error), err=True)
+        else:
+            click.echo("{}\t{} rows\t{} files\t{}\t{}s".format(
+                table_name, entry['rows'] if entry['rows'] is not None else '?',
+                len(entry['files']),
+                prettyMBprint(sum(item['bytes'] for item in entry['files'])),
+                entry['seconds']))
+
+    try:
+        manifest, errors = account_dump.dump(
+            carto_obj, table_names, directory, format, workers=workers,
+            chunk_rows=chunk_rows, chunk_workers=chunk_workers, callback=report)
+    except Exception as e:
+        ctx.fail("Error dumping your tables: {}".format(e))
+
+    click.echo("{} tables, {} in the manifest, {} failed".format(
+        len(table_names), len(manifest['tables']), len(errors)), err=True)
+    if errors:
+        ctx.fail("Run the same command again to retry the tables that failed")
@@ -0,0 +1,85 @@
+import click
+import json
+
+from prettytable import PrettyTable
+
+from carto_cli.carto import health as table_health
+from carto_cli.carto.jobs import BATCH_CONCURRENCY, run_jobs
+
+
+def pretty_health(rows):
+    table = PrettyTable(['Table', 'Score', 'Rows', 'Dead rows', 'Table MB', 'Indexes MB',
+                         'TOAST MB', 'Seq / idx scans', 'Issues'])
+    table.align = 'r'
+    table.align['Table'] = 'l'
+    table.align['Issues'] = 'l'
+    for row in rows:
+        table.add_row([
+            row['name'],
+            '{:.2f}'.format(row['score']),
+            '{:,}'.format(row['live_tup'] or 0),
+            '{:,}'.format(row['dead_tup'] or 0),
+            '{:.2f}'.format((row['table_size'] or 0) / table_health.MEGABYTE),
+            '{:.2f}'.format((row['indexes_size'] or 0) / table_health.MEGABYTE),
+            '{:.2f}'.format((row['toast_size'] or 0) / table_health.MEGABYTE),
+            '{} / {}'.format(row['seq_scan'] or 0, row['idx_scan']),
+            '\n'.join(row['issues'])
+        ])
+    return table.get_string()
+
+
+@click.command(help="Ranks your tables by bloat, stale statistics and missing indexes")
+@click.option('-f', '--format', default="pretty", type=click.Choice(['pretty', 'json']),
+              help="Format of the report")
+@click.option('-t', '--filter', help="Filter the tables")
+@click.option('-n', '--top', default=20, type=int,
+              help="Number of tables to report")
+@click.option('-q', '--queue', is_flag=True, default=False,
+              help="Queue a Batch API job per reported table with its VACUUM ANALYZE "
+                   "and CREATE INDEX statements")
+@click.option('-d', '--dry-run', is_flag=True, default=False,
+              help="Print the statements that --queue would run")
+@click.option('-c', '--concurrency', default=BATCH_CONCURRENCY, type=click.IntRange(min=1),
+              help="Maximum number of unfinished jobs at the same time")
+@click.help_option('-h', '--help')
+@click.pass_context
+def health(ctx, format, filter, top, queue, dry_run, concurrency):
+    '''
+    Reads the statistics, sizes and indexes of all the tables at once and
+    reports the ones with issues, the biggest expected payoff first
+    '''
+    carto_obj = ctx.obj['carto']
+    try:
+        rows = table_health.rank(table_health.table_health(carto_obj, filter))[:top]
+    except Exception as e:
+        ctx.fail("Error reading the statistics of your tables: {}".format(e))
+
+    if format == 'json':
+        click.echo(json.dumps(rows))
+    elif rows:
+        click.echo(pretty_health(rows))
+    else:
+        click.echo('No issues found')
+
+    # One multi query job per table: its statements run one after the other,
+    # and the jobs of different tables run in parallel
+    fixes = [row for row in rows if row['statements']]
+    if dry_run:
+        for row in fixes:
+            for statement in row['statements']:
+                click.echo(statement, err=format == 'json')
+    if not queue or dry_run or not fixes:
+        return
+
+    def progress(index, job):
+        click.echo('{}\t{}\t{}'.format(fixes[index]['name'], job.get('job_id', '-'),
+                                       job['status']), err=True)
+
+    results = run_jobs(carto_obj, [row['statements'] for row in fixes],
+                       concurrency=concurrency, callback=progress)
+    for row in fixes:
+        carto_obj.invalidate_cache(row['name'])
+
+    failed = [row['name'] for row, job in zip(fixes, results) if job['status'] != 'done']
+    if failed:
+        ctx.fail('The jobs of {} did not finish'.format(', '.join(failed)))
@@ -1,20 +1,50 @@
 import click
 import json
-import csv
+import os
+import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from prettytable import PrettyTable
 from carto_cli.carto import queries
+from carto_cli.carto import convert
+from carto_cli.carto import activity
+from carto_cli.carto import output
+from carto_cli.carto.cache import ANY_TABLE
+from carto_cli.carto.statements import split_statements, is_read_only
 from carto_cli.utils import check_piped_arg
 
+SERVER_FORMATS = ['csv', 'shp', 'json', 'gpkg', 'geojson']
 
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
+FORMAT_EXTENSIONS = {
+    'csv': '.csv', 'shp': '.zip', 'json': '.json', 'gpkg': '.gpkg',
+    'geojson': '.geojson', 'ndjson': '.ndjson', 'geojsonseq': '.geojsons',
+    'parquet': '.parquet', 'arrow': '.arrow'
+}
+
+
+def export_sql(carto_obj, sql, output, format):
+    '''
+    Writes the result of a query into a file as it is received, converting
+    it locally when the format is not one of the SQL API
+    '''
+    if format in convert.CONVERT_FORMATS:
+        convert.convert_sql(carto_obj, sql, output, format)
+    else:
+        carto_obj.stream_sql(sql, output, format=format)
+
+
+def invalidate_written(carto_obj, sql):
+    '''
+    Drops the whole metadata cache after a statement that may change tables
+    '''
+    if not is_read_only(sql):
+        carto_obj.invalidate_cache(ANY_TABLE)
 
 @click.command(help="Execute a SQL passed as a string")
-@click.option('-f','--format',default="json",help="Format of your results",
-    type=click.Choice(['csv', 'shp','json','gpkg','geojson']))
+@click.option('-f','--format',default="json",
+    help="Format of your results, ndjson, geojsonseq, parquet and arrow are converted locally",
+    type=click.Choice(SERVER_FORMATS + sorted(convert.CONVERT_FORMATS)))
 @click.option('-o','--output',type=click.File('wb'),
               help="Output file to generate instead of printing directly")
 @click.option('-e','--explain',is_flag=True,default=False,help="Explains the query")
@@ -39,6 +69,16 @@ def run(ctx,format,output,explain,explain_analyze,explain_analyze_json,sql):
             sql = "EXPLAIN (ANALYZE, COSTS, VERBOSE, BUFFERS, FORMAT JSON) " + sql
             format = 'json'
 
+        if format in convert.CONVERT_FORMATS:
+            if not output and format in convert.BINARY_FORMATS:
+                raise Exception('the {} format needs an output file'.format(format))
+            export_sql(carto_obj, sql, output or click.get_binary_stream('stdout'), format)
+            return
+
+        if output and not (explain or explain_analyze or explain_analyze_json):
+            export_sql(carto_obj, sql, output, format)
+            return
+
         result = carto_obj.execute_sql(sql,format=format,do_post=True)
 
         if explain or explain_analyze:
@@ -54,15 +94,123 @@ def run(ctx,format,output,explain,explain_analyze,explain_analyze_json,sql):
             click.echo(result,nl=format=='json')
     except Exception as e:
         ctx.fail("Error executing your SQL: {}".format(e))
+    finally:
+        invalidate_written(carto_obj, sql)
+
+
+def run_statement(carto_obj, index, sql, format, output_dir):
+    '''
+    Runs one statement of run_many returning its NDJSON record, with the
+    result or the file it was written to
+    '''
+    record = {'index': index, 'sql': sql}
+    start = time.time()
+    try:
+        if output_dir:
+            path = os.path.join(output_dir, '{}{}'.format(index, FORMAT_EXTENSIONS[format]))
+            with open(path + '.part', 'wb') as output:
+                export_sql(carto_obj, sql, output, format)
+            os.replace(path + '.part', path)
+            record['path'] = path
+            record['bytes'] = os.path.getsize(path)
+        else:
+            record['result'] = carto_obj.execute_sql(sql, format=format, do_post=True)
+    except Exception as e:
+        record['error'] = str(e)
+    invalidate_written(carto_obj, sql)
+    record['seconds'] = round(time.time() - start, 3)
+    return record
+
+
+def run_in_order(carto_obj, statements, format, output_dir):
+    for index, sql in enumerate(statements, 1):
+        yield run_statement(carto_obj, index, sql, format, output_dir)
+
+
+def run_concurrently(carto_obj, statements, format, output_dir, concurrency):
+    '''
+    Runs up to `concurrency` statements at the same time yielding their
+    records as they finish
+    '''
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_statement, carto_obj, index, sql, format, output_dir)
+                   for index, sql in enumerate(statements, 1)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+@click.command(help="Execute many SQL statements from a file, one after the other or concurrently")
+@click.option('-i', '--input', 'statements_file', type=click.File('r'), default='-',
+              help="File with the statements separated by semicolons or new lines (default stdin)")
+@click.option('-d', '--delimiter', default='auto',
+              type=click.Choice(['auto', 'semicolon', 'newline']),
+              help="How statements are separated, auto uses semicolons if there are any")
+@click.option('-f', '--format', default="json",
+              type=click.Choice(SERVER_FORMATS + sorted(convert.CONVERT_FORMATS)),
+              help="Format of the results, only json and geojson unless written to files")
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False),
+              help="Directory to write the result of every statement to, named after its index")
+@click.option('-c', '--concurrency', default=1, type=int,
+              help="Maximum number of statements running at the same time, only "
+                   "for statements that do not depend on each other (default 1)")
+@click.help_option('-h', '--help')
+@click.pass_context
+def run_many(ctx, statements_file, delimiter, format, output_dir, concurrency):
+    '''
+    Prints one JSON line per statement as they finish, with its index,
+    time and result, or the file it was written to, or its error. They run
+    in order unless a concurrency is given.
+    '''
+    carto_obj = ctx.obj['carto']
+
+    statements = split_statements(statements_file.read(), delimiter)
+    if not statements:
+        ctx.fail('No statements to run')
+    if not output_dir and format not in ('json', 'geojson'):
+        ctx.fail('The {} format needs an output directory'.format(format))
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if concurrency > 1:
+        records = run_concurrently(carto_obj, statements, format, output_dir, concurrency)
+    else:
+        records = run_in_order(carto_obj, statements, format, output_dir)
+
+    failed = 0
+    for record in records:
+        if 'error' in record:
+            failed += 1
+        click.echo(json.dumps(record))
 
+    if failed:
+        click.echo('{} of {} statements failed'.format(failed, len(statements)), err=True)
+        ctx.exit(1)
 
-@click.command(help="Kills a query based on its pid")
-@click.argument('pid', type=int, callback=check_piped_arg, required=False)
+
+@click.command(help="Kills a query based on its pid, or all the ones matching a pattern or age")
+@click.option('-p', '--pattern', help="Regular expression the queries to cancel match")
+@click.option('-t', '--older-than', type=float,
+              help="Cancel the queries running for more than these seconds")
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help="Show the queries that would be cancelled")
+@click.option('-y', '--yes', is_flag=True, default=False,
+              help="Do not ask for confirmation before cancelling many queries")
+@click.argument('pid', type=int, required=False)
 @click.help_option('-h', '--help')
 @click.pass_context
-def kill(ctx,pid):
+def kill(ctx,pattern,older_than,dry_run,yes,pid):
     carto_obj = ctx.obj['carto']
 
+    if pattern or older_than is not None:
+        kill_many(ctx, carto_obj, pattern, older_than, dry_run, yes)
+        return
+
+    if pid is None:
+        if sys.stdin.isatty():
+            ctx.fail("Missing argument: pid.\n"
+                     "Either pass it explicitly or pipe into the command")
+        pid = int(sys.stdin.read().strip())
+
     sql = queries.KILL_QUERY.format(pid)
 
     try:
@@ -80,90 +228,75 @@ def kill(ctx,pid):
         ctx.fail("Error cancelling the query: {}".format(e))
 
 
+def kill_many(ctx, carto_obj, pattern, older_than, dry_run, yes):
+    '''
+    Cancels the active queries that match a pattern and are older than a
+    number of seconds
+    '''
+    try:
+        rows = carto_obj.execute_sql(queries.ACTIVITY_SAMPLE, do_post=True)['rows']
+        targets = activity.select_queries(rows, pattern, older_than)
+    except Exception as e:
+        ctx.fail("Error reading the running queries: {}".format(e))
+
+    if not targets:
+        click.echo('No queries to cancel')
+        return
+
+    table = PrettyTable(['pid', 'Seconds', 'Query'])
+    table.align = 'l'
+    for row in targets:
+        table.add_row([row['pid'], '{:.1f}'.format(row['duration'] or 0),
+                       ' '.join(row['query'].split())[:80]])
+    click.echo(table.get_string())
+
+    if dry_run:
+        click.echo('{} queries would be cancelled'.format(len(targets)))
+        return
+    if not yes and sys.stdin.isatty():
+        click.confirm('Cancel {} queries?'.format(len(targets)), abort=True)
+
+    try:
+        cancelled = activity.cancel_queries(
+            carto_obj, [(row['pid'], row['query_start']) for row in targets])
+    except Exception as e:
+        ctx.fail("Error cancelling the queries: {}".format(e))
+
+    click.echo('{} of {} queries cancelled'.format(len(cancelled), len(targets)))
+    if len(cancelled) < len(targets):
+        ctx.exit(1)
+
+
 
 @click.command(help="Functions on your account")
 @click.option('-f', '--format', default="json",
               help="Format of your results (JSON output includes definition)",
-              type=click.Choice(['json', 'csv', 'pretty']))
+              type=click.Choice(output.FORMATS))
 @click.help_option('-h', '--help')
 @click.pass_context
 def functions(ctx,format):
     carto_obj = ctx.obj['carto']
-    sql = queries.FUNCTIONS
-    result = carto_obj.execute_sql(sql)
-
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            fieldnames = queries.FUNCTIONS_HEADER
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for row in result['rows']:
-                arg_array = row['arguments']
-                if arg_array and len(arg_array) > 0:
-                    arg_str = ', '.join(arg_array)
-                else:
-                    arg_str = None
-
-                writer.writerow({
-                    'oid' : row['oid'],
-                    'name' : row['name'],
-                    'arguments': arg_str
-                })
-
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(queries.FUNCTIONS_HEADER)
-        table_general.align = "l"
+    rows = carto_obj.iter_rows(queries.FUNCTIONS)
 
-        #import ipdb; ipdb.set_trace()
-        for row in result['rows']:
-            pretty_row = []
-
-            arg_array = row['arguments']
-            if arg_array and len(arg_array) > 0:
-                row['arguments'] = ', '.join(arg_array)
-            else:
-                row['arguments'] = ''
+    if format in ['csv', 'pretty']:
+        rows = (dict(row, arguments=', '.join(row['arguments'] or []))
+                for row in rows)
 
-            for key in queries.FUNCTIONS_HEADER:
-                pretty_row.append(row[key])
-            table_general.add_row(pretty_row)
-
-        raw_result = table_general.get_string()
-
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+    try:
+        output.write_rows(rows, format, queries.FUNCTIONS_HEADER)
+    except Exception as e:
+        ctx.fail("Error listing your functions: {}".format(e))
 
 
 @click.command(help="List your organization schemas")
 @click.option('-f', '--format', default="json", help="Format of your results",
-              type=click.Choice(['json', 'csv', 'pretty']))
+              type=click.Choice(output.FORMATS))
 @click.help_option('-h', '--help')
 @click.pass_context
 def schemas(ctx,format):
     carto_obj = ctx.obj['carto']
-    sql = queries.LIST_SCHEMAS
-    result = carto_obj.execute_sql(sql)
-
-    if format == 'json':
-        raw_result = json.dumps(result['rows'])
-    elif format == 'csv':
-        with StringIO() as csvfile:
-            fieldnames = ['user']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for row in result['rows']:
-                writer.writerow(row)
-            raw_result = csvfile.getvalue()
-    else:
-        table_general = PrettyTable(['user'])
-        table_general.align = "l"
-
-        #import ipdb; ipdb.set_trace()
-        for row in result['rows']:
-            table_general.add_row([row['user']])
 
-        raw_result = table_general.get_string()
-
-    click.echo(raw_result, nl=format in ['json', 'pretty'])
+    try:
+        output.write_rows(carto_obj.iter_rows(queries.LIST_SCHEMAS), format, ['user'])
+    except Exception as e:
+        ctx.fail("Error listing your schemas: {}".format(e))
@@ -0,0 +1,125 @@
+import click
+import json
+import sys
+
+from prettytable import PrettyTable
+
+from carto_cli.carto import plans
+
+
+def format_summary(summary):
+    return '{:.2f} / {:.2f} / {:.2f}'.format(
+        summary['min'], summary['median'], summary['p95'])
+
+
+def format_change(before, after):
+    if before is None or after is None:
+        return ''
+    if not before:
+        return 'n/a'
+    return '{:+.1%}'.format(after / before - 1)
+
+
+def pretty_profile(profile):
+    table = PrettyTable(['Node', 'Time ms (min / median / p95)', 'Self ms',
+                         'Rows est.', 'Rows', 'Est. error', 'Hit', 'Read', 'Flags'])
+    table.align = 'l'
+    for node in profile['nodes']:
+        table.add_row([
+            '  ' * node['depth'] + node['label'],
+            format_summary(node['time']),
+            '{:.2f}'.format(node['self_time']['median']),
+            node['plan_rows'],
+            node['actual_rows'],
+            '{}x'.format(node['estimate_error']),
+            node['shared_hit'],
+            node['shared_read'],
+            '\n'.join(node['flags'])
+        ])
+
+    return '\n'.join([
+        'Runs: {}'.format(profile['runs']),
+        'Execution ms (min / median / p95): {}'.format(format_summary(profile['execution_time'])),
+        'Planning ms (min / median / p95): {}'.format(format_summary(profile['planning_time'])),
+        table.get_string()
+    ])
+
+
+def pretty_diff(comparison):
+    table = PrettyTable(['Node', 'Before ms', 'After ms', 'Change', 'Plan'])
+    table.align = 'l'
+    for node in comparison['nodes']:
+        table.add_row([
+            '  ' * node['depth'] + node['label'],
+            '' if node['before'] is None else '{:.2f}'.format(node['before']),
+            '' if node['after'] is None else '{:.2f}'.format(node['after']),
+            format_change(node['before'], node['after']),
+            node['status']
+        ])
+
+    lines = []
+    for name in ('execution_time', 'planning_time'):
+        times = comparison[name]
+        lines.append('{} ms (median): {:.2f} -> {:.2f} {}'.format(
+            name.replace('_', ' ').capitalize(), times['before'], times['after'],
+            format_change(times['before'], times['after'])))
+    if comparison['plan_changed']:
+        lines.append('The plan changed')
+    lines.append(table.get_string())
+    return '\n'.join(lines)
+
+
+@click.command(help="Profiles a query running it many times with EXPLAIN ANALYZE")
+@click.option('-n', '--runs', default=5, type=int,
+              help="Number of measured runs, the query is executed every time")
+@click.option('-w', '--warmup', default=1, type=int,
+              help="Runs before measuring, to have the data cached")
+@click.option('-f', '--format', default="pretty", type=click.Choice(['pretty', 'json']),
+              help="Format of the report")
+@click.option('-o', '--output', type=click.File('w'),
+              help="Save the profile as JSON to compare it later")
+@click.option('-b', '--baseline', type=click.File('r'),
+              help="Saved profile to compare with")
+@click.option('-l', '--load', type=click.File('r'),
+              help="Report a saved profile instead of running the query")
+@click.help_option('-h', '--help')
+@click.argument('sql', nargs=-1, required=False)
+@click.pass_context
+def profile(ctx, runs, warmup, format, output, baseline, load, sql):
+    '''
+    Reports the time, rows and buffers of every node of the plan, flagging
+    bad row estimates and sequential scans on tables with indexes
+    '''
+    carto_obj = ctx.obj['carto']
+
+    sql = ' '.join(sql)
+    if not sql and not load and not sys.stdin.isatty():
+        sql = sys.stdin.read().rstrip()
+    if not sql and not load:
+        ctx.fail('Missing argument: SQL.\nEither pass it explicitly or pipe into the command')
+    if runs < 1:
+        ctx.fail('At least one run is needed')
+
+    try:
+        if load:
+            result = json.load(load)
+        else:
+            def report(run, document):
+                click.echo('Run {} of {}: {:.2f} ms'.format(
+                    run, runs, document.get('Execution Time', 0)), err=True)
+            result = plans.profile_query(carto_obj, sql, runs, warmup, callback=report)
+    except Exception as e:
+        ctx.fail("Error profiling your SQL: {}".format(e))
+
+    if output:
+        json.dump(result, output, indent=2)
+
+    comparison = plans.diff(json.load(baseline), result) if baseline else None
+
+    if format == 'json':
+        click.echo(json.dumps({'profile': result, 'diff': comparison}
+                              if comparison else result))
+    elif comparison:
+        click.echo(pretty_diff(comparison))
+    else:
+        click.echo(pretty_profile(result))
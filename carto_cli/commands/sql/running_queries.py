@@ -1,9 +1,12 @@
 import click
 import json
+import time
 from prettytable import PrettyTable
 
 
 from carto_cli.carto import queries as carto_queries
+from carto_cli.carto.activity import ActivityMonitor, HISTORY_SIZE
+from carto_cli.carto.output import plain
 
 QUERY_FIELDS = [
     ('pid','pid'),
@@ -13,17 +16,110 @@ QUERY_FIELDS = [
     ('query','Query')
 ]
 
+# Longest queries shown in the watch views
+QUERY_WIDTH = 80
+
+
+def short_query(query):
+    query = ' '.join((query or '').split())
+    return query if len(query) <= QUERY_WIDTH else query[:QUERY_WIDTH - 3] + '...'
+
+
+def activity_table(rows):
+    table = PrettyTable(['pid', 'Seconds', 'Wait', 'Application', 'Query'])
+    table.align = 'l'
+    for row in rows:
+        wait = '{}: {}'.format(row['wait_event_type'], row['wait_event']) \
+            if row.get('wait_event_type') else ''
+        table.add_row([row['pid'], '{:.1f}'.format(row.get('duration') or 0),
+                       wait, row.get('application_name'), short_query(row.get('query'))])
+    return table.get_string()
+
+
+def frequent_table(groups):
+    table = PrettyTable(['Fingerprint', 'Executions', 'Samples', 'Max seconds',
+                         'Waiting', 'Query'])
+    table.align = 'l'
+    for group in groups:
+        table.add_row([group['fingerprint'], group['executions'], group['samples'],
+                       '{:.1f}'.format(group['max_duration']), group['waiting'],
+                       short_query(group['query'])])
+    return table.get_string()
+
+
+def watch_view(monitor, top):
+    last = monitor.last
+    active = [row for row in last['rows'] if row.get('state') == 'active']
+    return '\n'.join([
+        '{} - {} connections, {} active, {} samples'.format(
+            time.strftime('%H:%M:%S', time.localtime(last['sampled_at'])),
+            len(last['rows']), len(active), len(monitor.samples)),
+        '',
+        'Longest running',
+        activity_table(monitor.longest(top)),
+        '',
+        'Most frequent',
+        frequent_table(monitor.frequent(top)),
+        '',
+        'Waiting',
+        activity_table(monitor.waiting(top))
+    ])
+
+
+def watch_queries(ctx, carto_obj, interval, top, samples, history_size, export):
+    '''
+    Samples the running queries every interval seconds, refreshing the
+    views, until the number of samples is reached or it is interrupted
+    '''
+    monitor = ActivityMonitor(carto_obj, history_size)
+    taken = 0
+    try:
+        while not samples or taken < samples:
+            start = time.time()
+            try:
+                monitor.sample()
+            except Exception as e:
+                click.echo("Error sampling the running queries: {}".format(e), err=True)
+            else:
+                click.clear()
+                click.echo(watch_view(monitor, top))
+            taken += 1
+            if not samples or taken < samples:
+                time.sleep(max(interval - (time.time() - start), 0))
+    except KeyboardInterrupt:
+        pass
+
+    if export:
+        lines = monitor.export(export)
+        click.echo('{} rows of {} samples exported to {}'.format(
+            lines, len(monitor.samples), export.name), err=True)
+
+
 @click.command(help="Shows the current running queries")
 @click.option('-o','--output',type=click.File('w'),
               help="Output file to generate instead of printing directly")
 @click.option('-p','--pretty',default=False,is_flag=True, help="Formats only some relevant fields for easy reading")
+@click.option('-w','--watch',default=False,is_flag=True,
+              help="Samples the running queries until interrupted, showing the longest, most frequent and waiting ones")
+@click.option('-i','--interval',default=2.0,type=float,help="Seconds between samples when watching")
+@click.option('-n','--top',default=10,type=int,help="Queries shown on every view when watching")
+@click.option('-s','--samples',default=0,type=int,help="Stop watching after this number of samples, 0 never stops")
+@click.option('--history-size',default=HISTORY_SIZE,type=int,
+              help="Number of samples kept to group the queries when watching")
+@click.option('-e','--export',type=click.File('w'),
+              help="File to write the sampled queries as JSON lines when watching ends")
 @click.help_option('-h', '--help')
 @click.pass_context
-def queries(ctx,output,pretty):
+def queries(ctx,output,pretty,watch,interval,top,samples,history_size,export):
     carto_obj = ctx.obj['carto']
+
+    if watch:
+        watch_queries(ctx, carto_obj, interval, top, samples, history_size, export)
+        return
+
     sql = carto_queries.CURRENT_RUNNING
     try:
-        query = carto_obj.execute_sql(sql,format='json')
+        query = carto_obj.execute_sql(sql, columnar=True)
 
         if pretty:
             fields = [item[0] for item in QUERY_FIELDS]
@@ -34,7 +130,7 @@ def queries(ctx,output,pretty):
                 table_general.add_row([row[field] for field in fields])
             result = str(table_general)
         else:
-            result = json.dumps(query['rows'])
+            result = json.dumps(query['rows'], default=plain)
 
         if output:
             output.write(result)
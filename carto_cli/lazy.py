@@ -0,0 +1,31 @@
+"""
+Command groups that import their commands only when they are used, so
+printing the version or the help of one command does not load the modules,
+and their dependencies, of all the others.
+"""
+
+import importlib
+
+import click
+
+
+class LazyGroup(click.Group):
+    '''
+    Group that takes a `lazy_commands` dictionary of command names and
+    'module:attribute' paths, importing every command the first time it
+    is needed
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module_name, attribute = self.lazy_commands[name].split(':')
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, attribute), name)
+        return self.commands.get(name)
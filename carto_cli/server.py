@@ -0,0 +1,243 @@
+"""
+Persistent server for the commands sent by carto_cli.client.
+
+The server keeps the imported modules and one CARTOUser per account, with
+its pool of open connections, between commands. Commands run one at a
+time with the environment variables, working directory and standard
+streams of the client that sent them.
+
+Settings read from environment variables when a module is imported, like
+CARTO_SPLIT_EXPORT or CARTO_POOL_SIZE, take the values the server was
+started with.
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+import click
+
+from carto_cli.client import SOCKET_PATH, connect, load_cli, read_frame, send_frame
+
+IDLE_TIMEOUT = float(os.environ.get('CARTO_SERVER_IDLE_TIMEOUT', 0))
+
+
+class FrameWriter(io.RawIOBase):
+    '''
+    Sends everything written to it to the client on one channel
+    '''
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        if data:
+            send_frame(self.connection, self.channel, data)
+        return len(data)
+
+
+class FrameReader(io.RawIOBase):
+    '''
+    Reads the standard input of the client, asking for it only when the
+    command needs it
+    '''
+
+    def __init__(self, connection, tty):
+        self.connection = connection
+        self.tty = tty
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def readinto(self, buffer):
+        send_frame(self.connection, b'i', str(len(buffer)).encode('ascii'))
+        channel, data = read_frame(self.connection)
+        if channel != b'i':
+            raise IOError('The client closed the connection')
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def text_stream(raw):
+    buffered = io.BufferedWriter(raw) if raw.writable() else io.BufferedReader(raw)
+    return io.TextIOWrapper(buffered, encoding='utf-8', write_through=True)
+
+
+def run_command(request, users):
+    if request['command'] == 'carto_cli' and request['args'][:1] == ['serve']:
+        click.echo('Error: the server can not run serve', err=True)
+        return 2
+
+    cli = load_cli(request['command'])
+    try:
+        cli.main(args=request['args'], prog_name=request['prog'],
+                 obj={'users': users})
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        click.echo(e.code, err=True)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle(connection, users):
+    '''
+    Runs the command of one client with its environment, working directory
+    and standard streams, restoring the ones of the server afterwards
+    '''
+    channel, data = read_frame(connection)
+    if channel != b'r':
+        return
+    request = json.loads(data.decode('utf-8'))
+    if request.get('stop'):
+        send_frame(connection, b'x', b'0')
+        raise SystemExit(0)
+
+    saved_streams = sys.stdin, sys.stdout, sys.stderr
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    try:
+        for key in [key for key in os.environ if key.startswith('CARTO_')]:
+            del os.environ[key]
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+
+        sys.stdin = text_stream(FrameReader(connection, request['stdin_tty']))
+        sys.stdout = text_stream(FrameWriter(connection, b'o'))
+        sys.stderr = text_stream(FrameWriter(connection, b'e'))
+
+        code = run_command(request, users)
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        send_frame(connection, b'x', str(code).encode('ascii'))
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved_streams
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+
+
+def listen(path):
+    '''
+    Binds the socket, only reachable by the current user, removing the one
+    of a server that is not running anymore
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, 0o700)
+
+    running = connect(path)
+    if running is not None:
+        running.close()
+        raise Exception('There is a server running on {}'.format(path))
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    return server
+
+
+def serve_forever(server, path, idle_timeout):
+    users = {}
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if idle_timeout:
+        server.settimeout(idle_timeout)
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            connection.settimeout(None)
+            try:
+                handle(connection, users)
+            except (IOError, OSError, ValueError):
+                # The client went away in the middle of the command
+                pass
+            except Exception as e:
+                # A request the server can not run, like one for an unknown
+                # command or without its environment, only fails its client
+                try:
+                    send_frame(connection, b'e', ''.join(
+                        traceback.format_exception_only(type(e), e)).encode('utf-8'))
+                    send_frame(connection, b'x', b'1')
+                except (IOError, OSError):
+                    pass
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def stop(path):
+    connection = connect(path)
+    if connection is None:
+        return False
+    try:
+        send_frame(connection, b'r', json.dumps({'stop': True}).encode('utf-8'))
+        read_frame(connection)
+    finally:
+        connection.close()
+    return True
+
+
+@click.command(help="Runs a server that keeps accounts and connections ready "
+                    "for the commands of this user")
+@click.option('-s', '--socket', 'path', default=SOCKET_PATH, envvar='CARTO_SOCKET',
+              help="Unix socket to listen on (default ~/.carto_cli/server.sock "
+                   "or $CARTO_SOCKET)")
+@click.option('-d', '--detach', is_flag=True, default=False,
+              help="Run the server in the background")
+@click.option('-t', '--idle-timeout', default=IDLE_TIMEOUT, type=float,
+              help="Stop after this many seconds without commands, 0 never stops")
+@click.option('--stop', 'stop_server', is_flag=True, default=False,
+              help="Stop the server running on the socket")
+@click.help_option('-h', '--help')
+@click.pass_context
+def serve(ctx, path, detach, idle_timeout, stop_server):
+    if stop_server:
+        if not stop(path):
+            ctx.fail('There is no server running on {}'.format(path))
+        click.echo('Server stopped')
+        return
+
+    try:
+        server = listen(path)
+    except Exception as e:
+        ctx.fail(e)
+
+    if detach:
+        if os.fork():
+            click.echo('Server listening on {}'.format(path))
+            return
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+    else:
+        click.echo('Server listening on {}'.format(path), err=True)
+
+    serve_forever(server, path, idle_timeout)
@@ -44,9 +44,9 @@ setup(name="carto-cli",
       include_package_data=True,
       entry_points='''
 [console_scripts]
-carto_cli=carto_cli.app:cli
-carto_env=carto_cli.carto_env:cli
-carto_sql=carto_cli.carto_sql:cli
-carto_batch=carto_cli.carto_batch:cli
-carto_dataset=carto_cli.carto_dataset:cli
+carto_cli=carto_cli.client:carto_cli
+carto_env=carto_cli.client:carto_env
+carto_sql=carto_cli.client:carto_sql
+carto_batch=carto_cli.client:carto_batch
+carto_dataset=carto_cli.client:carto_dataset
       ''')
@@ -0,0 +1,35 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks'))
+
+import fake_carto  # noqa: E402
+
+from carto_cli.carto.cache import MetadataCache  # noqa: E402
+from carto_cli.carto.carto_user import CARTOUser  # noqa: E402
+
+
+@pytest.fixture
+def fake_server():
+    '''
+    The local stand-in of the CARTO APIs of benchmarks/fake_carto.py, with
+    small tables of 1000 rows
+    '''
+    server = fake_carto.serve(rows=1000, tables=2, job_reads=1, import_reads=1)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def carto_obj(fake_server, tmp_path):
+    carto_obj = CARTOUser(user_name=fake_carto.USER, api_url=fake_carto.api_url(fake_server),
+                          api_key='fake', use_cache=False)
+    carto_obj.cache = MetadataCache(path=str(tmp_path / 'cache.sqlite'))
+    return carto_obj
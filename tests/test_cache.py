@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from carto_cli.carto.cache import ANY_TABLE, MetadataCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MetadataCache(path=str(tmp_path / 'cache.sqlite'))
+
+
+def test_get_set_and_invalidate(cache):
+    cache.set('schema', {'rows': [1]}, ['bench'])
+    cache.set('other', {'rows': [2]}, ['other'])
+    cache.set('tables', {'rows': [3]}, [ANY_TABLE])
+    assert cache.get('schema') == {'rows': [1]}
+
+    cache.invalidate('bench')
+    assert cache.get('schema') is None and cache.get('tables') is None
+    assert cache.get('other') == {'rows': [2]}
+
+    cache.invalidate(ANY_TABLE)
+    assert cache.get('other') is None
+
+
+def test_connections_are_closed(cache, monkeypatch):
+    connections = []
+    connect = cache.connect
+
+    def tracked():
+        connections.append(connect())
+        return connections[-1]
+
+    monkeypatch.setattr(cache, 'connect', tracked)
+    cache.set('schema', {'rows': [1]}, ['bench'])
+    cache.get('schema')
+    cache.invalidate('bench')
+
+    assert len(connections) == 3
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute('select 1')
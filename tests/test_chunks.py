@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import re
+
+import pytest
+
+from carto_cli.carto import chunks
+
+CHUNK_FILTER = re.compile(r'(\w+) >= (-?\d+) and\s+\1 < (-?\d+)')
+FRACTIONS = re.compile(r'array\[([^\]]*)\]')
+
+
+class FakeTable(object):
+    '''
+    Answers the queries of the chunked export with the rows of one table
+    '''
+
+    def __init__(self, ids, broken=(), cut=()):
+        self.ids = sorted(ids)
+        self.broken = broken
+        self.cut = cut
+        self.chunk_queries = []
+
+    def execute_sql(self, sql, parse_json=True, format=None, do_post=False, **kwargs):
+        if CHUNK_FILTER.search(sql):
+            return self.chunk(sql)
+        if 'percentile_disc' in sql:
+            fractions = [float(value) for value in FRACTIONS.search(sql).group(1).split(',')]
+            return {'rows': [{'bounds': [self.ids[int(fraction * (len(self.ids) - 1))]
+                                         for fraction in fractions]}]}
+        return {'rows': [{'count': len(self.ids),
+                          'min_id': min(self.ids) if self.ids else None,
+                          'max_id': max(self.ids) if self.ids else None}]}
+
+    def stream_sql(self, sql, output, format=None):
+        output.write(self.chunk(sql))
+
+    def iter_sql(self, sql, format=None):
+        _, start, end = CHUNK_FILTER.search(sql).groups()
+        rows = [{'cartodb_id': id} for id in self.ids if int(start) <= id < int(end)]
+        if int(start) in self.cut:
+            # The SQL API adds the error after the rows sent before it
+            body = {'rows': rows[:10], 'error': ['canceling statement due to statement timeout']}
+        else:
+            body = {'rows': rows, 'time': 0.01, 'total_rows': len(rows)}
+        data = json.dumps(body).encode('utf-8')
+        for position in range(0, len(data), 100):
+            yield data[position:position + 100]
+
+    def chunk(self, sql):
+        _, start, end = CHUNK_FILTER.search(sql).groups()
+        self.chunk_queries.append((int(start), int(end)))
+        if int(start) in self.broken:
+            raise Exception('Connection reset')
+        lines = ['cartodb_id,name\n'] + ['{0},row {0}\n'.format(id) for id in self.ids
+                                         if int(start) <= id < int(end)]
+        return ''.join(lines).encode('utf-8')
+
+
+def read_ids(paths):
+    ids = []
+    for path in paths:
+        with open(path, newline='') as chunk_file:
+            ids += [int(row['cartodb_id']) for row in csv.DictReader(chunk_file)]
+    return ids
+
+
+def export(carto_obj, tmp_path, chunk_size=300, format='csv'):
+    base = str(tmp_path / 'bench')
+    count, windows = chunks.plan_chunks(carto_obj, 'bench', chunk_size)
+    state = chunks.new_state('bench', format, count, windows, base, '.' + format)
+    return base, state, chunks.export_chunks(carto_obj, state, base, workers=2)
+
+
+def test_plan_chunks_dense_ids():
+    count, windows = chunks.plan_chunks(FakeTable(range(1, 1001)), 'bench', 300)
+
+    assert count == 1000
+    assert windows == [(1, 251), (251, 501), (501, 751), (751, 1001)]
+
+
+def test_plan_chunks_sparse_ids():
+    ids = list(range(1, 101)) + list(range(100000, 100900))
+    count, windows = chunks.plan_chunks(FakeTable(ids), 'bench', 300)
+
+    assert count == 1000
+    assert len(windows) == 4
+    assert windows[0][0] == 1 and windows[-1][1] == max(ids) + 1
+    # The windows are contiguous, every id falls in exactly one of them
+    assert all(previous[1] == window[0] for previous, window in zip(windows, windows[1:]))
+
+
+def test_plan_chunks_empty_table():
+    assert chunks.plan_chunks(FakeTable([]), 'bench', 300) == (0, [])
+
+
+def test_export_chunks(tmp_path):
+    base, state, failures = export(FakeTable(range(1, 1001)), tmp_path)
+
+    assert failures == []
+    assert all(chunk['done'] for chunk in chunks.load_state(base)['chunks'])
+    assert read_ids(chunk['path'] for chunk in state['chunks']) == list(range(1, 1001))
+
+
+def test_resume_fetches_only_the_pending_chunks(tmp_path):
+    carto_obj = FakeTable(range(1, 1001))
+    base, state, _ = export(carto_obj, tmp_path)
+
+    # An interrupted export: the state of chunk 3 was never saved and the
+    # file of chunk 2 is gone
+    state = chunks.load_state(base)
+    state['chunks'][2]['done'] = False
+    os.remove(state['chunks'][1]['path'])
+    assert [chunk['index'] for chunk in chunks.pending_chunks(state)] == [2, 3]
+
+    carto_obj.chunk_queries = []
+    failures = chunks.export_chunks(carto_obj, state, base, workers=2)
+
+    assert failures == []
+    assert sorted(carto_obj.chunk_queries) == [(251, 501), (501, 751)]
+    assert chunks.pending_chunks(chunks.load_state(base)) == []
+    assert read_ids(chunk['path'] for chunk in state['chunks']) == list(range(1, 1001))
+
+
+def test_failed_chunks_stay_pending(tmp_path):
+    base, state, failures = export(FakeTable(range(1, 1001), broken=(251,)), tmp_path)
+
+    assert [(chunk['index'], str(error)) for chunk, error in failures] == \
+        [(2, 'Connection reset')]
+    assert [chunk['index'] for chunk in chunks.pending_chunks(chunks.load_state(base))] == [2]
+    assert not os.path.exists(state['chunks'][1]['path'])
+
+
+def test_export_json_chunks(tmp_path):
+    base, state, failures = export(FakeTable(range(1, 1001)), tmp_path, format='json')
+
+    assert failures == []
+    ids = []
+    for chunk in state['chunks']:
+        with open(chunk['path']) as chunk_file:
+            ids += [row['cartodb_id'] for row in json.load(chunk_file)['rows']]
+    assert ids == list(range(1, 1001))
+
+
+def test_chunks_cut_by_an_error_stay_pending(tmp_path):
+    base, state, failures = export(FakeTable(range(1, 1001), cut=(501,)), tmp_path,
+                                   format='json')
+
+    assert [(chunk['index'], str(error)) for chunk, error in failures] == \
+        [(3, 'canceling statement due to statement timeout')]
+    assert [chunk['index'] for chunk in chunks.pending_chunks(chunks.load_state(base))] == [3]
+    assert not os.path.exists(state['chunks'][2]['path'])
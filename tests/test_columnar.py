@@ -0,0 +1,89 @@
+import json
+
+from carto_cli.carto.columnar import ColumnarResult
+from carto_cli.carto import output
+from carto_cli.carto.output import dumps
+
+POINT = '0101000020E6100000000000000000F03F0000000000000040'
+
+ROWS = [
+    {'cartodb_id': 1, 'the_geom': POINT, 'value': 1.5, 'count': 3, 'flag': True,
+     'name': 'first', 'mixed': 1},
+    {'cartodb_id': 2, 'the_geom': None, 'value': 3, 'count': None, 'flag': False,
+     'name': None, 'mixed': 'two'},
+    {'cartodb_id': 3, 'the_geom': POINT.lower(), 'value': None, 'count': 2 ** 70,
+     'flag': None, 'name': 'third', 'mixed': [3]},
+]
+
+TAIL = {'time': 0.05, 'total_rows': 3,
+        'fields': {'the_geom': {'type': 'geometry'}, 'value': {'type': 'number'}}}
+
+
+def plain_rows(result):
+    return [dict(row) for row in result['rows']]
+
+
+def test_rows_read_back_unchanged():
+    result = ColumnarResult.from_rows(ROWS, TAIL)
+
+    assert plain_rows(result) == ROWS
+    assert len(result['rows']) == 3
+    assert result['rows'][-1]['name'] == 'third'
+    assert result['time'] == 0.05 and result['total_rows'] == 3
+    # Integers sent in a float column are still integers
+    assert type(result['rows'][1]['value']) is int
+
+
+def test_typed_columns():
+    columns = ColumnarResult.from_rows(ROWS, TAIL).columns
+
+    assert columns['cartodb_id'].kind == 'int'
+    assert columns['value'].kind == 'float'
+    assert columns['flag'].kind == 'bool'
+    # Out of the int64 range and mixed types fall back to lists
+    assert columns['count'].kind == 'object'
+    assert columns['mixed'].kind == 'object'
+
+
+def test_geometries_are_packed_only_when_consistent():
+    result = ColumnarResult.from_rows(ROWS[:2], TAIL)
+    assert result.columns['the_geom'].kind == 'geometry'
+    assert result['rows'][0]['the_geom'] == POINT
+
+    # Upper and lower case hexadecimal in the same column are kept as text
+    result = ColumnarResult.from_rows(ROWS, TAIL)
+    assert result.columns['the_geom'].kind == 'object'
+    assert plain_rows(result) == ROWS
+
+
+def test_dump_and_load_round_trip():
+    result = ColumnarResult.from_rows(ROWS, TAIL)
+    data = json.loads(json.dumps(result.dump()))
+    loaded = ColumnarResult.load(data)
+
+    assert plain_rows(loaded) == ROWS
+    assert loaded['fields'] == TAIL['fields']
+    assert {name: column.kind for name, column in loaded.columns.items()} == \
+        {name: column.kind for name, column in result.columns.items()}
+
+
+def test_from_chunks_matches_the_json_response():
+    # The SQL API sends the rows first
+    body = json.dumps(dict(rows=ROWS, **TAIL)).encode('utf-8')
+    result = ColumnarResult.from_chunks(body[start:start + 7] for start in range(0, len(body), 7))
+
+    assert plain_rows(result) == ROWS
+    assert json.loads(dumps(result)) == dict(TAIL, rows=ROWS)
+
+
+def test_rows_written_as_json():
+    result = ColumnarResult.from_rows(ROWS, TAIL)
+    parts = []
+    output.write_json(result['rows'], write=parts.append)
+    assert ''.join(parts) == json.dumps(ROWS) + '\n'
+
+
+def test_empty_result():
+    result = ColumnarResult.from_rows([], {'total_rows': 0})
+    assert plain_rows(result) == []
+    assert ColumnarResult.load(result.dump())['total_rows'] == 0
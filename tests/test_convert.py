@@ -0,0 +1,46 @@
+import io
+import json
+
+import pytest
+
+from carto_cli.carto import convert
+
+ROWS = [{'cartodb_id': id, 'name': 'row {}'.format(id)} for id in range(1, 101)]
+
+
+class FakeSQL(object):
+    '''
+    Sends one JSON response in small chunks, whatever the query
+    '''
+
+    def __init__(self, response):
+        self.body = json.dumps(response).encode('utf-8')
+
+    def iter_sql(self, sql, format=None):
+        for position in range(0, len(self.body), 50):
+            yield self.body[position:position + 50]
+
+
+def test_ndjson():
+    output = io.BytesIO()
+    count = convert.write_ndjson(FakeSQL({'rows': ROWS, 'total_rows': 100}), 'q', output)
+
+    assert count == 100
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == ROWS
+
+
+def test_geojson_sequence():
+    features = [{'type': 'Feature', 'properties': row, 'geometry': None} for row in ROWS]
+    output = io.BytesIO()
+    convert.write_geojsonseq(FakeSQL({'type': 'FeatureCollection', 'features': features}),
+                             'q', output)
+
+    records = output.getvalue().split(convert.RECORD_SEPARATOR)[1:]
+    assert [json.loads(record) for record in records] == features
+
+
+def test_error_after_the_rows():
+    carto_obj = FakeSQL({'rows': ROWS[:10], 'error': ['division by zero']})
+
+    with pytest.raises(Exception, match='division by zero'):
+        convert.write_ndjson(carto_obj, 'q', io.BytesIO())
@@ -0,0 +1,110 @@
+import csv
+import os
+
+import pytest
+
+from carto_cli.carto import incremental
+
+
+def read_ids(path):
+    with open(path, newline='') as table_file:
+        return [int(row['cartodb_id']) for row in csv.DictReader(table_file)]
+
+
+def test_first_download_and_new_rows(carto_obj, fake_server, tmp_path):
+    path = str(tmp_path / 'bench.csv')
+
+    summary = incremental.download(carto_obj, 'bench', path, 'csv', chunk_size=300)
+    assert summary['rows'] == 1000 and summary['watermark'] == 1000
+    assert read_ids(path) == list(range(1, 1001))
+    assert incremental.load_state(path)['watermark'] == 1000
+
+    fake_server.fake.rows = 1500
+    summary = incremental.download(carto_obj, 'bench', path, 'csv', chunk_size=300)
+    assert summary['rows'] == 500 and summary['watermark'] == 1500
+    assert read_ids(path) == list(range(1, 1501))
+
+    # Nothing new, nothing fetched
+    summary = incremental.download(carto_obj, 'bench', path, 'csv', chunk_size=300)
+    assert summary['rows'] == 0
+    assert read_ids(path) == list(range(1, 1501))
+    assert not [name for name in os.listdir(str(tmp_path)) if '.delta' in name]
+
+
+def test_verify_finds_deleted_and_missing_rows(carto_obj, tmp_path):
+    path = str(tmp_path / 'bench.csv')
+    incremental.download(carto_obj, 'bench', path, 'csv')
+
+    # A row deleted in CARTO that is still local, and a local row lost
+    with open(path, newline='') as table_file:
+        rows = [row for row in csv.reader(table_file)]
+    rows = rows[:1] + [row for row in rows[1:] if row[0] != '10']
+    rows.append(['5000'] + rows[1][1:])
+    with open(path, 'w', newline='') as table_file:
+        csv.writer(table_file, lineterminator='\n').writerows(rows)
+
+    summary = incremental.download(carto_obj, 'bench', path, 'csv', verify=True)
+    assert summary['deleted'] == 1 and summary['missing'] == 1
+    assert sorted(read_ids(path)) == list(range(1, 1001))
+
+
+def test_merge_replaces_rows_with_the_same_id(tmp_path):
+    path = str(tmp_path / 'table.csv')
+    part = str(tmp_path / 'part.csv')
+    with open(path, 'w', newline='') as table_file:
+        table_file.write('cartodb_id,name\n1,old\n2,kept\n')
+    with open(part, 'w', newline='') as part_file:
+        part_file.write('cartodb_id,name\n1,new\n3,added\n')
+
+    incremental.merge(path, 'csv', [part], 'cartodb_id', append=False)
+    with open(path, newline='') as table_file:
+        assert table_file.read() == 'cartodb_id,name\n2,kept\n1,new\n3,added\n'
+
+
+def test_merge_rejects_changed_columns(tmp_path):
+    path = str(tmp_path / 'table.csv')
+    part = str(tmp_path / 'part.csv')
+    with open(path, 'w', newline='') as table_file:
+        table_file.write('cartodb_id,name\n1,old\n')
+    with open(part, 'w', newline='') as part_file:
+        part_file.write('cartodb_id,name,value\n2,new,1\n')
+
+    with pytest.raises(Exception, match='columns of the table changed'):
+        incremental.merge(path, 'csv', [part], 'cartodb_id', append=True)
+
+
+def test_other_table_in_the_same_file(carto_obj, tmp_path):
+    path = str(tmp_path / 'bench.csv')
+    incremental.download(carto_obj, 'bench', path, 'csv')
+    with pytest.raises(Exception, match='was downloaded from bench'):
+        incremental.download(carto_obj, 'bench_1', path, 'csv')
+
+
+def test_watermark_saved_when_verify_fails(carto_obj, fake_server, tmp_path, monkeypatch):
+    path = str(tmp_path / 'bench.csv')
+    incremental.download(carto_obj, 'bench', path, 'csv')
+
+    def broken(*args):
+        raise Exception('Connection reset')
+
+    fake_server.fake.rows = 1500
+    monkeypatch.setattr(incremental, 'compare_ids', broken)
+    with pytest.raises(Exception, match='Connection reset'):
+        incremental.download(carto_obj, 'bench', path, 'csv', verify=True)
+    assert incremental.load_state(path)['watermark'] == 1500
+
+    # The next run does not append the rows of the failed one again
+    monkeypatch.undo()
+    assert incremental.download(carto_obj, 'bench', path, 'csv')['rows'] == 0
+    assert read_ids(path) == list(range(1, 1501))
+
+
+def test_output_without_state(carto_obj, tmp_path):
+    path = str(tmp_path / 'bench.csv')
+    with open(path, 'w') as table_file:
+        table_file.write('not a download\n')
+
+    with pytest.raises(Exception, match='has no'):
+        incremental.download(carto_obj, 'bench', path, 'csv')
+    with open(path) as table_file:
+        assert table_file.read() == 'not a download\n'
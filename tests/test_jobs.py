@@ -0,0 +1,64 @@
+import pytest
+
+from carto.exceptions import CartoException
+from pyrestcli.exceptions import NotFoundException, ServerErrorException
+
+from carto_cli.carto.jobs import JobTracker, is_final_error
+
+
+class NoBackoff(object):
+
+    def wait(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+class UnreadableJobs(object):
+    '''
+    Creates jobs that always fail to be read with the same error
+    '''
+
+    def __init__(self, error):
+        self.error = error
+        self.reads = 0
+
+    def batch_create(self, query):
+        return {'job_id': 'job-1', 'status': 'pending', 'query': query}
+
+    def batch_check(self, job_id):
+        self.reads += 1
+        raise self.error
+
+
+def test_client_errors_are_final():
+    assert is_final_error(CartoException(NotFoundException('Not found', 404)))
+    assert not is_final_error(CartoException(ServerErrorException('Error', 500)))
+    assert not is_final_error(CartoException(ValueError('Connection reset')))
+
+
+def test_jobs_fail_after_consecutive_read_errors():
+    carto_obj = UnreadableJobs(CartoException(ServerErrorException('Error', 500)))
+    tracker = JobTracker(carto_obj, backoff=NoBackoff(), read_failures=3)
+    tracker.submit('select 1')
+
+    job, = tracker.wait()
+    assert job['status'] == 'failed'
+    assert 'Error' in job['failed_reason']
+    assert carto_obj.reads == 3
+
+
+def test_missing_jobs_fail_at_once():
+    carto_obj = UnreadableJobs(CartoException(NotFoundException('Not found', 404)))
+    tracker = JobTracker(carto_obj, backoff=NoBackoff())
+    tracker.track('job-2')
+
+    job, = tracker.wait()
+    assert job['status'] == 'failed'
+    assert carto_obj.reads == 1
+
+
+def test_concurrency_below_one():
+    with pytest.raises(Exception, match='at least 1'):
+        JobTracker(UnreadableJobs(None), concurrency=0)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from carto_cli.carto.jsonstream import JSONArrayStream
+
+RESPONSE = {
+    'rows': [
+        {'cartodb_id': 1, 'name': 'a "quoted" ] name', 'value': 1.5, 'tags': ['x', 'y']},
+        {'cartodb_id': 2, 'name': u'Logroño, 東京', 'value': None, 'tags': []},
+        {'cartodb_id': 3, 'name': '{"rows": [1]}', 'value': -3, 'tags': None},
+    ],
+    'time': 0.012,
+    'fields': {'cartodb_id': {'type': 'number'}, 'name': {'type': 'string'}},
+    'total_rows': 3
+}
+
+
+def split(body, size):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_rows_and_tail_in_any_chunking(size):
+    body = json.dumps(RESPONSE, ensure_ascii=False).encode('utf-8')
+    stream = JSONArrayStream(split(body, size))
+
+    assert [row for row in stream] == RESPONSE['rows']
+    assert stream.tail == {key: value for key, value in RESPONSE.items() if key != 'rows'}
+
+
+def test_empty_array():
+    stream = JSONArrayStream([b'{"rows": [], "time": 0.1, "total_rows": 0}'])
+    assert [row for row in stream] == []
+    assert stream.tail == {'time': 0.1, 'total_rows': 0}
+
+
+def test_geojson_features():
+    body = json.dumps({'type': 'FeatureCollection',
+                       'features': [{'type': 'Feature', 'properties': {'id': 1}}]})
+    stream = JSONArrayStream(split(body.encode('utf-8'), 5), key='features')
+    assert [feature['properties'] for feature in stream] == [{'id': 1}]
+
+
+def test_truncated_response():
+    body = json.dumps(RESPONSE).encode('utf-8')[:60]
+    with pytest.raises(ValueError):
+        [row for row in JSONArrayStream(split(body, 10))]
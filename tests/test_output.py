@@ -0,0 +1,90 @@
+import csv
+import json
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from prettytable import PrettyTable
+
+from carto_cli.carto import output
+
+ROWS = [{'name': 'bench_{}'.format(index), 'size': index * 100, 'privacy': None,
+         'extra': 'left out'} for index in range(1, 1201)]
+
+FIELDNAMES = ['name', 'size', 'privacy']
+
+
+def written(writer, *args, **kwargs):
+    parts = []
+    writer(*args, write=parts.append, **kwargs)
+    return ''.join(parts), len(parts)
+
+
+def test_json_is_the_dumps_of_the_list():
+    text, writes = written(output.write_json, (row for row in ROWS))
+    assert text == json.dumps(ROWS) + '\n'
+    # Written in batches, not in one piece
+    assert writes > 2
+
+
+def test_json_of_an_empty_listing():
+    assert written(output.write_json, [])[0] == '[]\n'
+
+
+def test_ndjson():
+    text, _ = written(output.write_ndjson, ROWS)
+    assert [json.loads(line) for line in text.splitlines()] == ROWS
+
+
+def test_csv_leaves_out_other_columns():
+    text, _ = written(output.write_csv, ROWS, FIELDNAMES)
+
+    expected = StringIO()
+    writer = csv.DictWriter(expected, fieldnames=FIELDNAMES, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(ROWS)
+    assert text == expected.getvalue()
+
+
+def test_pretty_matches_prettytable():
+    table = PrettyTable(FIELDNAMES)
+    table.align = 'l'
+    for row in ROWS[:20]:
+        table.add_row([row[name] for name in FIELDNAMES])
+
+    text, _ = written(output.write_pretty, ROWS[:20], FIELDNAMES)
+    assert text == table.get_string() + '\n'
+
+
+def test_pretty_alignment_and_headers():
+    text, _ = written(output.write_pretty, [{'name': 'a', 'size': 5}], ['name', 'size'],
+                      headers=['Name', 'Size'], align={'size': 'r'})
+    assert text.splitlines()[1] == '| Name | Size |'
+    assert text.splitlines()[3] == '| a    |    5 |'
+
+
+def test_pretty_cuts_wide_values():
+    rows = [{'name': 'x' * 100, 'query': 'select\n  1'}]
+    text, _ = written(output.write_pretty, rows, ['name', 'query'], max_width=10)
+    assert text.splitlines()[3] == '| xxxxxxx... | select 1 |'
+
+    text, _ = written(output.write_pretty, rows, ['name', 'query'], max_width=None)
+    assert '| {} |'.format('x' * 100) in text
+
+
+def test_pretty_widths_from_the_sample():
+    rows = [{'name': 'short'}, {'name': 'a much longer name'}]
+    text, _ = written(output.write_pretty, rows, ['name'], sample=1)
+    assert text.splitlines()[4] == '| a ... |'
+
+    # Without a maximum width every row is measured
+    text, _ = written(output.write_pretty, rows, ['name'], sample=1, max_width=None)
+    assert text.splitlines()[4] == '| a much longer name |'
+
+
+def test_write_rows_formats():
+    for format in output.FORMATS:
+        text, _ = written(output.write_rows, ROWS[:3], format, FIELDNAMES)
+        assert 'bench_3' in text
@@ -0,0 +1,51 @@
+import pytest
+
+from carto_cli.carto import plans
+
+# The inner side of a nested loop: 1 row per loop, as estimated
+NESTED_LOOP = {
+    'Plan': {
+        'Node Type': 'Nested Loop', 'Plan Rows': 1000, 'Actual Rows': 1000,
+        'Actual Loops': 1, 'Actual Total Time': 12.0,
+        'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'a', 'Plan Rows': 1000,
+             'Actual Rows': 1000, 'Actual Loops': 1, 'Actual Total Time': 2.0},
+            {'Node Type': 'Index Scan', 'Relation Name': 'b', 'Index Name': 'b_pkey',
+             'Plan Rows': 1, 'Actual Rows': 1, 'Actual Loops': 1000,
+             'Actual Total Time': 0.008},
+        ]
+    },
+    'Planning Time': 0.1,
+    'Execution Time': 12.5,
+}
+
+
+class Unreachable(object):
+
+    def execute_sql(self, sql, **kwargs):
+        raise AssertionError('The query was run: {}'.format(sql))
+
+
+def test_node_stats_per_loop():
+    stats = plans.node_stats(NESTED_LOOP['Plan']['Plans'][1])
+    assert stats['plan_rows'] == 1 and stats['actual_rows'] == 1
+    assert stats['time'] == pytest.approx(8.0)
+
+
+def test_nested_loop_inner_side_not_flagged():
+    profile = plans.aggregate('select 1', [NESTED_LOOP, NESTED_LOOP])
+
+    assert [node['label'] for node in profile['nodes']] == \
+        ['Nested Loop', 'Seq Scan on a', 'Index Scan on b using b_pkey']
+    assert [node['estimate_error'] for node in profile['nodes']] == [1, 1, 1]
+    assert not any(node['flags'] for node in profile['nodes'])
+    assert profile['nodes'][0]['self_time']['median'] == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize('sql', [
+    'update t set a = 1',
+    'with gone as (delete from t returning *) select * from gone',
+])
+def test_writes_are_not_profiled(sql):
+    with pytest.raises(Exception, match='do not write'):
+        plans.profile_query(Unreachable(), sql, runs=5)
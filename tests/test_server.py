@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+
+import pytest
+
+from carto_cli import server
+from carto_cli.client import connect, read_frame, send_frame
+
+REQUEST = {'command': 'carto_sql', 'args': ['-h'], 'prog': 'carto_sql', 'env': {},
+           'cwd': '/', 'stdin_tty': False}
+
+
+def send(path, request):
+    '''
+    Sends one request and returns the text sent to stdout and stderr and the
+    exit code
+    '''
+    connection = connect(path)
+    try:
+        send_frame(connection, b'r', json.dumps(request).encode('utf-8'))
+        streams = {b'o': b'', b'e': b''}
+        while True:
+            channel, data = read_frame(connection)
+            if channel == b'x':
+                return streams[b'o'].decode(), streams[b'e'].decode(), int(data)
+            streams[channel] += data
+    finally:
+        connection.close()
+
+
+def test_bad_requests_do_not_stop_the_server(tmp_path):
+    path = str(tmp_path / 's.sock')
+    listening = server.listen(path)
+    responses = []
+
+    def client():
+        responses.append(send(path, dict(REQUEST, command='carto_unknown')))
+        responses.append(send(path, {'command': 'carto_sql', 'args': []}))
+        responses.append(send(path, REQUEST))
+        send(path, {'stop': True})
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    # serve_forever sets a signal handler, so it runs in the main thread
+    with pytest.raises(SystemExit):
+        server.serve_forever(listening, path, 0)
+    thread.join()
+
+    assert [code for _, _, code in responses] == [1, 1, 0]
+    assert responses[0][1] == "KeyError: 'carto_unknown'\n"
+    assert responses[1][1] == "KeyError: 'env'\n"
+    assert 'Usage: carto_sql' in responses[2][0]
+    assert not os.path.exists(path)
@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from carto_cli.carto import tracing
+from carto_cli.carto.session import TimedSession
+
+BODY = json.dumps({'rows': [{'cartodb_id': index} for index in range(500)],
+                   'time': 0.25}).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if self.path.endswith('/chunked'):
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(BODY), 1000):
+                chunk = BODY[start:start + 1000]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+                self.wfile.flush()
+                time.sleep(0.01)
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/api/v2/sql'.format(server.server_address[1])
+    server.shutdown()
+
+
+@pytest.mark.parametrize('path', ['/chunked', '/length'])
+def test_records_the_whole_body(stub_url, path):
+    session = TimedSession()
+    response = session.get(stub_url + path)
+
+    assert response.json()['time'] == 0.25
+    timing = session.timings[0]
+    assert timing['status'] == 200
+    assert timing['response_bytes'] == len(BODY)
+    assert BODY.endswith(timing['tail'])
+    assert tracing.server_seconds(timing) == 0.25
+
+
+def test_records_streamed_chunked_bodies(stub_url):
+    session = TimedSession()
+    response = session.get(stub_url + '/chunked', stream=True)
+    received = b''.join(response.iter_content(256))
+
+    timing = session.timings[0]
+    assert received == BODY
+    assert timing['response_bytes'] == len(BODY)
+    # The body arrives after the headers, the last byte is its end
+    assert timing['end'] > timing['start'] + timing['seconds']
+    assert tracing.total_seconds(timing) >= 0.05
@@ -0,0 +1,65 @@
+import pytest
+
+from carto_cli.carto.statements import split_statements, is_read_only
+
+
+def test_split_on_semicolons():
+    assert split_statements('select 1; select 2;\n\nselect 3') == \
+        ['select 1', 'select 2', 'select 3']
+
+
+def test_semicolons_inside_literals_and_comments():
+    script = '''
+        insert into t values ('a;b', 'it''s; fine');
+        select "odd;name" from t; -- trailing; comment
+        /* a; block */ select 2;
+        create function f() returns int as $body$ select 1; $body$ language sql;
+        create function g() returns int as $$ begin return 1; end $$ language plpgsql
+    '''
+    assert split_statements(script) == [
+        "insert into t values ('a;b', 'it''s; fine')",
+        'select "odd;name" from t',
+        '-- trailing; comment\n        /* a; block */ select 2',
+        'create function f() returns int as $body$ select 1; $body$ language sql',
+        'create function g() returns int as $$ begin return 1; end $$ language plpgsql',
+    ]
+
+
+def test_split_on_new_lines():
+    script = 'select 1\n\n-- comment only\nselect 2\n'
+    assert split_statements(script) == ['select 1', 'select 2']
+    assert split_statements(script, 'auto') == ['select 1', 'select 2']
+
+
+def test_single_statement_with_a_semicolon():
+    assert split_statements('select 1;\n') == ['select 1']
+
+
+def test_explicit_delimiter():
+    script = 'select 1;\nselect 2'
+    assert split_statements(script, 'newline') == ['select 1;', 'select 2']
+    assert split_statements(script, 'semicolon') == ['select 1', 'select 2']
+
+
+@pytest.mark.parametrize('statement', [
+    'select * from t',
+    'SELECT updated_at, created_at FROM t',
+    'with recent as (select * from t) select count(*) from recent',
+    '-- comment\nselect 1',
+    'explain select * from t',
+])
+def test_read_only(statement):
+    assert is_read_only(statement)
+
+
+@pytest.mark.parametrize('statement', [
+    'update t set a = 1',
+    'insert into t values (1)',
+    'with gone as (delete from t returning *) select * from gone',
+    "select cdb_cartodbfytable('t')",
+    'select * into copy from t',
+    'explain analyze select 1',
+    'drop table t',
+])
+def test_writes(statement):
+    assert not is_read_only(statement)
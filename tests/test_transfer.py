@@ -0,0 +1,52 @@
+import pytest
+
+from carto_cli.carto import transfer
+from carto_cli.carto.carto_user import CARTOUser
+
+INDEXES = [
+    ('bench_pkey', 'CREATE UNIQUE INDEX bench_pkey ON public.bench USING btree (cartodb_id)'),
+    ('bench_the_geom_idx', 'CREATE INDEX bench_the_geom_idx ON public.bench USING gist (the_geom)'),
+    ('bench_name_idx', 'CREATE INDEX bench_name_idx ON public.bench USING btree (name)'),
+    ('by_day', 'CREATE INDEX by_day ON public.bench USING btree (date(updated_at))'),
+]
+
+
+class FakeIndexes(object):
+    user_name = 'bench'
+    org_name = None
+
+    def execute_sql(self, sql):
+        return {'rows': [{'index_name': name, 'definition': definition}
+                         for name, definition in INDEXES]}
+
+
+def test_cartodbfied_indexes_left_to_cartodbfy():
+    assert transfer.index_statements(FakeIndexes(), 'bench', 'bench_copy') == [
+        'CREATE INDEX ON "bench_copy" USING btree (name)',
+        'CREATE INDEX ON "bench_copy" USING btree (date(updated_at))',
+    ]
+
+
+def test_all_indexes_without_cartodbfy():
+    assert transfer.index_statements(FakeIndexes(), 'bench', 'bench', cartodbfy=False) == [
+        'CREATE UNIQUE INDEX ON "bench" USING btree (cartodb_id)',
+        'CREATE INDEX ON "bench" USING gist (the_geom)',
+        'CREATE INDEX ON "bench" USING btree (name)',
+        'CREATE INDEX ON "bench" USING btree (date(updated_at))',
+    ]
+
+
+@pytest.mark.parametrize('other, same', [
+    (CARTOUser(user_name='bench'), True),
+    (CARTOUser(user_name='bench', api_url='https://bench.carto.com/api'), True),
+    (CARTOUser(user_name='bench', org_name='team'), False),
+    (CARTOUser(user_name='bench', api_url='https://carto.example.com/user/bench/'), False),
+    (CARTOUser(user_name='other'), False),
+])
+def test_same_account(other, same):
+    assert transfer.same_account(CARTOUser(user_name='bench', api_key='a'), other) is same
+
+
+def test_copy_onto_itself():
+    with pytest.raises(Exception, match='onto itself'):
+        transfer.copy_table(CARTOUser(user_name='bench'), CARTOUser(user_name='bench'), 'bench')